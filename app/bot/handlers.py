@@ -1,7 +1,10 @@
+import asyncio
+import io
 import logging
 import re
+import time
 from datetime import datetime
-from telegram import Update
+from telegram import PhotoSize, Update
 from telegram.ext import (
     ContextTypes, CommandHandler, MessageHandler, filters,
     ConversationHandler, CallbackQueryHandler
@@ -9,13 +12,21 @@ from telegram.ext import (
 
 from app.bot.keyboards import (
     get_transaction_type_keyboard, get_confirmation_keyboard,
-    get_editing_keyboard, get_restart_keyboard
+    get_editing_keyboard, get_restart_keyboard, get_duplicate_keyboard
 )
-from app.services.vision_ocr import recognize_text
-from app.services.data_parser import (
-    parse_transaction_data, parse_multiple_transactions
+from app.bot.session_store import SharedConversationHandler, session_store
+from app.services.vision_ocr import recognize_text, recognize_texts
+from app.services.ocr_cache import ocr_cache, file_cache_key
+from app.services.image_preprocessing import (
+    select_photo_size, prepare_image_for_ocr, estimate_photo_memory
 )
-from app.services.sheets_client import write_transaction
+from app.services.photo_admission import photo_admission, AdmissionRejected
+from app.services.safe_parser import (
+    parse_transaction_data_safe, parse_multiple_transactions_safe
+)
+from app.services.sheets_journal import enqueue_transactions
+from app.services.ledger import ledger, normalize_pet_name
+from app.services.receipt_index import receipt_index
 from config.settings import settings
 
 logging.basicConfig(
@@ -42,14 +53,26 @@ def build_summary_text(data: dict) -> str:
         date = data.get('date', '...')
         
         for tx in data['transactions']:
-            summary_parts = [
-                "Тип: 📈 *Доход*",
-                f"Подопечный: *{pet_name}*",
-                f"Дата: *{date}*",
-                f"Сумма: *{tx.get('amount', '...')} ₽*",
-                f"Банк: *{tx.get('bank', '...')}*",
-                f"Отправитель: *{tx.get('author', '...')}*"
-            ]
+            # Записи из альбома несут свой тип и дату, записи со скриншота транзакций — нет
+            tx_date = tx.get('date') or date
+            if tx.get('type') == 'expense':
+                summary_parts = [
+                    "Тип: 🛍️ *Расход*",
+                    f"Подопечный: *{pet_name}*",
+                    f"Дата: *{tx_date}*",
+                    f"Сумма: *{tx.get('amount', '...')} ₽*",
+                    f"Назначение: *{tx.get('procedure', '...')}*",
+                    f"Поставщик: *{tx.get('author', '...')}*"
+                ]
+            else:
+                summary_parts = [
+                    "Тип: 📈 *Доход*",
+                    f"Подопечный: *{pet_name}*",
+                    f"Дата: *{tx_date}*",
+                    f"Сумма: *{tx.get('amount', '...')} ₽*",
+                    f"Банк: *{tx.get('bank', '...')}*",
+                    f"Отправитель: *{tx.get('author', '...')}*"
+                ]
             summaries.append("\n".join(summary_parts))
         
         final_summary = "\n\n---\n\n".join(summaries)
@@ -149,11 +172,39 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     help_text = (
         "Чем могу помочь? 😼\n\n"
         "➡️ *Начать новую запись* — отправьте команду /start.\n"
-        "➡️ *Прервать операцию* — отправьте /cancel в любой момент.\n\n"
+        "➡️ *Прервать операцию* — отправьте /cancel в любой момент.\n"
+        "➡️ *Узнать остаток по подопечному* — /balance и имя, например `/balance Мурзик`.\n\n"
         "Я умею распознавать данные с фото чеков и скриншотов, чтобы вам не пришлось вводить всё вручную."
     )
     await update.message.reply_text(help_text, parse_mode='Markdown')
 
+def _format_money(amount: float) -> str:
+    return f"{amount:,.2f}".replace(',', ' ').replace('.', ',') + " ₽"
+
+async def balance_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """/balance <имя> — остаток по подопечному из локального учёта, без обращения к таблице."""
+    pet_name = ' '.join(context.args or [])
+    if not pet_name.strip():
+        await update.message.reply_text(
+            "Напишите имя подопечного после команды, например: `/balance Мурзик`", parse_mode='Markdown'
+        )
+        return
+
+    totals = ledger.balance(pet_name)
+    if totals is None:
+        await update.message.reply_text(f"По «{normalize_pet_name(pet_name)}» пока нет записей в таблице.")
+        return
+
+    month_label = datetime.strptime(totals['month'], "%Y-%m").strftime("%m.%Y")
+    await update.message.reply_text(
+        f"💰 *{totals['pet_name']}*\n\n"
+        f"Остаток: *{_format_money(totals['balance'])}*\n"
+        f"Всего пришло: {_format_money(totals['income'])}\n"
+        f"Всего потрачено: {_format_money(totals['expense'])}\n\n"
+        f"За {month_label}: +{_format_money(totals['month_income'])} / −{_format_money(totals['month_expense'])}",
+        parse_mode='Markdown'
+    )
+
 async def handle_invalid_input(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if update.message:
         await update.message.reply_text(
@@ -184,15 +235,59 @@ async def handle_pet(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     )
     return STATE_AWAITING_PHOTO
 
+def _is_ocr_failure(recognized_text: str | None) -> bool:
+    return not recognized_text or recognized_text.startswith("Ошибка")
+
+async def _download_for_ocr(photo) -> bytes:
+    photo_file = await photo.get_file()
+    buffer = io.BytesIO()
+    await photo_file.download_to_memory(buffer)
+    return await prepare_image_for_ocr(buffer)
+
+def _queue_notifier(update: Update):
+    """Сообщает пользователю его место в очереди, если фото придётся подождать."""
+    async def notify(position: int) -> None:
+        try:
+            await update.message.reply_text(
+                f"Сейчас много фото 📬 Ваше в очереди, позиция {position}. Изучу его, как только освобожусь!"
+            )
+        except Exception as e:
+            logger.warning(f"Не удалось сообщить позицию в очереди: {e}")
+    return notify
+
+BUSY_TEXT = "Сейчас очень много фото 🙈 Пришлите, пожалуйста, это ещё раз через пару минут."
+
 async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    if update.message.media_group_id:
+        state = await _handle_album(update, context)
+    else:
+        state = await _handle_single_photo(update, context)
+
+    # Фото другого альбома, присланные, пока шла обработка, никто не соберёт
+    if session_store.discard_album_photos(update.effective_chat.id):
+        await update.message.reply_text(
+            "Пока я изучал предыдущее фото, пришли ещё снимки — пришлите их, пожалуйста, ещё раз 🙏"
+        )
+    return state
+
+async def _handle_single_photo(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     await update.message.reply_text("Отличное фото! 🧐 Дайте мне пару секунд, я его изучу...")
 
     try:
-        photo_file = await update.message.photo[-1].get_file()
-        image_bytes = await photo_file.download_as_bytearray()
-        recognized_text = await recognize_text(bytes(image_bytes))
+        photo = select_photo_size(update.message.photo)
+        # Повторно присланный скриншот берём из кэша, не скачивая его заново
+        photo_key = file_cache_key(photo.file_unique_id)
+        recognized_text = ocr_cache.get(photo_key)
+        if recognized_text is None:
+            # Скачивание и OCR — только после допуска: число фото и их объём в памяти ограничены
+            async with photo_admission.admit(estimate_photo_memory(photo), _queue_notifier(update)):
+                image_bytes = await _download_for_ocr(photo)
+                recognized_text = await recognize_text(image_bytes, cache_key=photo_key, with_layout=True)
+                del image_bytes
+        else:
+            logger.info("Фото уже распознавалось ранее, используем результат из кэша.")
 
-        if not recognized_text or recognized_text.startswith("Ошибка"):
+        if _is_ocr_failure(recognized_text):
             logger.warning("OCR не смог распознать текст.", extra={'ocr_result': recognized_text})
             await update.message.reply_text(
                 "Ой, не могу разобрать текст на фото. 😔 Попробуйте, пожалуйста, сделать снимок почётче или при другом освещении."
@@ -205,7 +300,7 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
         transaction_type = ud.get('type')
         
         if transaction_type == 'transaction':
-            transactions = parse_multiple_transactions(recognized_text)
+            transactions = await parse_multiple_transactions_safe(recognized_text)
             if not transactions:
                 await update.message.reply_text(
                     "К сожалению, не удалось найти транзакций на этом скриншоте. Попробуйте другой или выберите тип 'Доход' для одиночной записи."
@@ -216,13 +311,17 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
             ud['date'] = datetime.now().strftime("%d.%m.%Y")
         
         else:
-            parsed_data = parse_transaction_data(recognized_text, transaction_type)
+            parsed_data = await parse_transaction_data_safe(recognized_text, transaction_type)
             ud.update(parsed_data)
 
 
         await _show_summary(update, context, "Готово! ✨ Вот что мне удалось распознать:")
         return STATE_CONFIRMATION
 
+    except AdmissionRejected as e:
+        logger.warning(f"Фото не принято в обработку: {e}")
+        await update.message.reply_text(BUSY_TEXT)
+        return STATE_AWAITING_PHOTO
     except Exception as e:
         logger.error(f"Критическая ошибка в handle_photo: {e}", exc_info=True)
         await update.message.reply_text(
@@ -230,77 +329,159 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
         )
         return STATE_AWAITING_PHOTO
 
+async def _handle_album(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """
+    Обрабатывает альбом (media group) целиком: собирает все фото, пока они приходят
+    чаще, чем раз в settings.album_collect_window секунд, распознаёт их одним
+    batch-запросом к Vision и показывает одно общее подтверждение.
+    Остальные фото альбома приходят в collect_album_photo (в любом воркере) и ждут
+    в общем хранилище, пока этот обработчик их не заберёт.
+    """
+    ud = context.user_data
+    chat_id = update.effective_chat.id
+    media_group_id = update.message.media_group_id
+    photos = [select_photo_size(update.message.photo)]
+    await update.message.reply_text("Вижу альбом! 📚 Соберу все фото и изучу их разом...")
+
+    try:
+        last_photo_at = time.time()
+        while time.time() - last_photo_at < settings.album_collect_window:
+            await asyncio.sleep(settings.album_collect_window)
+            last_photo_at = max(last_photo_at, session_store.album_last_photo_at(chat_id, media_group_id) or 0)
+        photos += [
+            PhotoSize.de_json(photo, context.bot)
+            for photo in session_store.take_album_photos(chat_id, media_group_id)
+        ]
+        logger.info(f"Альбом {media_group_id} собран: {len(photos)} фото.")
+
+        photo_keys = [file_cache_key(photo.file_unique_id) for photo in photos]
+        recognized_texts = [ocr_cache.get(key) for key in photo_keys]
+        missing = [i for i, text in enumerate(recognized_texts) if text is None]
+        if missing:
+            album_cost = sum(estimate_photo_memory(photos[i]) for i in missing)
+            async with photo_admission.admit(album_cost, _queue_notifier(update)):
+                images = await asyncio.gather(*(_download_for_ocr(photos[i]) for i in missing))
+                batch_texts = await recognize_texts(list(images), [photo_keys[i] for i in missing])
+                del images
+            for i, text in zip(missing, batch_texts):
+                recognized_texts[i] = text
+
+        good_texts = [text for text in recognized_texts if not _is_ocr_failure(text)]
+        if not good_texts:
+            logger.warning("OCR не смог распознать ни одного фото из альбома.")
+            await update.message.reply_text(
+                "Ой, не могу разобрать текст ни на одном фото из альбома. 😔 Попробуйте, пожалуйста, сделать снимки почётче."
+            )
+            return STATE_AWAITING_PHOTO
+
+        transaction_type = ud.get('type')
+        transactions = []
+        for recognized_text in good_texts:
+            if transaction_type == 'transaction':
+                transactions.extend(await parse_multiple_transactions_safe(recognized_text))
+            else:
+                parsed_data = await parse_transaction_data_safe(recognized_text, transaction_type)
+                parsed_data['type'] = transaction_type
+                transactions.append(parsed_data)
+
+        if not transactions:
+            await update.message.reply_text(
+                "К сожалению, не удалось найти транзакций на фото из альбома. Попробуйте другие снимки."
+            )
+            return STATE_AWAITING_PHOTO
+
+        ud['transactions'] = transactions
+        ud['date'] = datetime.now().strftime("%d.%m.%Y")
+
+        prefix = f"Готово! ✨ Распознал {len(good_texts)} из {len(photos)} фото из альбома:"
+        await _show_summary(update, context, prefix)
+        return STATE_CONFIRMATION
+
+    except AdmissionRejected as e:
+        logger.warning(f"Альбом не принят в обработку: {e}")
+        await update.message.reply_text(BUSY_TEXT)
+        return STATE_AWAITING_PHOTO
+    except Exception as e:
+        logger.error(f"Критическая ошибка в _handle_album: {e}", exc_info=True)
+        await update.message.reply_text(
+            "Упс, что-то пошло не так во время обработки альбома. 😵‍💫 Попробуйте, пожалуйста, отправить его ещё раз."
+        )
+        return STATE_AWAITING_PHOTO
+
+async def collect_album_photo(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Принимает фото, пока предыдущее фото или альбом ещё обрабатываются. Фото альбома
+    откладываются в общее хранилище: альбом может собирать другой воркер.
+    """
+    if update.message.media_group_id:
+        session_store.add_album_photo(
+            update.effective_chat.id, update.message.media_group_id,
+            select_photo_size(update.message.photo).to_dict()
+        )
+        return
+
+    await update.message.reply_text("Я ещё изучаю предыдущее фото, подождите немного, пожалуйста 🙏")
+
 async def handle_confirmation(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     await query.answer()
     action = query.data
     ud = context.user_data
 
-    if action == 'save':
-        await query.edit_message_text("Минутку, сохраняю данные в таблицу... ⏳")
-        
+    if action in ('save', 'save_anyway'):
+        pet_name = ud.get('pet_name', 'хвостик')
         if 'transactions' in ud:
-            sheet_link = None
-            pet_name = ud.get('pet_name', 'хвостик')
-            success_count = 0
-            
-            for tx_data in ud['transactions']:
-                full_transaction_data = {
+            full_transactions = [
+                {
                     'pet_name': ud.get('pet_name'),
-                    'date': ud.get('date'),
-                    'type': 'income',
+                    'date': tx_data.get('date') or ud.get('date'),
+                    'type': tx_data.get('type', 'income'),
                     'amount': tx_data.get('amount'),
                     'bank': tx_data.get('bank'),
+                    'procedure': tx_data.get('procedure'),
                     'author': tx_data.get('author'),
-                    'comment': ud.get('comment', '')
+                    'comment': ud.get('comment') or tx_data.get('comment') or ''
                 }
-                
-                try:
-                    sheet_link = write_transaction(full_transaction_data)
-                    if sheet_link:
-                        success_count += 1
-                except Exception as e:
-                    logger.error(f"Ошибка при записи в Google Sheets (мульти-транзакция): {e}", exc_info=True)
-            
-            if success_count > 0 and sheet_link:
-                success_message = (
-                    f"✅ *Успех!* Записи ({success_count} шт.) для *{pet_name}* добавлены в таблицу.\n\n"
-                    f"🔗 [Посмотреть записи в таблице]({sheet_link})"
-                )
+                for tx_data in ud['transactions']
+            ]
+        else:
+            full_transactions = [dict(ud)]
+
+        # Проверка по локальному индексу отпечатков, без чтения таблицы
+        if action == 'save':
+            duplicates = receipt_index.find_duplicates(full_transactions)
+            if duplicates:
+                if 'transactions' in ud:
+                    numbers = ', '.join(str(index + 1) for index in duplicates)
+                    warning = f"⚠️ Похоже, записи №{numbers} уже были сохранены раньше."
+                else:
+                    warning = "⚠️ Похоже, такая запись уже была сохранена раньше."
                 await query.edit_message_text(
-                    success_message, parse_mode='Markdown',
-                    disable_web_page_preview=True, reply_markup=get_restart_keyboard()
+                    f"{warning} Сохранить ещё раз?\n\n{build_summary_text(ud)}",
+                    reply_markup=get_duplicate_keyboard(), parse_mode='Markdown'
                 )
-                return STATE_DONE
-            else:
-                error_text = "❌ Не удалось сохранить данные. Что-то пошло не так с таблицей. Пожалуйста, попробуйте снова."
-                await query.edit_message_text(error_text, reply_markup=get_restart_keyboard())
-                
-        else: 
-            try:
-                sheet_link = write_transaction(context.user_data)
-                if sheet_link:
-                    pet_name = context.user_data.get('pet_name', 'хвостик')
-                    success_message = (
-                        f"✅ *Успех!* Запись для *{pet_name}* добавлена в таблицу.\n\n"
-                        f"🔗 [Посмотреть запись в таблице]({sheet_link})"
-                    )
-                    await query.edit_message_text(
-                        success_message, parse_mode='Markdown',
-                        disable_web_page_preview=True, reply_markup=get_restart_keyboard()
-                    )
-                    return STATE_DONE
-                else:
-                    error_text = "❌ Не удалось сохранить данные. Что-то пошло не так с таблицей. Пожалуйста, попробуйте снова."
-                    await query.edit_message_text(error_text)
+                return STATE_CONFIRMATION
 
-            except Exception as e:
-                logger.error(f"Ошибка при записи в Google Sheets: {e}", exc_info=True)
-                error_text = "❌ Ошибка при сохранении. Пожалуйста, свяжитесь с администратором."
-                await query.edit_message_text(error_text)
-
-        context.user_data.clear()
-        return ConversationHandler.END
+        # Запись фиксируется в локальном журнале, в таблицу её допишет фоновый воркер
+        # и пришлёт ссылку отдельным сообщением
+        try:
+            await enqueue_transactions(update.effective_chat.id, full_transactions)
+        except Exception as e:
+            logger.error(f"Ошибка при сохранении в журнал записей: {e}", exc_info=True)
+            error_text = "❌ Ошибка при сохранении. Пожалуйста, свяжитесь с администратором."
+            await query.edit_message_text(error_text)
+            context.user_data.clear()
+            return ConversationHandler.END
+
+        if len(full_transactions) > 1:
+            accepted = f"Записи ({len(full_transactions)} шт.) для *{pet_name}* приняты"
+        else:
+            accepted = f"Запись для *{pet_name}* принята"
+        await query.edit_message_text(
+            f"✅ *Готово!* {accepted}. Пришлю ссылку на таблицу, как только всё будет записано.",
+            parse_mode='Markdown', reply_markup=get_restart_keyboard()
+        )
+        return STATE_DONE
 
     elif action == 'edit':
         if 'transactions' in ud:
@@ -393,7 +574,10 @@ async def handle_comment(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     return STATE_CONFIRMATION
 
 def setup_handlers():
-    conv_handler = ConversationHandler(
+    # Состояние диалога хранится в общем хранилище: шаги одной записи может обработать любой воркер
+    conv_handler = SharedConversationHandler(
+        name='receipt',
+        session_store=session_store,
         entry_points=[CommandHandler('start', start), CallbackQueryHandler(start, pattern='^restart_flow$')],
         states={
             STATE_AWAITING_TYPE: [
@@ -403,10 +587,15 @@ def setup_handlers():
                 MessageHandler(filters.TEXT & ~filters.COMMAND, handle_pet)
             ],
             STATE_AWAITING_PHOTO: [
-                MessageHandler(filters.PHOTO, handle_photo)
+                # Неблокирующий обработчик: пока он ждёт остальные фото альбома,
+                # они попадают в состояние WAITING
+                MessageHandler(filters.PHOTO, handle_photo, block=False)
+            ],
+            ConversationHandler.WAITING: [
+                MessageHandler(filters.PHOTO, collect_album_photo)
             ],
             STATE_CONFIRMATION: [
-                CallbackQueryHandler(handle_confirmation, pattern='^(save|edit|add_comment|cancel)$')
+                CallbackQueryHandler(handle_confirmation, pattern='^(save|save_anyway|edit|add_comment|cancel)$')
             ],
             STATE_EDITING_CHOICE: [
                 CallbackQueryHandler(handle_editing_choice, pattern='^edit_')
@@ -430,5 +619,7 @@ def setup_handlers():
     )
 
     help_handler = CommandHandler('help', help_command)
+    # Регистрируется раньше диалога, чтобы работать и посреди него
+    balance_handler = CommandHandler('balance', balance_command)
 
-    return conv_handler, help_handler
\ No newline at end of file
+    return conv_handler, help_handler, balance_handler
\ No newline at end of file
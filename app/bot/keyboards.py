@@ -21,6 +21,14 @@ def get_confirmation_keyboard() -> InlineKeyboardMarkup:
     ]
     return InlineKeyboardMarkup(keyboard)
 
+def get_duplicate_keyboard() -> InlineKeyboardMarkup:
+    keyboard = [
+        [InlineKeyboardButton("💾 Всё равно сохранить", callback_data="save_anyway")],
+        [InlineKeyboardButton("✍️ Изменить данные", callback_data="edit")],
+        [InlineKeyboardButton("🚫 Отменить операцию", callback_data="cancel")],
+    ]
+    return InlineKeyboardMarkup(keyboard)
+
 def get_editing_keyboard(transaction_data: dict) -> InlineKeyboardMarkup:
     keyboard = []
     
@@ -0,0 +1,75 @@
+"""
+Доступ к внутреннему устройству ConversationHandler из python-telegram-bot.
+
+SharedConversationHandler'у нужны словарь состояний диалогов (_conversations), ключ
+диалога (_get_key) и PendingState неблокирующих обработчиков — публичного API для них нет.
+Всё обращение к закрытым частям PTB собрано здесь и проверено только на версиях из
+SUPPORTED_PTB_VERSIONS (версия закреплена в requirements.txt); на другой версии бот
+не запустится, пока этот модуль не сверят с новым ConversationHandler.
+"""
+import telegram
+from telegram.ext import ConversationHandler
+
+SUPPORTED_PTB_VERSIONS = ("21.7",)
+
+
+def check_ptb_version() -> None:
+    if telegram.__version__ not in SUPPORTED_PTB_VERSIONS:
+        raise RuntimeError(
+            f"python-telegram-bot {telegram.__version__} не проверен с общим хранилищем диалогов "
+            f"(поддерживаются: {', '.join(SUPPORTED_PTB_VERSIONS)}). Сверьте app/bot/ptb_internals.py "
+            f"с новым ConversationHandler и обновите SUPPORTED_PTB_VERSIONS."
+        )
+
+
+check_ptb_version()
+
+from telegram.ext._handlers.conversationhandler import PendingState  # noqa: E402
+
+
+def conversation_key(handler: ConversationHandler, update: object) -> tuple:
+    return handler._get_key(update)
+
+
+def check_result_key(check_result: tuple) -> tuple:
+    """Ключ диалога из результата check_update: (состояние, ключ, обработчик, результат проверки)."""
+    return check_result[1]
+
+
+def get_state(handler: ConversationHandler, key: tuple) -> object:
+    """Состояние диалога: номер состояния, PendingState или None, если диалога нет."""
+    return handler._conversations.get(key)
+
+
+def set_state(handler: ConversationHandler, key: tuple, state: object) -> None:
+    """Подставляет состояние диалога; None — диалог завершён."""
+    if state is None:
+        handler._conversations.pop(key, None)
+    else:
+        handler._conversations[key] = state
+
+
+def is_pending(state: object) -> bool:
+    """Неблокирующий обработчик ещё работает."""
+    return isinstance(state, PendingState) and not state.done()
+
+
+def is_resolved_pending(state: object) -> bool:
+    return isinstance(state, PendingState) and state.done()
+
+
+def pending_old_state(state: object) -> object:
+    """Состояние, в котором диалог был до запуска неблокирующего обработчика."""
+    return state.old_state
+
+
+def on_pending_done(state: object, callback) -> None:
+    state.task.add_done_callback(lambda _: callback())
+
+
+def resolve_pending(state: object) -> object:
+    """Итоговое состояние завершившегося обработчика (как его вычисляет ConversationHandler)."""
+    task = state.task
+    if task.cancelled() or task.exception() or task.result() is None:
+        return state.old_state
+    return task.result()
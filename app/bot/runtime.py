@@ -0,0 +1,147 @@
+import asyncio
+import logging
+import os
+
+from telegram import Update
+from telegram.ext import Application
+
+from config.settings import settings
+from app.bot.handlers import setup_handlers
+from app.bot.update_processor import ChatOrderedUpdateProcessor
+from app.bot.session_store import session_store
+from app.services.vision_ocr import get_ocr_stats
+from app.services.ocr_cache import ocr_cache
+from app.services.ocr_engines import get_ocr_engine
+from app.services.photo_admission import photo_admission
+from app.services.google_quota import quota_scheduler
+from app.services.sheets_client import sheets_client
+from app.services.sheets_journal import sheets_journal, sheets_writer
+from app.services.ledger import run_reconciliation
+from app.services.safe_parser import get_parser_stats, start_parser_pool, shutdown_parser_pool
+from app.services.startup_timing import startup_timer
+
+logger = logging.getLogger(__name__)
+
+# Проверяем наличие файла с ключами доступа Google
+if not os.path.exists("credentials.json"):
+    logger.critical("Файл credentials.json не найден в корне проекта! Доступ к Google API невозможен.")
+
+# --- Инициализация Telegram-бота ---
+try:
+    with startup_timer.measure("clients", "telegram.Application"):
+        # Разные чаты обрабатываются параллельно, сообщения одного чата — по порядку
+        update_processor = ChatOrderedUpdateProcessor(
+            settings.bot_max_concurrent_updates, settings.bot_max_pending_updates
+        )
+        ptb_app_builder = Application.builder().token(settings.telegram_token).concurrent_updates(update_processor)
+        ptb_app = ptb_app_builder.build()
+
+        # Регистрация обработчиков
+        conv_handler, help_handler, balance_handler = setup_handlers()
+        ptb_app.add_handler(balance_handler)
+        ptb_app.add_handler(conv_handler)
+        ptb_app.add_handler(help_handler)
+
+    logger.info("Бот и обработчики успешно инициализированы")
+except Exception as e:
+    logger.critical(f"Критическая ошибка инициализации бота: {e}", exc_info=True)
+    raise
+
+_reconciliation_task: asyncio.Task | None = None
+
+
+def get_webhook_url() -> str:
+    webhook_url = os.getenv("RENDER_EXTERNAL_URL", "") + "/webhook"
+    if webhook_url and not webhook_url.startswith("http"):
+        webhook_url = f"https://{webhook_url}"
+    return webhook_url
+
+
+async def start_bot() -> None:
+    """Запускает бота и фоновые сервисы."""
+    global _reconciliation_task
+    start_parser_pool()
+    if settings.storage_backend == "sheets":
+        sheets_client.start()
+
+    # На Render используем вебхуки вместо polling
+    webhook_url = get_webhook_url()
+    if webhook_url and "render.com" in webhook_url:
+        logger.info(f"Настройка вебхука для Render: {webhook_url}")
+        with startup_timer.measure("clients", "telegram.initialize"):
+            await ptb_app.initialize()
+            await ptb_app.bot.set_webhook(webhook_url, secret_token=settings.telegram_webhook_secret or None)
+        await ptb_app.start()
+        logger.info("Бот успешно запущен в режиме вебхука")
+    else:
+        # Локальная разработка с polling
+        logger.info("Запуск Telegram-бота в режиме polling (локальная разработка)...")
+        with startup_timer.measure("clients", "telegram.initialize"):
+            await ptb_app.initialize()
+        await ptb_app.start()
+        if ptb_app.updater:
+            await ptb_app.updater.start_polling()
+        logger.info("Бот успешно запущен в режиме polling")
+
+    sheets_writer.start(ptb_app.bot)
+    _reconciliation_task = asyncio.create_task(run_reconciliation())
+
+
+async def prewarm_clients() -> None:
+    """Создаёт OCR-клиент заранее, чтобы первое фото не ждало импорта google.cloud.vision."""
+    try:
+        await asyncio.to_thread(get_ocr_engine)
+    except Exception as e:
+        logger.warning(f"Не удалось заранее создать OCR-движок: {e}")
+
+
+async def stop_bot() -> None:
+    """Останавливает бота и фоновые сервисы."""
+    if _reconciliation_task is not None:
+        _reconciliation_task.cancel()
+    # Сначала дописываем журнал в таблицу: воркеру нужны и клиент Sheets, и бот для уведомлений
+    await sheets_writer.stop()
+    logger.info("Остановка Telegram-бота...")
+    try:
+        if ptb_app.updater and ptb_app.updater.running:
+            await ptb_app.updater.stop()
+        if ptb_app.running:
+            await ptb_app.stop()
+        await ptb_app.shutdown()
+        logger.info("Бот успешно остановлен")
+    except Exception as e:
+        logger.error(f"Ошибка при остановке бота: {e}", exc_info=True)
+    shutdown_parser_pool()
+    await sheets_client.stop()
+    sheets_journal.close()
+    session_store.close()
+
+
+async def enqueue_update(data: dict) -> None:
+    """Ставит обновление из вебхука в очередь приложения, не дожидаясь его обработки."""
+    update = Update.de_json(data, ptb_app.bot)
+    update_processor.mark_received(update)
+    await ptb_app.update_queue.put(update)
+
+
+async def set_webhook(webhook_url: str) -> bool:
+    return await ptb_app.bot.set_webhook(webhook_url, secret_token=settings.telegram_webhook_secret or None)
+
+
+async def get_status() -> dict:
+    """Состояние вебхука и метрики сервисов для эндпоинта /."""
+    webhook_info = await ptb_app.bot.get_webhook_info()
+    return {
+        "status": "Bot is running via FastAPI",
+        "webhook_url": webhook_info.url,
+        "webhook_set": bool(webhook_info and webhook_info.url),
+        "pending_updates": webhook_info.pending_update_count if webhook_info else 0,
+        "photo_admission": photo_admission.get_stats(),
+        "ocr": get_ocr_stats(),
+        "ocr_cache": ocr_cache.get_stats(),
+        "updates": {"queue": ptb_app.update_queue.qsize(), **update_processor.get_stats()},
+        "parser": get_parser_stats(),
+        "sheets_journal": sheets_journal.get_stats(),
+        "google_quota": quota_scheduler.get_stats(),
+        "startup": startup_timer.get_report(),
+    }
@@ -0,0 +1,234 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from typing import NamedTuple
+
+from telegram import Update
+from telegram.ext import ConversationHandler
+
+from app.bot import ptb_internals
+
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+class StoredSession(NamedTuple):
+    state: object
+    user_data: dict
+    version: int
+
+
+class SessionStore:
+    """
+    Общее хранилище диалогов (SQLite в режиме WAL): состояние ConversationHandler и user_data
+    по ключу диалога. Им пользуются все воркеры uvicorn, поэтому подтверждение можно обработать
+    не в том процессе, где распознавалось фото, а незаконченные записи переживают перезапуск.
+    Запись одного обновления — одна транзакция; если состояние и данные не изменились
+    с последней записи этого процесса, в базу ничего не пишется. Запись проходит, только если
+    версия в базе та же, что этот процесс последний раз прочитал или записал.
+    Здесь же лежат фото альбомов, пришедшие в воркеры, которые альбом не собирают.
+    """
+
+    def __init__(self, path: str, ttl_seconds: float, waiting_timeout: float):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS conversation_sessions ("
+            "name TEXT NOT NULL, conversation_key TEXT NOT NULL, state TEXT, user_data TEXT NOT NULL, "
+            "version INTEGER NOT NULL, updated_at REAL NOT NULL, PRIMARY KEY (name, conversation_key))"
+        )
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(conversation_sessions)")]
+        if "resume_state" not in columns:
+            # Состояние, в которое диалог вернётся, если обработчик в WAITING так и не завершился
+            self._db.execute("ALTER TABLE conversation_sessions ADD COLUMN resume_state TEXT")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS album_photos ("
+            "chat_id INTEGER NOT NULL, media_group_id TEXT NOT NULL, photo TEXT NOT NULL, added_at REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS album_photos_chat ON album_photos(chat_id, media_group_id)")
+
+        now = time.time()
+        # Брошенные диалоги не копятся бесконечно
+        self._db.execute("DELETE FROM conversation_sessions WHERE updated_at < ?", (now - ttl_seconds,))
+        self._db.execute("DELETE FROM album_photos WHERE added_at < ?", (now - ttl_seconds,))
+        reset = self._db.execute(
+            "UPDATE conversation_sessions SET state = resume_state, resume_state = NULL, "
+            "version = version + 1, updated_at = ? WHERE state = ? AND updated_at < ?",
+            (now, json.dumps(ConversationHandler.WAITING), now - waiting_timeout),
+        ).rowcount
+        self._db.commit()
+        if reset:
+            logger.warning(f"Диалогов, зависших в обработке, возвращено в прежнее состояние: {reset}")
+        # (name, key) -> (state, user_data, version) в том виде, в каком этот процесс последний раз записал или прочитал их
+        self._last_seen: dict[tuple[str, str], tuple[str | None, str, int]] = {}
+        logger.info(f"Хранилище диалогов: {path}")
+
+    @staticmethod
+    def _encode_key(key: tuple) -> str:
+        return json.dumps(list(key))
+
+    def load(self, name: str, key: tuple) -> StoredSession | None:
+        encoded_key = self._encode_key(key)
+        with self._lock:
+            row = self._db.execute(
+                "SELECT state, user_data, version FROM conversation_sessions "
+                "WHERE name = ? AND conversation_key = ?",
+                (name, encoded_key),
+            ).fetchone()
+            if row is None:
+                self._last_seen.pop((name, encoded_key), None)
+                return None
+            state, user_data, version = row
+            self._last_seen[(name, encoded_key)] = (state, user_data, version)
+        return StoredSession(json.loads(state) if state is not None else None, json.loads(user_data), version)
+
+    def save(
+        self, name: str, key: tuple, state: object, user_data: dict, resume_state: object = None
+    ) -> int | None:
+        """
+        Сохраняет состояние диалога (None — диалог завершён) и user_data; для WAITING —
+        ещё и resume_state, состояние до начала обработки. Возвращает новую версию или None,
+        если записывать было нечего или запись в базе успел изменить другой воркер.
+        """
+        encoded_key = self._encode_key(key)
+        encoded_state = json.dumps(state) if state is not None else None
+        encoded_resume = json.dumps(resume_state) if resume_state is not None else None
+        encoded_data = json.dumps(user_data, ensure_ascii=False, default=str)
+        with self._lock:
+            last_seen = self._last_seen.get((name, encoded_key))
+            if last_seen is not None and last_seen[:2] == (encoded_state, encoded_data):
+                return None
+            # Версия, с которой этот процесс работал; 0 — записи ещё нет
+            expected_version = last_seen[2] if last_seen is not None else 0
+            try:
+                row = self._db.execute(
+                    "INSERT INTO conversation_sessions "
+                    "(name, conversation_key, state, resume_state, user_data, version, updated_at) "
+                    "SELECT ?, ?, ?, ?, ?, 1, ? WHERE true ON CONFLICT (name, conversation_key) DO UPDATE SET "
+                    "state = excluded.state, resume_state = excluded.resume_state, user_data = excluded.user_data, "
+                    "version = version + 1, updated_at = excluded.updated_at WHERE version = ? RETURNING version",
+                    (name, encoded_key, encoded_state, encoded_resume, encoded_data, time.time(), expected_version),
+                ).fetchone()
+                self._db.commit()
+            except sqlite3.Error as e:
+                self._db.rollback()
+                logger.error(f"Не удалось сохранить диалог {encoded_key}: {e}")
+                return None
+            if row is None:
+                # Другой воркер изменил диалог после нашего чтения — его запись новее
+                self._last_seen.pop((name, encoded_key), None)
+                logger.warning(f"Диалог {encoded_key} изменён другим воркером, запись пропущена")
+                return None
+            version = row[0]
+            self._last_seen[(name, encoded_key)] = (encoded_state, encoded_data, version)
+        return version
+
+    def add_album_photo(self, chat_id: int, media_group_id: str, photo: dict) -> None:
+        """Откладывает фото альбома для воркера, который этот альбом собирает."""
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO album_photos (chat_id, media_group_id, photo, added_at) VALUES (?, ?, ?, ?)",
+                (chat_id, media_group_id, json.dumps(photo), time.time()),
+            )
+            self._db.commit()
+
+    def album_last_photo_at(self, chat_id: int, media_group_id: str) -> float | None:
+        with self._lock:
+            return self._db.execute(
+                "SELECT MAX(added_at) FROM album_photos WHERE chat_id = ? AND media_group_id = ?",
+                (chat_id, media_group_id),
+            ).fetchone()[0]
+
+    def take_album_photos(self, chat_id: int, media_group_id: str) -> list[dict]:
+        """Забирает отложенные фото альбома в порядке поступления."""
+        with self._lock:
+            rows = self._db.execute(
+                "DELETE FROM album_photos WHERE chat_id = ? AND media_group_id = ? RETURNING rowid, photo",
+                (chat_id, media_group_id),
+            ).fetchall()
+            self._db.commit()
+        return [json.loads(photo) for _, photo in sorted(rows)]
+
+    def discard_album_photos(self, chat_id: int) -> int:
+        """Удаляет фото, отложенные для чата, но никем не собранные. Возвращает их число."""
+        with self._lock:
+            count = self._db.execute("DELETE FROM album_photos WHERE chat_id = ?", (chat_id,)).rowcount
+            self._db.commit()
+        return count
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+class SharedConversationHandler(ConversationHandler):
+    """
+    ConversationHandler, который держит состояние диалога и user_data в общем SessionStore.
+    Перед выбором обработчика состояние подтягивается из хранилища, если другой воркер
+    успел его изменить; после обработки — записывается обратно. Пока неблокирующий
+    обработчик (распознавание фото) не завершился, в хранилище лежит состояние WAITING:
+    другие воркеры не начнут ту же работу заново, а фото альбома отложат в хранилище
+    для воркера, который его собирает.
+    """
+
+    def __init__(self, *args, session_store: SessionStore, **kwargs):
+        super().__init__(*args, **kwargs)
+        if not self.name:
+            raise ValueError("SharedConversationHandler требует name")
+        self._session_store = session_store
+        # Версия записи в хранилище, которую этот процесс уже видел, по ключу диалога
+        self._seen_versions: dict[tuple, int] = {}
+        # user_data, прочитанные в check_update, — применяются к context в handle_update
+        self._loaded_user_data: dict[tuple, dict] = {}
+
+    def check_update(self, update: object):
+        if (
+            isinstance(update, Update) and update.effective_chat and update.effective_user
+            and not (update.channel_post or update.edited_channel_post)
+        ):
+            self._refresh(ptb_internals.conversation_key(self, update))
+        return super().check_update(update)
+
+    def _refresh(self, key: tuple) -> None:
+        if ptb_internals.is_pending(ptb_internals.get_state(self, key)):
+            # Обработчик этого процесса ещё работает — его состояние и есть актуальное
+            return
+        stored = self._session_store.load(self.name, key)
+        if stored is None or stored.version == self._seen_versions.get(key):
+            return
+        self._seen_versions[key] = stored.version
+        ptb_internals.set_state(self, key, stored.state)
+        self._loaded_user_data[key] = stored.user_data
+
+    async def handle_update(self, update, application, check_result, context):
+        key = ptb_internals.check_result_key(check_result)
+        loaded = self._loaded_user_data.pop(key, None)
+        if loaded is not None and context.user_data is not None:
+            context.user_data.clear()
+            context.user_data.update(loaded)
+        try:
+            return await super().handle_update(update, application, check_result, context)
+        finally:
+            self._persist(key, context.user_data)
+
+    def _persist(self, key: tuple, user_data: dict | None) -> None:
+        state = ptb_internals.get_state(self, key)
+        if ptb_internals.is_pending(state):
+            self._save(key, self.WAITING, user_data, resume_state=ptb_internals.pending_old_state(state))
+            ptb_internals.on_pending_done(state, lambda: self._persist(key, user_data))
+            return
+        if ptb_internals.is_resolved_pending(state):
+            state = ptb_internals.resolve_pending(state)
+        self._save(key, None if state == self.END else state, user_data)
+
+    def _save(self, key: tuple, state: object, user_data: dict | None, resume_state: object = None) -> None:
+        version = self._session_store.save(self.name, key, state, user_data or {}, resume_state)
+        if version is not None:
+            self._seen_versions[key] = version
+
+
+session_store = SessionStore(settings.session_store_path, settings.session_ttl, settings.session_waiting_timeout)
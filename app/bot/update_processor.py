@@ -0,0 +1,98 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import nullcontext
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+# Сколько последних обновлений учитывается в статистике задержки
+LAG_WINDOW = 200
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """
+    Обрабатывает обновления разных чатов параллельно (не более max_concurrent одновременно),
+    а обновления одного чата — строго по очереди, в порядке поступления: ConversationHandler
+    видит состояние диалога таким же, как при последовательной обработке.
+
+    Семафор базового класса (max_pending) ограничивает только число принятых в работу
+    обновлений; параллельность задаёт собственный семафор, который берётся уже после
+    блокировки чата, — иначе серия сообщений из одного чата заняла бы все места и ждала
+    сама себя, пока остальные чаты простаивают.
+    """
+
+    def __init__(self, max_concurrent: int, max_pending: int):
+        super().__init__(max(max_pending, max_concurrent))
+        self.max_concurrent = max_concurrent
+        self._running_slots = asyncio.BoundedSemaphore(max_concurrent)
+        # chat_id -> [блокировка, сколько обновлений чата ждут или выполняются]
+        self._chat_locks: dict[int, list] = {}
+        # update_id -> время приёма вебхуком (monotonic)
+        self._received_at: dict[int, float] = {}
+        self._lags: deque[float] = deque(maxlen=LAG_WINDOW)
+        self._waiting = 0
+        self._running = 0
+        self._processed = 0
+
+    def mark_received(self, update: Update) -> None:
+        """Запоминает время приёма обновления, чтобы посчитать задержку до начала обработки."""
+        self._received_at[update.update_id] = time.monotonic()
+
+    def _acquire_chat_lock(self, chat_id: int) -> asyncio.Lock:
+        entry = self._chat_locks.setdefault(chat_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        return entry[0]
+
+    def _release_chat_lock(self, chat_id: int) -> None:
+        entry = self._chat_locks[chat_id]
+        entry[1] -= 1
+        if entry[1] == 0:
+            del self._chat_locks[chat_id]
+
+    async def do_process_update(self, update: object, coroutine) -> None:
+        received_at = time.monotonic()
+        chat_id = None
+        if isinstance(update, Update):
+            received_at = self._received_at.pop(update.update_id, received_at)
+            if update.effective_chat:
+                chat_id = update.effective_chat.id
+
+        self._waiting += 1
+        started = False
+        chat_lock = self._acquire_chat_lock(chat_id) if chat_id is not None else nullcontext()
+        try:
+            async with chat_lock, self._running_slots:
+                self._waiting -= 1
+                started = True
+                self._running += 1
+                self._lags.append(time.monotonic() - received_at)
+                try:
+                    await coroutine
+                finally:
+                    self._running -= 1
+                    self._processed += 1
+        finally:
+            if chat_id is not None:
+                self._release_chat_lock(chat_id)
+            if not started:
+                self._waiting -= 1
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def get_stats(self) -> dict:
+        """Очередь и задержка обработки: сколько ждут, сколько выполняются, сколько ждали последние."""
+        lags = list(self._lags)
+        return {
+            "max_concurrent": self.max_concurrent,
+            "waiting": self._waiting,
+            "running": self._running,
+            "active_chats": len(self._chat_locks),
+            "processed": self._processed,
+            "lag_avg": round(sum(lags) / len(lags), 3) if lags else 0.0,
+            "lag_max": round(max(lags), 3) if lags else 0.0,
+        }
@@ -1,6 +1,11 @@
 import re
-from datetime import datetime
+from collections import deque
+from dataclasses import dataclass
+from datetime import date, datetime
 import logging
+from typing import Iterable, Iterator
+
+from app.services.layout import LayoutIndex
 
 logger = logging.getLogger(__name__)
 
@@ -8,7 +13,7 @@ def _clean_amount_string(s: str) -> float | None:
     if not isinstance(s, str):
         return None
     try:
-        cleaned = re.sub(r'[^\d,.]', '', s)
+        cleaned = _NON_AMOUNT_CHARS_RE.sub('', s)
         cleaned = cleaned.replace(',', '.')
         return float(cleaned)
     except (ValueError, TypeError):
@@ -17,196 +22,259 @@ def _clean_amount_string(s: str) -> float | None:
 def _normalize_text_for_search(text: str) -> str:
     if not isinstance(text, str):
         return ''
-    text = re.sub(r'[ \t]+', ' ', text)
-    text = re.sub(r'\n+', '\n', text)
+    text = _HORIZONTAL_SPACE_RE.sub(' ', text)
+    text = _MULTIPLE_NEWLINES_RE.sub('\n', text)
     return text.strip()
 
 def _clean_author_string(author: str) -> str:
     author = author.strip('.,;:"«» \n\t')
-    author = re.sub(r'^(ООО|ИП|АО|ПАО|ЗАО|ОАО)\s+', '', author, flags=re.IGNORECASE).strip()
+    author = _ORG_FORM_PREFIX_RE.sub('', author).strip()
     author = author.strip('"«»')
     if not author.endswith('.'):
         author += '.'
     return author
 
-def _get_date_patterns() -> list:
-    return [
-        {
-            'tier': 0,
-            'desc': 'Дата операции с временем (текстовая, с ключом)',
-            'regex': r'(?:Операция\s+совершена|Дата\s+операции|Товарный\sчек\s.*?за)[:\s]*(\d{1,2})\s+(января|февраля|марта|апреля|мая|июня|июля|августа|сентября|октября|ноября|декабря)\s+(\d{4})',
-            'type': 'textual_ru',
-            'flags': re.IGNORECASE
-        },
-        {
-            'tier': 0,
-            'desc': 'Дата операции с временем (числовая, с ключом)',
-            'regex': r'(?:Операция\s+совершена|Дата\s+операции)[:\s]*(\d{2}[./-]\d{2}[./-]\d{2,4})(?:\s+в\s+\d{1,2}:\d{2})?',
-            'type': 'numeric',
-            'flags': re.IGNORECASE
-        },
-        {
-            'tier': 1,
-            'desc': 'Дата рядом с суммой или переводом',
-            'regex': r'(?:Перевод|Зачисление|Списание)\s+от?\s*(\d{1,2})\s+(января|февраля|марта|апреля|мая|июня|июля|августа|сентября|октября|ноября|декабря)\s+(\d{4})',
-            'type': 'textual_ru',
-            'flags': re.IGNORECASE
-        },
-        {
-            'tier': 1,
-            'desc': 'Дата рядом с суммой или переводом (числовая)',
-            'regex': r'(?:Перевод|Зачисление|Списание)\s+от?\s*(\d{2}[./-]\d{2}[./-]\d{2,4})',
-            'type': 'numeric',
-            'flags': re.IGNORECASE
-        },
-        {
-            'tier': 2,
-            'desc': 'Английская дата с разделителем и временем',
-            'regex': r'(\d{1,2})\s+(January|February|March|April|May|June|July|August|September|October|November|December)\s*[•\-]\s*\d{1,2}:\d{2}',
-            'type': 'textual_en',
-            'flags': re.IGNORECASE
-        },
-        {
-            'tier': 2,
-            'desc': 'Английская дата с пробелом и временем',
-            'regex': r'(\d{1,2})\s+(January|February|March|April|May|June|July|August|September|October|November|December)\s+\d{1,2}:\d{2}',
-            'type': 'textual_en',
-            'flags': re.IGNORECASE
-        },
-        {
-            'tier': 3,
-            'desc': 'Любая дата в числовом формате (ДД.ММ.ГГГГ)',
-            'regex': r'\b(\d{2}[./-]\d{2}[./-]\d{2,4})\b',
-            'type': 'numeric',
-            'flags': 0
-        },
-        {
-            'tier': 4,
-            'desc': 'Любая дата в текстовом формате (8 октября 2025)',
-            'regex': r'(\d{1,2})\s+(января|февраля|марта|апреля|мая|июня|июля|августа|сентября|октября|ноября|декабря)\s+(\d{4})\b',
-            'type': 'textual_ru',
-            'flags': re.IGNORECASE
-        },
-        {
-            'tier': 5,
-            'desc': 'Английская дата без времени',
-            'regex': r'\b(\d{1,2})\s+(January|February|March|April|May|June|July|August|September|October|November|December)\b',
-            'type': 'textual_en',
-            'flags': re.IGNORECASE
-        },
-        {
-            'tier': 6,
-            'desc': 'Дата формирования документа',
-            'regex': r'(?:Сформировано|Создано|Дата\s+формирования).*?(\d{1,2})\s+(января|февраля|марта|апреля|мая|июня|июля|августа|сентября|октября|ноября|декабря)\s+(\d{4})',
-            'type': 'textual_ru',
-            'flags': re.IGNORECASE | re.DOTALL
-        },
-    ]
-
-def _get_amount_patterns() -> list:
-    AMOUNT_REGEX = r'(\d(?:\s?\d)*(?:[,.]\d{1,2})?)'
-    CURRENCY_REGEX = r'(?:Р|₽|руб\.?|RUB|P)'
-
-    return [
-        {'tier': 0, 'desc': 'Ключевое слово "Итого сумма чека"', 'regex': fr'(?:Итого\sсумма\sчека)\s*[:\s.]*\s*{AMOUNT_REGEX}', 'flags': re.IGNORECASE},
-        {'tier': 1, 'desc': 'Сумма с явным знаком "+" и символом валюты', 'regex': fr'\+\s*{AMOUNT_REGEX}\s*{CURRENCY_REGEX}', 'flags': re.IGNORECASE},
-        {'tier': 2, 'desc': 'Ключевое слово "Сумма/Итого/Всего/Долг" и число', 'regex': fr'(?:Сумма|Итого|Всего|К\sоплате|Пополнение|Перевод|Долг\sпосле\sоплаты)\s*[:\s.]*\s*{AMOUNT_REGEX}', 'flags': re.IGNORECASE},
-        {'tier': 3, 'desc': 'Ключевое слово на отдельной строке ВЫШЕ числа', 'regex': fr'(?:Сумма|Итого|Всего|Операция|Сумма\sв\sвалюте\sоперации)\s*\n+\s*{AMOUNT_REGEX}\s*{CURRENCY_REGEX}?', 'flags': re.IGNORECASE},
-        {'tier': 4, 'desc': 'Число с явным символом валюты', 'regex': fr'\b{AMOUNT_REGEX}\s*{CURRENCY_REGEX}\b', 'flags': re.IGNORECASE},
-        {'tier': 5, 'desc': 'Число с копейками (формат: 1234.56)', 'regex': r'\b(\d(?:\s?\d)*[,.]\d{2})\b', 'flags': 0},
-    ]
-
-def _get_bank_patterns() -> list:
-    BANK_KEYWORDS = {
-        'Т-Банк': ['т-банк', 'тбанк', 'тинькофф', 'tinkoff', 't-bank'],
-        'Сбербанк': ['сбербанк', 'сбер', 'sber', 'sberbank'],
-        'Альфа-Банк': ['альфа-банк', 'альфа', 'alfa', 'alfabank'],
-        'ВТБ': ['втб', 'vtb'],
-        'Яндекс': ['яндекс', 'yandex'],
-    }
-    patterns = []
-    for bank_name, keywords in BANK_KEYWORDS.items():
-        regex = r'\b(' + '|'.join(keywords) + r')\b'
-        patterns.append({'tier': 1, 'desc': f'Поиск по ключевым словам для "{bank_name}"', 'regex': regex, 'bank_name': bank_name, 'flags': re.IGNORECASE})
-    return patterns
+@dataclass(frozen=True, slots=True)
+class ParserPattern:
+    """Скомпилированный шаблон поиска с приоритетом (чем меньше tier, тем надёжнее)."""
+    tier: int
+    desc: str
+    regex: re.Pattern
+    # Для дат: формат найденного значения (numeric, textual_ru, textual_en)
+    kind: str | None = None
+    # Для банков: каноническое название банка
+    bank_name: str | None = None
 
-def _get_author_patterns(transaction_type: str) -> list:
-    AUTHOR_NAME_REGEX = r'([А-ЯЁ][а-яёA-Za-z\s."«»-]+?)'
+def _compile(tier: int, desc: str, regex: str, flags: int = 0, **extra) -> ParserPattern:
+    return ParserPattern(tier=tier, desc=desc, regex=re.compile(regex, flags), **extra)
 
-    if transaction_type in ['income', 'transaction']:
-        return [
-            {'tier': 1, 'desc': 'Ключ "Отправитель", "Плательщик", "От кого"', 'regex': fr'(?:Отправитель|Плательщик|От\sкого)\s*[:\s\n]*{AUTHOR_NAME_REGEX}(?=\n|$)', 'flags': re.IGNORECASE},
-            {'tier': 2, 'desc': 'Имя после слова "Описание"', 'regex': r'Описание[\s\n]+([А-ЯЁа-яё\s]+\s[А-ЯЁ]\.)', 'flags': re.IGNORECASE},
-            {'tier': 3, 'desc': 'Имя формата (Имя О.) после строки с суммой', 'regex': r'\b(?:\d[\d\s,.]*)\s*(?:Р|₽|руб\.?|RUB|P)[\s\n]+([А-ЯЁ][а-яё]+(?:\s+[А-ЯЁ][а-яё]+)?\s+[А-ЯЁ]\.)', 'flags': re.IGNORECASE},
-            {'tier': 4, 'desc': 'Английские термины: "From", "Sender"', 'regex': fr'(?:From|Sender)\s*[:\s\n]*{AUTHOR_NAME_REGEX}(?=\n|$)', 'flags': re.IGNORECASE},
-            {'tier': 5, 'desc': 'Формат "Имя О." или "Имя Отчество О."', 'regex': r'\b([А-ЯЁ][а-яё]+(?:\s+[А-ЯЁ][а-яё]+){0,2}\s+[А-ЯЁ]\.)\b', 'flags': 0},
-        ]
-    else: # expense
-        return [
-            {'tier': 0, 'desc': 'Название организации в начале документа (над адресом)', 'regex': r'^(.*?)\n\s*(?:Адрес\sклиники|Адрес)', 'flags': re.MULTILINE},
-            {'tier': 1, 'desc': 'Название в кавычках: «ООО Ромашка»', 'regex': r'[«"]([^»"]{3,})[»"]', 'flags': 0},
-            {'tier': 1, 'desc': 'Ключ "Получатель", "Продавец"', 'regex': fr'(?:Получатель|Продавец|Организация)\s*[:\s\n]*{AUTHOR_NAME_REGEX}(?=\n|$)', 'flags': re.IGNORECASE},
-            {'tier': 2, 'desc': 'Орг. форма: ООО, ИП, АО', 'regex': r'\b(?:ООО|ИП|АО|ПАО)\s+[«"]?([^»"\n]{3,40})[»"]?', 'flags': re.IGNORECASE},
-        ]
+# --- Реестр шаблонов. Компилируется один раз при импорте модуля. ---
 
-def _get_comment_patterns() -> list:
-    return [{'tier': 1, 'desc': 'Поиск по ключевым словам', 'regex': r'(?:Комментарий|Примечание|Назначение\sплатежа|Note|Comment|Description)\s*[:\s\n]*(.+?)(?=\n\n|$|\n\s*—{3,})', 'flags': re.IGNORECASE | re.DOTALL}]
+_MONTHS_RU_REGEX = r'(января|февраля|марта|апреля|мая|июня|июля|августа|сентября|октября|ноября|декабря)'
+_MONTHS_EN_REGEX = r'(January|February|March|April|May|June|July|August|September|October|November|December)'
 
-def _get_procedure_patterns() -> list:
-    return [{'tier': 1, 'desc': 'Блок текста между заголовком таблицы и итоговой суммой', 'regex': r'(?:Наименование.*?Ст-ть)\s*\n(.*?)(?=\n\s*Итого\sсумма\sчека)', 'flags': re.DOTALL | re.IGNORECASE}]
+DATE_PATTERNS: tuple[ParserPattern, ...] = (
+    _compile(0, 'Дата операции с временем (текстовая, с ключом)',
+             fr'(?:Операция\s+совершена|Дата\s+операции|Товарный\sчек\s.{{0,100}}?за)[:\s]*(\d{{1,2}})\s+{_MONTHS_RU_REGEX}\s+(\d{{4}})',
+             re.IGNORECASE, kind='textual_ru'),
+    _compile(0, 'Дата операции с временем (числовая, с ключом)',
+             r'(?:Операция\s+совершена|Дата\s+операции)[:\s]*(\d{2}[./-]\d{2}[./-]\d{2,4})(?:\s+в\s+\d{1,2}:\d{2})?',
+             re.IGNORECASE, kind='numeric'),
+    _compile(1, 'Дата рядом с суммой или переводом',
+             fr'(?:Перевод|Зачисление|Списание)\s+от?\s*(\d{{1,2}})\s+{_MONTHS_RU_REGEX}\s+(\d{{4}})',
+             re.IGNORECASE, kind='textual_ru'),
+    _compile(1, 'Дата рядом с суммой или переводом (числовая)',
+             r'(?:Перевод|Зачисление|Списание)\s+от?\s*(\d{2}[./-]\d{2}[./-]\d{2,4})',
+             re.IGNORECASE, kind='numeric'),
+    _compile(2, 'Английская дата с разделителем и временем',
+             fr'(\d{{1,2}})\s+{_MONTHS_EN_REGEX}\s*[•\-]\s*\d{{1,2}}:\d{{2}}',
+             re.IGNORECASE, kind='textual_en'),
+    _compile(2, 'Английская дата с пробелом и временем',
+             fr'(\d{{1,2}})\s+{_MONTHS_EN_REGEX}\s+\d{{1,2}}:\d{{2}}',
+             re.IGNORECASE, kind='textual_en'),
+    _compile(3, 'Любая дата в числовом формате (ДД.ММ.ГГГГ)',
+             r'\b(\d{2}[./-]\d{2}[./-]\d{2,4})\b',
+             kind='numeric'),
+    _compile(4, 'Любая дата в текстовом формате (8 октября 2025)',
+             fr'(\d{{1,2}})\s+{_MONTHS_RU_REGEX}\s+(\d{{4}})\b',
+             re.IGNORECASE, kind='textual_ru'),
+    _compile(5, 'Английская дата без времени',
+             fr'\b(\d{{1,2}})\s+{_MONTHS_EN_REGEX}\b',
+             re.IGNORECASE, kind='textual_en'),
+    # Дата формирования печатается сразу за ключевым словом; окно в 200 символов не даёт
+    # каждому повтору ключа просматривать текст до конца. Уровень нужен для дат вида
+    # «5 марта 2025г», которые уровень 4 (с \b после года) пропускает
+    _compile(6, 'Дата формирования документа',
+             fr'(?:Сформировано|Создано|Дата\s+формирования).{{0,200}}?(\d{{1,2}})\s+{_MONTHS_RU_REGEX}\s+(\d{{4}})',
+             re.IGNORECASE | re.DOTALL, kind='textual_ru'),
+)
 
-def parse_date(text: str) -> str | None:
-    patterns = _get_date_patterns()
-    MONTHS_RU = {'января': '01', 'февраля': '02', 'марта': '03', 'апреля': '04', 'мая': '05', 'июня': '06', 'июля': '07', 'августа': '08', 'сентября': '09', 'октября': '10', 'ноября': '11', 'декабря': '12'}
-    MONTHS_EN = {'january': '01', 'february': '02', 'march': '03', 'april': '04', 'may': '05', 'june': '06', 'july': '07', 'august': '08', 'september': '09', 'october': '10', 'november': '11', 'december': '12'}
+_AMOUNT_REGEX = r'(\d(?:\s?\d){0,12}(?:[,.]\d{1,2})?)'
+_CURRENCY_REGEX = r'(?:Р|₽|руб\.?|RUB|P)'
 
-    found_dates = []
-    
+AMOUNT_PATTERNS: tuple[ParserPattern, ...] = (
+    _compile(0, 'Ключевое слово "Итого сумма чека"', fr'(?:Итого\sсумма\sчека)[:\s.]{{0,10}}{_AMOUNT_REGEX}', re.IGNORECASE),
+    _compile(1, 'Сумма с явным знаком "+" и символом валюты', fr'\+\s*{_AMOUNT_REGEX}\s*{_CURRENCY_REGEX}', re.IGNORECASE),
+    _compile(2, 'Ключевое слово "Сумма/Итого/Всего/Долг" и число', fr'(?:Сумма|Итого|Всего|К\sоплате|Пополнение|Перевод|Долг\sпосле\sоплаты)[:\s.]{{0,10}}{_AMOUNT_REGEX}', re.IGNORECASE),
+    _compile(3, 'Ключевое слово на отдельной строке ВЫШЕ числа', fr'(?:Сумма|Итого|Всего|Операция|Сумма\sв\sвалюте\sоперации)[ \t]*\n\s{{0,20}}{_AMOUNT_REGEX}\s*{_CURRENCY_REGEX}?', re.IGNORECASE),
+    _compile(4, 'Число с явным символом валюты', fr'\b{_AMOUNT_REGEX}\s*{_CURRENCY_REGEX}\b', re.IGNORECASE),
+    _compile(5, 'Число с копейками (формат: 1234.56)', r'\b(\d(?:\s?\d){0,12}[,.]\d{2})\b'),
+)
+
+_BANK_KEYWORDS = {
+    'Т-Банк': ['т-банк', 'тбанк', 'тинькофф', 'tinkoff', 't-bank'],
+    'Сбербанк': ['сбербанк', 'сбер', 'sber', 'sberbank'],
+    'Альфа-Банк': ['альфа-банк', 'альфа', 'alfa', 'alfabank'],
+    'ВТБ': ['втб', 'vtb'],
+    'Яндекс': ['яндекс', 'yandex'],
+}
+
+BANK_PATTERNS: tuple[ParserPattern, ...] = tuple(
+    _compile(1, f'Поиск по ключевым словам для "{bank_name}"', r'\b(' + '|'.join(keywords) + r')\b',
+             re.IGNORECASE, bank_name=bank_name)
+    for bank_name, keywords in _BANK_KEYWORDS.items()
+)
+
+_AUTHOR_NAME_REGEX = r'([А-ЯЁ][а-яёA-Za-z\s."«»-]{1,80}?)'
+
+_INCOME_AUTHOR_PATTERNS: tuple[ParserPattern, ...] = (
+    _compile(1, 'Ключ "Отправитель", "Плательщик", "От кого"', fr'(?:Отправитель|Плательщик|От\sкого)\s*[:\s\n]*{_AUTHOR_NAME_REGEX}(?=\n|$)', re.IGNORECASE),
+    _compile(2, 'Имя после слова "Описание"', r'Описание[\s\n]+([А-ЯЁа-яё\s]+\s[А-ЯЁ]\.)', re.IGNORECASE),
+    _compile(3, 'Имя формата (Имя О.) после строки с суммой', r'\b(?:\d[\d\s,.]{0,20})(?:Р|₽|руб\.?|RUB|P)[\s\n]+([А-ЯЁ][а-яё]+(?:\s+[А-ЯЁ][а-яё]+)?\s+[А-ЯЁ]\.)', re.IGNORECASE),
+    _compile(4, 'Английские термины: "From", "Sender"', fr'(?:From|Sender)\s*[:\s\n]*{_AUTHOR_NAME_REGEX}(?=\n|$)', re.IGNORECASE),
+    _compile(5, 'Формат "Имя О." или "Имя Отчество О."', r'\b([А-ЯЁ][а-яё]+(?:\s+[А-ЯЁ][а-яё]+){0,2}\s+[А-ЯЁ]\.)\b'),
+)
+
+_EXPENSE_AUTHOR_PATTERNS: tuple[ParserPattern, ...] = (
+    _compile(0, 'Название организации в начале документа (над адресом)', r'^(.*?)\n\s*(?:Адрес\sклиники|Адрес)', re.MULTILINE),
+    _compile(1, 'Название в кавычках: «ООО Ромашка»', r'[«"]([^»"]{3,})[»"]'),
+    _compile(1, 'Ключ "Получатель", "Продавец"', fr'(?:Получатель|Продавец|Организация)\s*[:\s\n]*{_AUTHOR_NAME_REGEX}(?=\n|$)', re.IGNORECASE),
+    _compile(2, 'Орг. форма: ООО, ИП, АО', r'\b(?:ООО|ИП|АО|ПАО)\s+[«"]?([^»"\n]{3,40})[»"]?', re.IGNORECASE),
+)
+
+AUTHOR_PATTERNS: dict[str, tuple[ParserPattern, ...]] = {
+    'income': _INCOME_AUTHOR_PATTERNS,
+    'transaction': _INCOME_AUTHOR_PATTERNS,
+    'expense': _EXPENSE_AUTHOR_PATTERNS,
+}
+
+COMMENT_PATTERNS: tuple[ParserPattern, ...] = (
+    # Комментарий идёт до пустой строки или разделителя «———», но не длиннее 500 символов:
+    # в показ всё равно попадают только первые 200, а граница держит разбор линейным
+    _compile(1, 'Поиск по ключевым словам', r'(?:Комментарий|Примечание|Назначение\sплатежа|Note|Comment|Description)[:\s]*((?:(?!\n\n|\n\s*—{3,}).){1,500})', re.IGNORECASE | re.DOTALL),
+)
+
+PROCEDURE_PATTERNS: tuple[ParserPattern, ...] = (
+    # Заголовок таблицы; конец блока ищется отдельно (_PROCEDURE_END_RE) от конца заголовка —
+    # один линейный проход вместо ленивого перебора до конца текста от каждого заголовка
+    _compile(1, 'Блок текста между заголовком таблицы и итоговой суммой', r'Наименование.{0,100}?Ст-ть\s*\n', re.DOTALL | re.IGNORECASE),
+)
+_PROCEDURE_END_RE = re.compile(r'\n\s*Итого\sсумма\sчека', re.IGNORECASE)
+
+@dataclass(frozen=True, slots=True)
+class DateTier:
+    """
+    Все шаблоны дат одного приоритета, объединённые в одну альтернацию.
+    alternatives[i] = (шаблон, номер первой группы шаблона в объединённом regex).
+    """
+    tier: int
+    regex: re.Pattern
+    alternatives: tuple[tuple[ParserPattern, int], ...]
+
+def _build_date_tiers(patterns: tuple[ParserPattern, ...]) -> tuple[DateTier, ...]:
+    by_tier: dict[int, list[ParserPattern]] = {}
     for p in patterns:
-        matches = list(re.finditer(p['regex'], text, p['flags']))
-        for match in matches:
-            try:
-                dt_obj = None
-                if p.get('type') == 'textual_ru':
-                    day, month_name, year = match.groups()
-                    month = MONTHS_RU.get(month_name.lower())
-                    if month: 
-                        dt_obj = datetime.strptime(f"{day}.{month}.{year}", "%d.%m.%Y")
-
-                elif p.get('type') == 'textual_en':
-                    day, month_name = match.groups()
-                    month = MONTHS_EN.get(month_name.lower())
-                    year = datetime.now().year
-                    if month: 
-                        dt_obj = datetime.strptime(f"{day}.{month}.{year}", "%d.%m.%Y")
-
-                elif p.get('type') == 'numeric':
-                    date_str = match.group(1).replace('/', '.').replace('-', '.')
-                    parts = date_str.split('.')
-                    year_format = "%Y" if len(parts[2]) == 4 else "%y"
-                    dt_obj = datetime.strptime(date_str, f"%d.%m.{year_format}")
+        by_tier.setdefault(p.tier, []).append(p)
+
+    tiers = []
+    for tier, tier_patterns in sorted(by_tier.items()):
+        flags = tier_patterns[0].regex.flags
+        if any(p.regex.flags != flags for p in tier_patterns):
+            raise ValueError(f"Шаблоны дат уровня {tier} должны иметь одинаковые флаги")
+        alternatives = []
+        group_offset = 1
+        for p in tier_patterns:
+            alternatives.append((p, group_offset))
+            group_offset += p.regex.groups
+        combined = '|'.join(f'(?:{p.regex.pattern})' for p in tier_patterns)
+        tiers.append(DateTier(tier=tier, regex=re.compile(combined, flags), alternatives=tuple(alternatives)))
+    return tuple(tiers)
+
+DATE_TIERS: tuple[DateTier, ...] = _build_date_tiers(DATE_PATTERNS)
 
+_MONTHS_RU = {'января': 1, 'февраля': 2, 'марта': 3, 'апреля': 4, 'мая': 5, 'июня': 6, 'июля': 7, 'августа': 8, 'сентября': 9, 'октября': 10, 'ноября': 11, 'декабря': 12}
+_MONTHS_EN = {'january': 1, 'february': 2, 'march': 3, 'april': 4, 'may': 5, 'june': 6, 'july': 7, 'august': 8, 'september': 9, 'october': 10, 'november': 11, 'december': 12}
+
+_AUTHOR_STOPWORDS = ('улица', 'москва', 'россия', 'кассир', 'чек', 'документ',
+                     'операция', 'платеж', 'карта', 'счет', 'transaction', 'успешно')
+
+# Вспомогательные шаблоны очистки значений
+_NON_AMOUNT_CHARS_RE = re.compile(r'[^\d,.]')
+_HORIZONTAL_SPACE_RE = re.compile(r'[ \t]+')
+_MULTIPLE_NEWLINES_RE = re.compile(r'\n+')
+_ORG_FORM_PREFIX_RE = re.compile(r'^(ООО|ИП|АО|ПАО|ЗАО|ОАО)\s+', re.IGNORECASE)
+_ONLY_DIGITS_RE = re.compile(r'[\d\s.,]+')
+_PROCEDURE_TRAILING_PRICE_RE = re.compile(r'[\s\d,.]+(руб\.?)?$')
+_PARENTHESES_RE = re.compile(r'\s*\([^)]*\)')
+_CYRILLIC_RE = re.compile(r'[а-яА-Я]')
+# Заголовки числовых колонок таблицы услуг
+_TABLE_HEADER_RE = re.compile(r'(?:Кол|Цена|Ст-ть|Стоимость|Сумма)', re.IGNORECASE)
+# Сумма начинается с цифры: пробелы между «+» и суммой и перед валютой не пересекаются
+# с группой суммы, поэтому длинная серия пробелов не даёт квадратичного перебора
+_MULTI_AMOUNT_RE = re.compile(r'\+\s{0,3}(\d[\d\s,.]{0,40}?)\s?(?:₽|Р|P)', re.IGNORECASE)
+_MULTI_AUTHOR_RE = re.compile(r'^[А-ЯЁ][а-яё]+\s+[А-ЯЁ]\.$')
+
+def _date_from_groups(kind: str, groups: tuple, current_year: int) -> date | None:
+    """Собирает дату из групп совпадения без strptime. Невалидная дата (31.02) даёт None."""
+    try:
+        if kind == 'textual_ru':
+            day, month_name, year = groups
+            month = _MONTHS_RU.get(month_name.lower())
+            return date(int(year), month, int(day)) if month else None
+
+        if kind == 'textual_en':
+            day, month_name = groups
+            month = _MONTHS_EN.get(month_name.lower())
+            return date(current_year, month, int(day)) if month else None
+
+        if kind == 'numeric':
+            # Формат ДД?ММ?ГГ(ГГ), где ? — любой из разделителей . / -
+            date_str = groups[0]
+            year_str = date_str[6:]
+            if len(year_str) == 4:
+                year = int(year_str)
+            elif len(year_str) == 2:
+                # Как %y в strptime: 69–99 -> 19xx, 00–68 -> 20xx
+                year = int(year_str)
+                year += 1900 if year >= 69 else 2000
+            else:
+                return None
+            return date(year, int(date_str[3:5]), int(date_str[0:2]))
+    except ValueError:
+        return None
+    return None
+
+def _first_valid_date(tier: DateTier, text: str, current_year: int) -> date | None:
+    """Ищет самое раннее по позиции валидное совпадение в пределах одного уровня."""
+    position = 0
+    while True:
+        match = tier.regex.search(text, position)
+        if match is None:
+            return None
+        start = match.start()
+
+        # Альтернативы до сработавшей на этой позиции не совпадают, после неё — могут:
+        # если дата сработавшей невалидна (например, 31.02), проверяем их по отдельности
+        winner = next(i for i, (_, offset) in enumerate(tier.alternatives) if match.group(offset) is not None)
+        p, offset = tier.alternatives[winner]
+        dt_obj = _date_from_groups(p.kind, match.groups()[offset - 1:offset - 1 + p.regex.groups], current_year)
+        if dt_obj:
+            return dt_obj
+        for p, _ in tier.alternatives[winner + 1:]:
+            alt_match = p.regex.match(text, start)
+            if alt_match:
+                dt_obj = _date_from_groups(p.kind, alt_match.groups(), current_year)
                 if dt_obj:
-                    normalized_date = dt_obj.strftime("%d.%m.%Y")
-                    found_dates.append({
-                        'date': normalized_date,
-                        'tier': p['tier'],
-                        'match_text': match.group(0),
-                        'position': match.start()
-                    })
-            except (ValueError, IndexError) as e:
-                continue
+                    return dt_obj
 
-    if found_dates:
-        best_date = min(found_dates, key=lambda x: (x['tier'], x['position']))
-        return best_date['date']
-    
+        position = start + 1
+
+def parse_date(text: str) -> str | None:
+    """
+    Находит дату операции. Уровни шаблонов (DATE_TIERS) просматриваются по порядку
+    приоритета, и поиск останавливается на первом уровне, давшем валидную дату;
+    внутри уровня побеждает самое раннее совпадение.
+    """
+    current_year = datetime.now().year
+    for tier in DATE_TIERS:
+        dt_obj = _first_valid_date(tier, text, current_year)
+        if dt_obj:
+            return f"{dt_obj.day:02d}.{dt_obj.month:02d}.{dt_obj.year}"
     return None
 
 def parse_amount(text: str, transaction_type: str) -> float | None:
-    patterns = _get_amount_patterns()
-    for p in patterns:
-        match = re.search(p['regex'], text, p['flags'])
+    for p in AMOUNT_PATTERNS:
+        match = p.regex.search(text)
         if match:
             amount_str = match.groups()[-1]
             amount = _clean_amount_string(amount_str)
@@ -215,33 +283,28 @@ def parse_amount(text: str, transaction_type: str) -> float | None:
     return None
 
 def parse_bank(text: str) -> str | None:
-    patterns = _get_bank_patterns()
     search_text = text.lower()
-    for p in patterns:
-        if re.search(p['regex'], search_text, p['flags']):
-            bank_name = p['bank_name']
-            return bank_name
+    for p in BANK_PATTERNS:
+        if p.regex.search(search_text):
+            return p.bank_name
     return None
 
 def parse_author(text: str, transaction_type: str) -> str | None:
-    patterns = _get_author_patterns(transaction_type)
-    STOPWORDS = ['улица', 'москва', 'россия', 'кассир', 'чек', 'документ',
-                 'операция', 'платеж', 'карта', 'счет', 'transaction', 'успешно']
+    patterns = AUTHOR_PATTERNS.get(transaction_type, _EXPENSE_AUTHOR_PATTERNS)
     for p in patterns:
-        matches = list(re.finditer(p['regex'], text, p['flags']))
-        for match in matches:
+        for match in p.regex.finditer(text):
             author = ' '.join(filter(None, match.groups())).strip()
             author = _clean_author_string(author)
             if len(author) < 2 or len(author) > 50: continue
-            if any(stop in author.lower() for stop in STOPWORDS): continue
-            if re.fullmatch(r'[\d\s.,]+', author): continue
+            author_lower = author.lower()
+            if any(stop in author_lower for stop in _AUTHOR_STOPWORDS): continue
+            if _ONLY_DIGITS_RE.fullmatch(author): continue
             return author
     return None
 
 def parse_comment(text: str) -> str | None:
-    patterns = _get_comment_patterns()
-    for p in patterns:
-        match = re.search(p['regex'], text, p['flags'])
+    for p in COMMENT_PATTERNS:
+        match = p.regex.search(text)
         if match:
             comment = match.group(1).strip().replace('\n', ' ')
             if len(comment) > 2:
@@ -249,12 +312,53 @@ def parse_comment(text: str) -> str | None:
                 return comment
     return None
 
+def parse_procedure_layout(layout: LayoutIndex) -> str | None:
+    """
+    Разбор таблицы услуг по координатам: строки между заголовком «Наименование ...»
+    и строкой «Итого»; название услуги — слова левее следующей колонки заголовка
+    («Кол-во», «Цена», …). Заголовок колонки названий может состоять из нескольких
+    слов («Наименование услуги»), поэтому граница — не второе слово заголовка.
+    """
+    header = layout.find_row(lambda row: row.words[0].text.lower().startswith('наименование'))
+    if header is None or len(header.words) < 2:
+        return None
+    name_column = layout.column_of(header.words[0])
+    next_header_word = next(
+        (word for word in header.words[1:] if _TABLE_HEADER_RE.match(word.text)),
+        next((word for word in header.words[1:] if layout.column_of(word) != name_column), None),
+    )
+    if next_header_word is None:
+        return None
+    name_column_end = next_header_word.x0
+
+    total = layout.find_row(lambda row: 'итого' in row.text.lower(), header.index + 1)
+    end = total.index if total else len(layout.rows)
+
+    clean_lines = []
+    for row in layout.rows[header.index + 1:end]:
+        name = ' '.join(
+            word.text for word in row.words
+            if word.x0 < name_column_end and layout.column_of(word) >= name_column
+        )
+        cleaned_line = _PROCEDURE_TRAILING_PRICE_RE.sub('', name).strip()
+        cleaned_line = _PARENTHESES_RE.sub('', cleaned_line).strip()
+        if len(cleaned_line) > 2 and _CYRILLIC_RE.search(cleaned_line):
+            clean_lines.append(cleaned_line)
+
+    return '; '.join(clean_lines) if clean_lines else None
+
 def parse_procedure(text: str) -> str | None:
-    patterns = _get_procedure_patterns()
-    for p in patterns:
-        match = re.search(p['regex'], text, p['flags'])
-        if match:
-            procedures_block = match.group(1).strip()
+    layout = LayoutIndex.from_text(text)
+    if layout:
+        procedure = parse_procedure_layout(layout)
+        if procedure:
+            return procedure
+
+    for p in PROCEDURE_PATTERNS:
+        match = p.regex.search(text)
+        end = _PROCEDURE_END_RE.search(text, match.end()) if match else None
+        if end:
+            procedures_block = text[match.end():end.start()].strip()
             clean_lines = []
             
             for line in procedures_block.split('\n'):
@@ -262,10 +366,10 @@ def parse_procedure(text: str) -> str | None:
                 if not line:
                     continue
                 
-                cleaned_line = re.sub(r'[\s\d,.]+(руб\.?)?$', '', line).strip()
-                cleaned_line = re.sub(r'\s*\([^)]*\)', '', cleaned_line).strip()
+                cleaned_line = _PROCEDURE_TRAILING_PRICE_RE.sub('', line).strip()
+                cleaned_line = _PARENTHESES_RE.sub('', cleaned_line).strip()
                 
-                if len(cleaned_line) > 2 and re.search(r'[а-яА-Я]', cleaned_line):
+                if len(cleaned_line) > 2 and _CYRILLIC_RE.search(cleaned_line):
                     clean_lines.append(cleaned_line)
             
             if clean_lines:
@@ -273,51 +377,125 @@ def parse_procedure(text: str) -> str | None:
                 return result
     return None
 
+# Сколько строк над суммой просматривается в поисках имени отправителя
+_MULTI_AUTHOR_WINDOW = 5
+
+def iter_lines(text: str) -> Iterator[str]:
+    """Отдаёт строки текста по одной, не создавая список всех строк."""
+    start = 0
+    while True:
+        end = text.find('\n', start)
+        if end == -1:
+            yield text[start:]
+            return
+        yield text[start:end]
+        start = end + 1
+
+def iter_multiple_transactions(lines: Iterable[str], bank: str | None = None) -> Iterator[dict]:
+    """
+    Потоковый разбор списка операций: каждая строка проверяется один раз.
+    Последние имена отправителей хранятся в скользящем окне из _MULTI_AUTHOR_WINDOW строк;
+    строка с суммой забирает ближайшее имя над собой, после чего окно очищается,
+    чтобы одно имя не досталось двум суммам. Память не зависит от длины текста.
+    """
+    recent_authors: deque[tuple[int, str]] = deque(maxlen=_MULTI_AUTHOR_WINDOW)
+
+    for index, raw_line in enumerate(lines):
+        line = raw_line.strip()
+
+        # Дешёвые проверки по символам отсекают большинство строк до запуска regex
+        amount_match = _MULTI_AMOUNT_RE.search(line) if '+' in line else None
+        if amount_match:
+            amount = _clean_amount_string(amount_match.group(1))
+            while recent_authors and index - recent_authors[0][0] > _MULTI_AUTHOR_WINDOW:
+                recent_authors.popleft()
+            if amount and amount > 0 and recent_authors:
+                _, author_line = recent_authors[-1]
+                recent_authors.clear()
+                yield {
+                    'author': _clean_author_string(author_line),
+                    'amount': amount,
+                    'bank': bank
+                }
+            continue
+
+        if line.endswith('.') and _MULTI_AUTHOR_RE.match(line):
+            recent_authors.append((index, line))
+
+def iter_layout_transactions(layout: LayoutIndex, bank: str | None = None) -> Iterator[dict]:
+    """
+    Разбор списка операций по координатам слов: сумма «+ N ₽» берёт имя отправителя
+    из той же строки левее суммы или из одной из двух строк над ней (тоже левее суммы).
+    Строка с именем используется только один раз.
+    """
+    used_rows: set[int] = set()
+    for row in layout.rows:
+        amount_word = next((word for word in row.words if '+' in word.text), None)
+        if amount_word is None:
+            continue
+        amount_text = ' '.join(word.text for word in row.words if word.x0 >= amount_word.x0)
+        amount_match = _MULTI_AMOUNT_RE.search(amount_text)
+        if not amount_match:
+            continue
+        amount = _clean_amount_string(amount_match.group(1))
+        if not amount or amount <= 0:
+            continue
+
+        for candidate in [row] + layout.rows_above(row, 2):
+            if candidate.index in used_rows:
+                continue
+            name = ' '.join(word.text for word in candidate.words_left_of(amount_word.x0))
+            if _MULTI_AUTHOR_RE.match(name):
+                used_rows.add(candidate.index)
+                yield {
+                    'author': _clean_author_string(name),
+                    'amount': amount,
+                    'bank': bank
+                }
+                break
+
 def parse_multiple_transactions(text: str) -> list[dict]:
     logger.info(f"🔍 Начинаем парсинг множественных транзакций. Объем текста: {len(text)} символов.")
-    
+
     bank = parse_bank(text)
     transactions = []
-    
-    amount_pattern = re.compile(r'\+\s*([\d\s,.]*)\s*(?:₽|Р|P)', re.IGNORECASE)
-    author_pattern = re.compile(r'^[А-ЯЁ][а-яё]+\s+[А-ЯЁ]\.$')
-    
-    lines = text.split('\n')
-
-    i = 0
-    while i < len(lines):
-        line = lines[i].strip()
-        
-        amount_match = amount_pattern.search(line)
-        if amount_match:
-            amount_str = amount_match.group(1)
-            amount = _clean_amount_string(amount_str)
-            
-            if amount:
-                author = None
-                
-                for j in range(1, 6):
-                    if i - j >= 0:
-                        prev_line = lines[i - j].strip()
-                        if author_pattern.match(prev_line):
-                            author = _clean_author_string(prev_line)
-                            break
-                
-                if author and amount > 0:
-                    transactions.append({
-                        'author': author,
-                        'amount': amount,
-                        'bank': bank
-                    })
-                    
-                    i += 3
-                    continue
-        
-        i += 1
+    layout = LayoutIndex.from_text(text)
+    if layout:
+        transactions = list(iter_layout_transactions(layout, bank=bank))
+        logger.info(f"Разбор по координатам слов: {len(transactions)} записей.")
+    if not transactions:
+        transactions = list(iter_multiple_transactions(iter_lines(text), bank=bank))
 
     logger.info(f"📊 Парсинг множественных транзакций завершен. Распознано: {len(transactions)} записей.")
     return transactions
 
+def transaction_fields(transaction_type: str) -> tuple[str, ...]:
+    """Поля, которые parse_transaction_data извлекает для данного типа операции."""
+    if transaction_type in ['income', 'transaction']:
+        return ('date', 'amount', 'bank', 'author', 'comment')
+    return ('date', 'amount', 'procedure', 'author', 'comment')
+
+def parse_field(field: str, text: str, transaction_type: str):
+    """
+    Извлекает одно поле так же, как parse_transaction_data. Используется безопасным
+    режимом (safe_parser), который разбирает поля по отдельности в дочерних процессах.
+    """
+    if field == 'date':
+        return parse_date(text)
+    if field == 'amount':
+        return parse_amount(text, transaction_type)
+    if transaction_type in ['income', 'transaction']:
+        text = _normalize_text_for_search(text)
+    if field == 'bank':
+        return parse_bank(text)
+    if field == 'author':
+        return parse_author(text, transaction_type)
+    if field == 'comment':
+        return parse_comment(text)
+    if field == 'procedure':
+        return parse_procedure(text)
+    raise ValueError(f"Неизвестное поле: '{field}'")
+
 def parse_transaction_data(text: str, transaction_type: str) -> dict:
     logger.info(f"🔍 Начинаем парсинг. Тип: {transaction_type.upper()}. Объем текста: {len(text)} символов.")
     
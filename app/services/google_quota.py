@@ -0,0 +1,218 @@
+import logging
+import random
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+# Приоритет исходящих запросов к Google: интерактивные (пользователь ждёт ответа)
+# обслуживаются раньше фоновых (дозапись журнала, обновление токена, сверки)
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+request_priority: ContextVar[int] = ContextVar("google_request_priority", default=PRIORITY_INTERACTIVE)
+
+# HTTP-статусы, при которых запрос повторяется с паузой: превышение квоты и временная недоступность
+RETRYABLE_STATUSES = (429, 503)
+
+
+@contextmanager
+def background_priority():
+    """Запросы к Google внутри блока считаются фоновыми."""
+    token = request_priority.set(PRIORITY_BACKGROUND)
+    try:
+        yield
+    finally:
+        request_priority.reset(token)
+
+
+class TokenBucket:
+    """
+    Маркерная корзина: per_minute маркеров в минуту, не более burst накопленных.
+    Время — time.time(): состояние корзины делят процессы (см. BucketStore).
+    """
+
+    def __init__(self, per_minute: int, burst: int):
+        self.rate = per_minute / 60
+        self.capacity = burst
+        self.tokens = float(burst)
+        self.updated_at = time.time()
+        # После ответа 429/503 корзина «замораживается» до этого момента
+        self.blocked_until = 0.0
+
+    def refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + max(now - self.updated_at, 0.0) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self, cost: int, now: float) -> float:
+        """Сколько секунд ждать, пока хватит маркеров. Запрос дороже burst ждёт полную корзину."""
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        missing = min(cost, self.capacity) - self.tokens
+        return max(missing / self.rate, 0.0) if self.rate else float('inf')
+
+
+class BucketStore:
+    """
+    Состояние маркерных корзин в SQLite, общее для всех воркеров uvicorn: квота Google
+    одна на проект, и каждый процесс расходует её из тех же корзин. Изменение корзины —
+    транзакция BEGIN IMMEDIATE, так что два процесса не возьмут один и тот же маркер.
+    """
+
+    def __init__(self, path: str):
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=10, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS quota_buckets ("
+            "bucket TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL, blocked_until REAL NOT NULL)"
+        )
+        logger.info(f"Общие корзины квот Google: {path}")
+
+    @contextmanager
+    def locked(self, name: str, bucket: TokenBucket):
+        """Загружает корзину из базы и записывает обратно после блока — всё в одной транзакции."""
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            row = self._db.execute(
+                "SELECT tokens, updated_at, blocked_until FROM quota_buckets WHERE bucket = ?", (name,)
+            ).fetchone()
+            if row is not None:
+                bucket.tokens, bucket.updated_at, bucket.blocked_until = row
+            yield bucket
+            self._db.execute(
+                "INSERT INTO quota_buckets (bucket, tokens, updated_at, blocked_until) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (bucket) DO UPDATE SET tokens = excluded.tokens, "
+                "updated_at = excluded.updated_at, blocked_until = excluded.blocked_until",
+                (name, bucket.tokens, bucket.updated_at, bucket.blocked_until),
+            )
+            self._db.execute("COMMIT")
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+
+
+def status_of(error: Exception) -> int | None:
+    """HTTP-статус из исключения gspread (APIError.code) или google-api-core (GoogleAPICallError.code)."""
+    code = getattr(error, 'code', None)
+    if isinstance(code, int):
+        return code
+    response = getattr(error, 'response', None)
+    return getattr(response, 'status_code', None)
+
+
+class QuotaScheduler:
+    """
+    Общий планировщик исходящих запросов к Google API. На каждую пару (API, класс квоты)
+    заведена маркерная корзина; поток, которому не хватило маркеров, ждёт, причём фоновые
+    запросы пропускают вперёд ожидающие интерактивные этого же процесса. Ответы 429/503
+    замораживают корзину и повторяются с экспоненциальной паузой со случайным разбросом.
+    Сами корзины лежат в BucketStore и общие для всех воркеров.
+    """
+
+    def __init__(self, limits: dict[tuple[str, str], tuple[int, int]], store: BucketStore):
+        self._buckets = {key: TokenBucket(per_minute, burst) for key, (per_minute, burst) in limits.items()}
+        self._store = store
+        self._waiting = {key: [0, 0] for key in limits}  # ожидающие по приоритетам
+        self._stats = {key: {"granted": 0, "throttled": 0, "retries": 0, "wait_total": 0.0} for key in limits}
+        self._condition = threading.Condition()
+
+    def acquire(self, api: str, quota_class: str, cost: int = 1) -> float:
+        """Блокирует поток, пока квота не позволит запрос. Возвращает время ожидания (сек.)."""
+        key = (api, quota_class)
+        bucket = self._buckets[key]
+        priority = request_priority.get()
+        waiting = self._waiting[key]
+        started = time.monotonic()
+
+        with self._condition:
+            waiting[priority] += 1
+            try:
+                while True:
+                    if priority == PRIORITY_BACKGROUND and waiting[PRIORITY_INTERACTIVE] > 0:
+                        # Фоновый запрос ждёт, пока интерактивные не получат маркеры (они разбудят нас)
+                        self._condition.wait(timeout=1.0)
+                        continue
+                    with self._store.locked(f"{api}.{quota_class}", bucket):
+                        now = time.time()
+                        bucket.refill(now)
+                        delay = bucket.wait_time(cost, now)
+                        if delay <= 0:
+                            bucket.tokens -= cost
+                    if delay <= 0:
+                        break
+                    # Маркеры могли взять другие воркеры — пересчитываем не реже раза в секунду
+                    self._condition.wait(timeout=min(delay, 1.0))
+            finally:
+                waiting[priority] -= 1
+                self._condition.notify_all()
+
+            waited = time.monotonic() - started
+            stats = self._stats[key]
+            stats["granted"] += 1
+            stats["wait_total"] += waited
+        if waited > 1:
+            logger.info(f"Запрос к {api}/{quota_class} ждал квоту {waited:.2f} с")
+        return waited
+
+    def penalize(self, api: str, quota_class: str, delay: float) -> None:
+        """Замораживает корзину после ответа о превышении квоты: остальные потоки тоже подождут."""
+        key = (api, quota_class)
+        with self._condition:
+            with self._store.locked(f"{api}.{quota_class}", self._buckets[key]) as bucket:
+                bucket.tokens = 0.0
+                bucket.blocked_until = max(bucket.blocked_until, time.time() + delay)
+            self._stats[key]["throttled"] += 1
+
+    def call(self, api: str, quota_class: str, func, *args, cost: int = 1, **kwargs):
+        """Выполняет func с учётом квоты и повторами на 429/503 (не более settings.google_retry_attempts)."""
+        attempt = 0
+        while True:
+            self.acquire(api, quota_class, cost)
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                status = status_of(e)
+                attempt += 1
+                if status not in RETRYABLE_STATUSES or attempt > settings.google_retry_attempts:
+                    raise
+                delay = min(settings.google_retry_base_delay * 2 ** (attempt - 1), settings.google_retry_max_delay)
+                delay *= random.uniform(0.5, 1.0)
+                logger.warning(f"{api}/{quota_class}: ответ {status}, повтор {attempt} через {delay:.1f} с")
+                self.penalize(api, quota_class, delay)
+                with self._condition:
+                    self._stats[(api, quota_class)]["retries"] += 1
+
+    def get_stats(self) -> dict:
+        """Текущий бюджет и очередь по каждой корзине."""
+        snapshot = {}
+        with self._condition:
+            for (api, quota_class), bucket in self._buckets.items():
+                with self._store.locked(f"{api}.{quota_class}", bucket):
+                    now = time.time()
+                    bucket.refill(now)
+                stats = self._stats[(api, quota_class)]
+                waiting = self._waiting[(api, quota_class)]
+                snapshot[f"{api}.{quota_class}"] = {
+                    "per_minute": round(bucket.rate * 60),
+                    "tokens": round(bucket.tokens, 1),
+                    "blocked_for": round(max(bucket.blocked_until - now, 0.0), 1),
+                    "waiting_interactive": waiting[PRIORITY_INTERACTIVE],
+                    "waiting_background": waiting[PRIORITY_BACKGROUND],
+                    "granted": stats["granted"],
+                    "throttled": stats["throttled"],
+                    "retries": stats["retries"],
+                    "wait_avg": round(stats["wait_total"] / stats["granted"], 3) if stats["granted"] else 0.0,
+                }
+        return snapshot
+
+
+quota_scheduler = QuotaScheduler({
+    ("sheets", "read"): (settings.google_sheets_reads_per_minute, settings.google_quota_burst),
+    ("sheets", "write"): (settings.google_sheets_writes_per_minute, settings.google_quota_burst),
+    ("vision", "request"): (settings.google_vision_requests_per_minute, settings.google_vision_burst),
+}, BucketStore(settings.google_quota_path))
@@ -0,0 +1,116 @@
+import asyncio
+import io
+import logging
+from typing import Sequence
+
+from telegram import PhotoSize
+
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+try:
+    from PIL import Image, ImageChops, ImageOps
+except ImportError:
+    Image = None
+    logger.warning("Pillow не установлен: предобработка изображений перед OCR отключена.")
+
+# Порог, начиная с которого пиксель считается "содержимым", а не фоном при обрезке полей
+_BORDER_THRESHOLD = 24
+_CROP_MARGIN = 8
+_JPEG_QUALITIES = (85, 75, 65, 55)
+_DOWNSCALE_STEP = 0.85
+
+
+def select_photo_size(photo_sizes: Sequence[PhotoSize]) -> PhotoSize:
+    """
+    Выбирает наименьший из вариантов размера фото, у которого длинная сторона
+    не меньше settings.ocr_min_photo_side. Если таких нет — самый крупный.
+    Telegram присылает варианты по возрастанию размера.
+    """
+    for photo_size in photo_sizes:
+        if max(photo_size.width, photo_size.height) >= settings.ocr_min_photo_side:
+            return photo_size
+    return photo_sizes[-1]
+
+
+def estimate_photo_memory(photo_size: PhotoSize) -> int:
+    """
+    Сколько памяти займёт фото на время обработки: скачанный файл плюс раскодированные
+    кадры предобработки (RGB и оттенки серого — около 4 байт на пиксель).
+    """
+    file_bytes = photo_size.file_size or photo_size.width * photo_size.height // 2
+    decoded_bytes = photo_size.width * photo_size.height * 4 if settings.ocr_preprocess else 0
+    return file_bytes + decoded_bytes
+
+
+def _crop_borders(image: "Image.Image") -> "Image.Image":
+    """Обрезает однотонные поля вокруг содержимого (цвет фона берётся из левого верхнего угла)."""
+    background = Image.new(image.mode, image.size, image.getpixel((0, 0)))
+    diff = ImageChops.difference(image, background).point(lambda p: 255 if p > _BORDER_THRESHOLD else 0)
+    bbox = diff.getbbox()
+    if not bbox:
+        return image
+    left, top, right, bottom = bbox
+    bbox = (
+        max(left - _CROP_MARGIN, 0), max(top - _CROP_MARGIN, 0),
+        min(right + _CROP_MARGIN, image.width), min(bottom + _CROP_MARGIN, image.height),
+    )
+    if bbox == (0, 0, image.width, image.height):
+        return image
+    return image.crop(bbox)
+
+
+def _encode_jpeg(image: "Image.Image", quality: int) -> bytes:
+    out = io.BytesIO()
+    image.save(out, format="JPEG", quality=quality, optimize=True)
+    return out.getvalue()
+
+
+def preprocess_image(source: io.BytesIO) -> bytes:
+    """
+    Готовит изображение к OCR: поворот по EXIF, оттенки серого, обрезка полей,
+    уменьшение до settings.ocr_max_image_side и пережатие в JPEG под бюджет
+    settings.ocr_target_image_bytes. Если результат не меньше исходника, возвращается исходник.
+    """
+    original_size = source.getbuffer().nbytes
+    source.seek(0)
+    with Image.open(source) as opened:
+        image = ImageOps.exif_transpose(opened).convert("L")
+
+    image = _crop_borders(image)
+
+    max_side = settings.ocr_max_image_side
+    if max(image.size) > max_side:
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+
+    encoded = b""
+    while True:
+        for quality in _JPEG_QUALITIES:
+            encoded = _encode_jpeg(image, quality)
+            if len(encoded) <= settings.ocr_target_image_bytes:
+                break
+        if len(encoded) <= settings.ocr_target_image_bytes:
+            break
+        # Не уменьшаем ниже порога читаемости текста
+        new_size = (int(image.width * _DOWNSCALE_STEP), int(image.height * _DOWNSCALE_STEP))
+        if max(new_size) < settings.ocr_min_photo_side:
+            break
+        image = image.resize(new_size, Image.LANCZOS)
+
+    if len(encoded) >= original_size:
+        return source.getvalue()
+
+    logger.info(f"Изображение подготовлено к OCR: {original_size} -> {len(encoded)} байт, {image.width}x{image.height}")
+    return encoded
+
+
+async def prepare_image_for_ocr(source: io.BytesIO) -> bytes:
+    """Асинхронная обёртка над preprocess_image; при любой ошибке отдаёт исходные байты."""
+    if Image is None or not settings.ocr_preprocess:
+        return source.getvalue()
+    try:
+        return await asyncio.to_thread(preprocess_image, source)
+    except Exception as e:
+        logger.warning(f"Не удалось предобработать изображение, отправляем исходное: {e}")
+        return source.getvalue()
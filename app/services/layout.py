@@ -0,0 +1,130 @@
+from bisect import bisect_right
+from dataclasses import dataclass
+from statistics import median
+
+
+@dataclass(frozen=True, slots=True)
+class OcrWord:
+    """Слово с прямоугольником на изображении (x0, y0 — левый верхний угол)."""
+    text: str
+    x0: int
+    y0: int
+    x1: int
+    y1: int
+
+    @property
+    def center_y(self) -> float:
+        return (self.y0 + self.y1) / 2
+
+    @property
+    def height(self) -> int:
+        return self.y1 - self.y0
+
+
+@dataclass(frozen=True, slots=True)
+class OcrBlock:
+    """Блок текста (абзац/колонка), как его выделил OCR-движок."""
+    text: str
+    x0: int
+    y0: int
+    x1: int
+    y1: int
+
+
+class OcrText(str):
+    """
+    Распознанный текст, который ведёт себя как обычная строка, но дополнительно
+    несёт слова и блоки с координатами. Возвращается recognize_text(..., with_layout=True).
+    """
+    words: tuple[OcrWord, ...]
+    blocks: tuple[OcrBlock, ...]
+
+    def __new__(cls, text: str, words=(), blocks=()):
+        obj = super().__new__(cls, text)
+        obj.words = tuple(words)
+        obj.blocks = tuple(blocks)
+        return obj
+
+
+@dataclass(slots=True)
+class LayoutRow:
+    index: int
+    words: list[OcrWord]
+
+    @property
+    def text(self) -> str:
+        return ' '.join(word.text for word in self.words)
+
+    def words_left_of(self, x: int) -> list[OcrWord]:
+        return [word for word in self.words if word.x1 <= x]
+
+
+class LayoutIndex:
+    """
+    Пространственный индекс слов: строки (слова с близким центром по вертикали,
+    отсортированные слева направо) и колонки (группы слов с близким левым краем).
+    """
+
+    def __init__(self, words: tuple[OcrWord, ...] | list[OcrWord]):
+        words = [word for word in words if word.text]
+        self.rows: list[LayoutRow] = []
+        self.columns: list[tuple[int, int]] = []
+        self._row_of: dict[int, int] = {}
+        self._column_starts: list[int] = []
+        if not words:
+            return
+
+        line_height = median(max(word.height, 1) for word in words)
+        self._build_rows(words, row_tolerance=line_height * 0.6)
+        self._build_columns(words, column_gap=line_height * 1.5)
+
+    def _build_rows(self, words: list[OcrWord], row_tolerance: float) -> None:
+        current: list[OcrWord] = []
+        current_center = 0.0
+        for word in sorted(words, key=lambda w: w.center_y):
+            if current and abs(word.center_y - current_center) > row_tolerance:
+                self._append_row(current)
+                current = []
+            current.append(word)
+            current_center = sum(w.center_y for w in current) / len(current)
+        if current:
+            self._append_row(current)
+
+    def _append_row(self, words: list[OcrWord]) -> None:
+        row = LayoutRow(index=len(self.rows), words=sorted(words, key=lambda w: w.x0))
+        self.rows.append(row)
+        for word in row.words:
+            self._row_of[id(word)] = row.index
+
+    def _build_columns(self, words: list[OcrWord], column_gap: float) -> None:
+        lefts = sorted(word.x0 for word in words)
+        start = previous = lefts[0]
+        for x in lefts[1:]:
+            if x - previous > column_gap:
+                self.columns.append((start, previous))
+                start = x
+            previous = x
+        self.columns.append((start, previous))
+        self._column_starts = [column_start for column_start, _ in self.columns]
+
+    @classmethod
+    def from_text(cls, text: str) -> "LayoutIndex | None":
+        """Индекс по OcrText; для обычной строки без координат — None."""
+        words = getattr(text, 'words', None)
+        return cls(words) if words else None
+
+    def row_of(self, word: OcrWord) -> LayoutRow:
+        return self.rows[self._row_of[id(word)]]
+
+    def column_of(self, word: OcrWord) -> int:
+        return max(bisect_right(self._column_starts, word.x0) - 1, 0)
+
+    def rows_above(self, row: LayoutRow, count: int) -> list[LayoutRow]:
+        """До count строк над данной, от ближайшей к дальней."""
+        return self.rows[max(row.index - count, 0):row.index][::-1]
+
+    def find_row(self, predicate, start: int = 0) -> LayoutRow | None:
+        for row in self.rows[start:]:
+            if predicate(row):
+                return row
+        return None
@@ -0,0 +1,173 @@
+import asyncio
+import logging
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from app.services.google_quota import background_priority
+from app.services.receipt_index import receipt_index
+from app.services.storage_backends import INCOME_COLS, get_storage_backend
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+_AMOUNT_JUNK_RE = re.compile(r'[^\d,.\-]')
+_DATE_RE = re.compile(r'(\d{1,2})[./-](\d{1,2})[./-](\d{2,4})')
+
+# Строка итогов за всё время хранится с пустым месяцем
+ALL_TIME = ''
+
+
+def _to_amount(value) -> float:
+    """Сумма из ячейки: число или строка вида «1 500,50 ₽». Нечитаемое значение — 0."""
+    if isinstance(value, (int, float)):
+        return float(value)
+    cleaned = _AMOUNT_JUNK_RE.sub('', str(value or '')).replace(',', '.')
+    try:
+        return float(cleaned)
+    except ValueError:
+        return 0.0
+
+
+def _to_month(value) -> str:
+    """Месяц «ГГГГ-ММ» из даты «ДД.ММ.ГГГГ»; для нераспознанной даты — пустая строка."""
+    match = _DATE_RE.search(str(value or ''))
+    if not match:
+        return ALL_TIME
+    day, month, year = match.groups()
+    if len(year) == 2:
+        year = f"20{year}"
+    return f"{year}-{int(month):02d}"
+
+
+def normalize_pet_name(pet_name: str) -> str:
+    """Имя питомца так же, как его называет лист в таблице."""
+    return (pet_name or '').strip().capitalize()
+
+
+class Ledger:
+    """
+    Локальное зеркало сумм по питомцам (SQLite). На каждую пару (питомец, месяц) и на
+    питомца за всё время хранится одна строка с суммами прихода и расхода, которая
+    увеличивается при каждой записи в таблицу, — остаток читается одним запросом по ключу.
+    Ручные правки в таблице подхватываются периодической сверкой (reconcile).
+    """
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS ledger_totals ("
+            "pet_name TEXT NOT NULL, month TEXT NOT NULL, income REAL NOT NULL DEFAULT 0, "
+            "expense REAL NOT NULL DEFAULT 0, entries INTEGER NOT NULL DEFAULT 0, updated_at REAL NOT NULL, "
+            "PRIMARY KEY (pet_name, month))"
+        )
+        self._db.commit()
+        self.last_reconciled_at: float | None = None
+
+    def _add(self, pet_name: str, month: str, income: float, expense: float, entries: int, now: float) -> None:
+        self._db.execute(
+            "INSERT INTO ledger_totals (pet_name, month, income, expense, entries, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (pet_name, month) DO UPDATE SET "
+            "income = income + excluded.income, expense = expense + excluded.expense, "
+            "entries = entries + excluded.entries, updated_at = excluded.updated_at",
+            (pet_name, month, income, expense, entries, now),
+        )
+
+    def _add_rows(self, pet_name: str, target_cols: dict, rows: list[list], now: float) -> None:
+        is_income = target_cols["start"] == INCOME_COLS["start"]
+        for row in rows:
+            amount = _to_amount(row[1] if len(row) > 1 else 0)
+            income, expense = (amount, 0.0) if is_income else (0.0, amount)
+            self._add(pet_name, ALL_TIME, income, expense, 1, now)
+            month = _to_month(row[0] if row else '')
+            if month:
+                self._add(pet_name, month, income, expense, 1, now)
+
+    def record(self, pet_name: str, sections: list[tuple[dict, list[list]]]) -> None:
+        """Учитывает строки, только что записанные в разделы листа питомца."""
+        pet_name = normalize_pet_name(pet_name)
+        with self._lock:
+            try:
+                self._add_rows_sections(pet_name, sections)
+                self._db.commit()
+            except sqlite3.Error as e:
+                self._db.rollback()
+                logger.error(f"Не удалось обновить локальный учёт для '{pet_name}': {e}")
+
+    def _add_rows_sections(self, pet_name: str, sections: list[tuple[dict, list[list]]]) -> None:
+        now = time.time()
+        for target_cols, rows in sections:
+            self._add_rows(pet_name, target_cols, rows, now)
+
+    def replace(self, sheets: dict[str, list[tuple[dict, list[list]]]]) -> None:
+        """Пересчитывает суммы заново по содержимому листов (сверка с таблицей)."""
+        with self._lock:
+            try:
+                self._db.execute("DELETE FROM ledger_totals")
+                for pet_name, sections in sheets.items():
+                    self._add_rows_sections(normalize_pet_name(pet_name), sections)
+                self._db.commit()
+            except sqlite3.Error as e:
+                self._db.rollback()
+                logger.error(f"Не удалось пересчитать локальный учёт: {e}")
+                return
+        self.last_reconciled_at = time.time()
+
+    def balance(self, pet_name: str, month: str | None = None) -> dict | None:
+        """Суммы по питомцу за всё время и за месяц (по умолчанию — текущий). None — записей нет."""
+        pet_name = normalize_pet_name(pet_name)
+        month = month or datetime.now().strftime("%Y-%m")
+        with self._lock:
+            rows = dict(
+                (row[0], row[1:]) for row in self._db.execute(
+                    "SELECT month, income, expense, entries FROM ledger_totals "
+                    "WHERE pet_name = ? AND month IN (?, ?)",
+                    (pet_name, ALL_TIME, month),
+                )
+            )
+        if ALL_TIME not in rows:
+            return None
+        income, expense, entries = rows[ALL_TIME]
+        month_income, month_expense, _ = rows.get(month, (0.0, 0.0, 0))
+        return {
+            "pet_name": pet_name,
+            "income": income,
+            "expense": expense,
+            "balance": income - expense,
+            "entries": entries,
+            "month": month,
+            "month_income": month_income,
+            "month_expense": month_expense,
+        }
+
+
+ledger = Ledger(settings.ledger_path)
+
+
+def reconcile_ledger() -> None:
+    """
+    Перечитывает все листы из хранилища, пересчитывает суммы и пополняет индекс дублей.
+    Выполняется в потоке Sheets.
+    """
+    started = time.monotonic()
+    sheets = get_storage_backend().read_sheets()
+    ledger.replace(sheets)
+    receipt_index.add_sheets(sheets)
+    logger.info(f"Сверка учёта с таблицей: {len(sheets)} листов за {time.monotonic() - started:.1f} с")
+
+
+async def run_reconciliation() -> None:
+    """Периодическая сверка: сразу после запуска и затем каждые settings.ledger_reconcile_interval секунд."""
+    from app.services.sheets_client import sheets_client
+
+    while True:
+        try:
+            # В потоке клиента Sheets сверка не пересекается с записью новых строк
+            with background_priority():
+                await sheets_client.run_in_thread(reconcile_ledger)
+        except Exception as e:
+            logger.warning(f"Не удалось сверить учёт с таблицей: {e}")
+        await asyncio.sleep(settings.ledger_reconcile_interval)
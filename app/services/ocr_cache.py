@@ -0,0 +1,146 @@
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+def image_cache_key(image_bytes: bytes) -> str:
+    """Ключ кэша по содержимому изображения (SHA-256)."""
+    return "sha256:" + hashlib.sha256(image_bytes).hexdigest()
+
+
+def file_cache_key(file_unique_id: str) -> str:
+    """Ключ кэша по Telegram file_unique_id (одинаков для одного и того же файла у всех ботов)."""
+    return "tg:" + file_unique_id
+
+
+class OcrCache:
+    """
+    Двухуровневый кэш результатов OCR: LRU в памяти и необязательный SQLite-файл на диске.
+    Оба уровня ограничены по размеру и по времени жизни записи (TTL).
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: int, disk_path: str = "", disk_max_entries: int = 0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.disk_max_entries = disk_max_entries
+        self._memory: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: sqlite3.Connection | None = None
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+        if disk_path:
+            try:
+                self._db = sqlite3.connect(disk_path, check_same_thread=False)
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS ocr_cache ("
+                    "key TEXT PRIMARY KEY, text TEXT NOT NULL, created_at REAL NOT NULL)"
+                )
+                self._db.execute("CREATE INDEX IF NOT EXISTS ocr_cache_created ON ocr_cache(created_at)")
+                self._db.commit()
+                logger.info(f"Дисковый кэш OCR подключен: {disk_path}")
+            except sqlite3.Error as e:
+                logger.error(f"Не удалось открыть дисковый кэш OCR '{disk_path}': {e}")
+                self._db = None
+
+    def _is_expired(self, created_at: float) -> bool:
+        return self.ttl_seconds > 0 and time.time() - created_at > self.ttl_seconds
+
+    def get(self, *keys: str | None) -> str | None:
+        """Возвращает текст по первому найденному ключу (проверяются по порядку)."""
+        keys = [k for k in keys if k]
+        with self._lock:
+            for key in keys:
+                entry = self._memory.get(key)
+                if entry is None:
+                    continue
+                created_at, text = entry
+                if self._is_expired(created_at):
+                    del self._memory[key]
+                    self.stats["evictions"] += 1
+                    continue
+                self._memory.move_to_end(key)
+                self.stats["memory_hits"] += 1
+                return text
+
+            if self._db is not None:
+                for key in keys:
+                    try:
+                        row = self._db.execute(
+                            "SELECT text, created_at FROM ocr_cache WHERE key = ?", (key,)
+                        ).fetchone()
+                    except sqlite3.Error as e:
+                        logger.error(f"Ошибка чтения дискового кэша OCR: {e}")
+                        break
+                    if row is None:
+                        continue
+                    text, created_at = row
+                    if self._is_expired(created_at):
+                        continue
+                    self._put_memory(key, text, created_at)
+                    self.stats["disk_hits"] += 1
+                    return text
+
+            self.stats["misses"] += 1
+            return None
+
+    def put(self, text: str, *keys: str | None) -> None:
+        """Сохраняет результат OCR сразу под несколькими ключами (file_unique_id и хеш)."""
+        keys = [k for k in keys if k]
+        now = time.time()
+        with self._lock:
+            for key in keys:
+                self._put_memory(key, text, now)
+            self.stats["stores"] += 1
+
+            if self._db is not None:
+                try:
+                    self._db.executemany(
+                        "INSERT OR REPLACE INTO ocr_cache (key, text, created_at) VALUES (?, ?, ?)",
+                        [(key, text, now) for key in keys],
+                    )
+                    self._prune_disk(now)
+                    self._db.commit()
+                except sqlite3.Error as e:
+                    logger.error(f"Ошибка записи в дисковый кэш OCR: {e}")
+
+    def _put_memory(self, key: str, text: str, created_at: float) -> None:
+        self._memory[key] = (created_at, text)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def _prune_disk(self, now: float) -> None:
+        if self.ttl_seconds > 0:
+            self._db.execute("DELETE FROM ocr_cache WHERE created_at < ?", (now - self.ttl_seconds,))
+        if self.disk_max_entries > 0:
+            self._db.execute(
+                "DELETE FROM ocr_cache WHERE key NOT IN "
+                "(SELECT key FROM ocr_cache ORDER BY created_at DESC LIMIT ?)",
+                (self.disk_max_entries,),
+            )
+
+    def get_stats(self) -> dict:
+        hits = self.stats["memory_hits"] + self.stats["disk_hits"]
+        lookups = hits + self.stats["misses"]
+        return {
+            **self.stats,
+            "memory_entries": len(self._memory),
+            "disk_enabled": self._db is not None,
+            "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+        }
+
+
+ocr_cache = OcrCache(
+    max_entries=settings.ocr_cache_size,
+    ttl_seconds=settings.ocr_cache_ttl,
+    disk_path=settings.ocr_cache_path,
+    disk_max_entries=settings.ocr_cache_disk_max_entries,
+)
@@ -0,0 +1,248 @@
+import hashlib
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+from app.services.google_quota import quota_scheduler
+from app.services.layout import OcrBlock, OcrText, OcrWord
+from app.services.startup_timing import startup_timer
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+class OcrEngineError(Exception):
+    """Ошибка OCR-движка; текст исключения уже пригоден для показа в логах."""
+
+
+class OcrEngine:
+    """
+    Базовый интерфейс OCR-движка. Методы синхронные: recognize_text вызывает их
+    в отдельном пуле потоков. Пустая строка означает, что текста на изображении нет.
+    """
+    name = "base"
+
+    def is_ready(self) -> bool:
+        return True
+
+    def detect_text(self, image_bytes: bytes) -> str:
+        raise NotImplementedError
+
+    def detect_layout(self, image_bytes: bytes) -> OcrText:
+        """Текст вместе со словами и блоками. По умолчанию — без координат."""
+        return OcrText(self.detect_text(image_bytes))
+
+    def batch_detect_text(self, images: list[bytes]) -> list[str | OcrEngineError]:
+        """Распознаёт несколько изображений; ошибка по одному изображению не прерывает остальные."""
+        results: list[str | OcrEngineError] = []
+        for image_bytes in images:
+            try:
+                results.append(self.detect_text(image_bytes))
+            except OcrEngineError as e:
+                results.append(e)
+        return results
+
+
+class VisionOcrEngine(OcrEngine):
+    """Google Cloud Vision. Библиотека импортируется только при создании движка."""
+    name = "vision"
+
+    def __init__(self, credentials_path: str):
+        from google.cloud import vision
+
+        self._vision = vision
+        self.client = None
+        try:
+            if os.path.exists(credentials_path):
+                self.client = vision.ImageAnnotatorClient.from_service_account_file(credentials_path)
+                logger.info(f"Google Vision client initialized with {credentials_path}")
+            else:
+                logger.error(f"Файл {credentials_path} не найден в корне проекта!")
+        except Exception as e:
+            logger.error(f"Could not initialize Google Vision client: {e}")
+
+    def is_ready(self) -> bool:
+        return self.client is not None
+
+    def _describe_error(self, e: Exception) -> OcrEngineError:
+        from google.api_core.exceptions import GoogleAPICallError, PermissionDenied, InvalidArgument
+
+        if isinstance(e, PermissionDenied):
+            return OcrEngineError(f"Доступ запрещен: {e}. Проверьте права сервисного аккаунта.")
+        if isinstance(e, InvalidArgument):
+            return OcrEngineError(f"Неверный аргумент: {e}. Проверьте формат изображения.")
+        if isinstance(e, GoogleAPICallError):
+            return OcrEngineError(f"Ошибка Google API: {e}")
+        return OcrEngineError(f"Неожиданная ошибка: {e}")
+
+    def _text_from_response(self, response) -> str | OcrEngineError:
+        if response.error.message:
+            return OcrEngineError(f'Ошибка Vision API: {response.error.message}')
+        texts = response.text_annotations
+        return texts[0].description if texts else ""
+
+    def _text_detection(self, image_bytes: bytes):
+        return quota_scheduler.call(
+            "vision", "request", self.client.text_detection, image=self._vision.Image(content=image_bytes)
+        )
+
+    def detect_text(self, image_bytes: bytes) -> str:
+        try:
+            response = self._text_detection(image_bytes)
+        except Exception as e:
+            raise self._describe_error(e) from e
+        result = self._text_from_response(response)
+        if isinstance(result, OcrEngineError):
+            raise result
+        return result
+
+    @staticmethod
+    def _box(bounding_poly) -> tuple[int, int, int, int]:
+        xs = [vertex.x for vertex in bounding_poly.vertices]
+        ys = [vertex.y for vertex in bounding_poly.vertices]
+        return min(xs), min(ys), max(xs), max(ys)
+
+    def detect_layout(self, image_bytes: bytes) -> OcrText:
+        try:
+            response = self._text_detection(image_bytes)
+        except Exception as e:
+            raise self._describe_error(e) from e
+        result = self._text_from_response(response)
+        if isinstance(result, OcrEngineError):
+            raise result
+
+        # text_annotations[0] — весь текст, остальные — отдельные слова с рамками
+        words = [
+            OcrWord(annotation.description, *self._box(annotation.bounding_poly))
+            for annotation in response.text_annotations[1:]
+        ]
+        blocks = []
+        for page in response.full_text_annotation.pages:
+            for block in page.blocks:
+                block_text = ' '.join(
+                    ''.join(symbol.text for symbol in word.symbols)
+                    for paragraph in block.paragraphs
+                    for word in paragraph.words
+                )
+                blocks.append(OcrBlock(block_text, *self._box(block.bounding_box)))
+        return OcrText(result, words, blocks)
+
+    def batch_detect_text(self, images: list[bytes]) -> list[str | OcrEngineError]:
+        vision = self._vision
+        text_feature = vision.Feature(type_=vision.Feature.Type.TEXT_DETECTION)
+        requests = [
+            vision.AnnotateImageRequest(image=vision.Image(content=image_bytes), features=[text_feature])
+            for image_bytes in images
+        ]
+        try:
+            # Квота Vision считается по изображениям, а не по HTTP-запросам
+            batch_response = quota_scheduler.call(
+                "vision", "request", self.client.batch_annotate_images, requests=requests, cost=len(images)
+            )
+        except Exception as e:
+            error = self._describe_error(e)
+            return [error] * len(images)
+        return [self._text_from_response(response) for response in batch_response.responses]
+
+
+class ReplayOcrEngine(OcrEngine):
+    """
+    Локальный движок для нагрузочных тестов без Google: отдаёт заранее записанный текст
+    по SHA-256 изображения из файлов <каталог>/<sha256>.txt (или default.txt, если записи нет).
+    Разметка берётся из <sha256>.layout.json: {"words": [[текст, x0, y0, x1, y1], ...]}.
+    Умеет добавлять задержку и случайные ошибки; случайность детерминирована seed'ом.
+    """
+    name = "replay"
+
+    def __init__(self, replay_dir: str, latency_ms: int = 0, jitter_ms: int = 0,
+                 error_rate: float = 0.0, seed: int = 0):
+        self.replay_dir = replay_dir
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.seed = seed
+        self._calls: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def is_ready(self) -> bool:
+        return os.path.isdir(self.replay_dir)
+
+    def _load_recording(self, digest: str) -> str | None:
+        for file_name in (f"{digest}.txt", "default.txt"):
+            path = os.path.join(self.replay_dir, file_name)
+            if os.path.exists(path):
+                with open(path, encoding="utf-8") as f:
+                    return f.read()
+        return None
+
+    def detect_text(self, image_bytes: bytes) -> str:
+        digest = hashlib.sha256(image_bytes).hexdigest()
+        with self._lock:
+            call_number = self._calls.get(digest, 0)
+            self._calls[digest] = call_number + 1
+        # Отдельный генератор на каждый (seed, изображение, номер вызова) — прогоны воспроизводимы
+        rng = random.Random(f"{self.seed}:{digest}:{call_number}")
+
+        delay_ms = self.latency_ms + (rng.uniform(0, self.jitter_ms) if self.jitter_ms else 0)
+        if delay_ms > 0:
+            time.sleep(delay_ms / 1000)
+
+        if self.error_rate and rng.random() < self.error_rate:
+            raise OcrEngineError("Ошибка OCR (replay): смоделированный сбой")
+
+        text = self._load_recording(digest)
+        if text is None:
+            raise OcrEngineError(f"Ошибка OCR (replay): нет записи для изображения {digest[:12]}")
+        return text
+
+    def detect_layout(self, image_bytes: bytes) -> OcrText:
+        text = self.detect_text(image_bytes)
+        digest = hashlib.sha256(image_bytes).hexdigest()
+        layout_path = os.path.join(self.replay_dir, f"{digest}.layout.json")
+        if not os.path.exists(layout_path):
+            return OcrText(text)
+        with open(layout_path, encoding="utf-8") as f:
+            layout = json.load(f)
+        return OcrText(text, [OcrWord(*word) for word in layout.get("words", [])])
+
+
+def record_ocr_result(image_bytes: bytes, text: str) -> None:
+    """Сохраняет успешный результат OCR в settings.ocr_record_dir для последующего replay."""
+    if not settings.ocr_record_dir:
+        return
+    try:
+        os.makedirs(settings.ocr_record_dir, exist_ok=True)
+        digest = hashlib.sha256(image_bytes).hexdigest()
+        with open(os.path.join(settings.ocr_record_dir, f"{digest}.txt"), "w", encoding="utf-8") as f:
+            f.write(text)
+    except OSError as e:
+        logger.warning(f"Не удалось сохранить запись OCR: {e}")
+
+
+_engine: OcrEngine | None = None
+_engine_lock = threading.Lock()
+
+
+def get_ocr_engine() -> OcrEngine:
+    """Создаёт (один раз) OCR-движок, выбранный в settings.ocr_engine."""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            if settings.ocr_engine == "replay":
+                _engine = ReplayOcrEngine(
+                    settings.ocr_replay_dir,
+                    latency_ms=settings.ocr_replay_latency_ms,
+                    jitter_ms=settings.ocr_replay_jitter_ms,
+                    error_rate=settings.ocr_replay_error_rate,
+                    seed=settings.ocr_replay_seed,
+                )
+            elif settings.ocr_engine == "vision":
+                with startup_timer.measure("clients", "google.cloud.vision"):
+                    _engine = VisionOcrEngine(settings.google_credentials_path)
+            else:
+                raise ValueError(f"Неизвестный OCR-движок: '{settings.ocr_engine}'")
+            logger.info(f"OCR-движок: {_engine.name}")
+        return _engine
@@ -0,0 +1,125 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+class AdmissionRejected(Exception):
+    """Очередь на обработку фото заполнена — запрос отклонён сразу, без ожидания."""
+
+
+class PhotoAdmission:
+    """
+    Допуск фото к скачиванию и OCR. Одновременно обрабатывается не более max_active фото
+    (альбом считается одной заявкой), и их суммарный объём в памяти не превышает max_bytes.
+    Остальные заявки ждут в очереди строго по порядку — крупная заявка не голодает
+    за потоком мелких; если в очереди уже max_queue заявок, новая сразу отклоняется.
+    """
+
+    def __init__(self, max_active: int, max_bytes: int, max_queue: int):
+        self.max_active = max_active
+        self.max_bytes = max_bytes
+        self.max_queue = max_queue
+        self._active = 0
+        self._bytes = 0
+        # [future, объём] в порядке поступления
+        self._waiters: deque[list] = deque()
+        self._stats = {"admitted": 0, "queued": 0, "rejected": 0, "wait_total": 0.0, "wait_max": 0.0}
+
+    def _fits(self, cost: int) -> bool:
+        # Заявка крупнее всего бюджета допускается, когда кроме неё ничего не обрабатывается
+        return self._active < self.max_active and (self._active == 0 or self._bytes + cost <= self.max_bytes)
+
+    def _grant(self, cost: int) -> None:
+        self._active += 1
+        self._bytes += cost
+
+    def _release(self, cost: int) -> None:
+        self._active -= 1
+        self._bytes -= cost
+        self._wake_waiters()
+
+    def _wake_waiters(self) -> None:
+        while self._waiters:
+            future, cost = self._waiters[0]
+            if future.done():
+                self._waiters.popleft()
+                continue
+            if not self._fits(cost):
+                break
+            self._waiters.popleft()
+            self._grant(cost)
+            future.set_result(None)
+
+    async def _acquire(self, cost: int, on_queued) -> None:
+        if not self._waiters and self._fits(cost):
+            self._grant(cost)
+            return
+        if len(self._waiters) >= self.max_queue:
+            self._stats["rejected"] += 1
+            raise AdmissionRejected(f"В очереди на обработку уже {len(self._waiters)} фото")
+
+        future = asyncio.get_running_loop().create_future()
+        waiter = [future, cost]
+        self._waiters.append(waiter)
+        self._stats["queued"] += 1
+        try:
+            if on_queued is not None:
+                await on_queued(len(self._waiters))
+            await future
+        except BaseException:
+            if future.done() and not future.cancelled():
+                # Место уже выдано, но ожидающий отменён — возвращаем его следующим
+                self._release(cost)
+            else:
+                future.cancel()
+                self._waiters.remove(waiter)
+                self._wake_waiters()
+            raise
+
+    @asynccontextmanager
+    async def admit(self, cost: int, on_queued=None):
+        """
+        Занимает место для обработки фото объёмом cost байт. Если придётся ждать, вызывает
+        await on_queued(позиция в очереди); при заполненной очереди бросает AdmissionRejected.
+        """
+        queued_at = time.monotonic()
+        await self._acquire(cost, on_queued)
+
+        wait = time.monotonic() - queued_at
+        self._stats["admitted"] += 1
+        self._stats["wait_total"] += wait
+        self._stats["wait_max"] = max(self._stats["wait_max"], wait)
+        if wait > 1:
+            logger.info(f"Фото ждало допуска к обработке {wait:.1f} с")
+        try:
+            yield
+        finally:
+            self._release(cost)
+
+    def get_stats(self) -> dict:
+        """Текущая загрузка, очередь и время ожидания допуска (сек.)."""
+        admitted = self._stats["admitted"]
+        return {
+            "max_active": self.max_active,
+            "active": self._active,
+            "bytes_in_flight": self._bytes,
+            "max_bytes": self.max_bytes,
+            "queue": len(self._waiters),
+            "max_queue": self.max_queue,
+            "admitted": admitted,
+            "queued": self._stats["queued"],
+            "rejected": self._stats["rejected"],
+            "wait_avg": round(self._stats["wait_total"] / admitted, 3) if admitted else 0.0,
+            "wait_max": round(self._stats["wait_max"], 3),
+        }
+
+
+photo_admission = PhotoAdmission(
+    settings.photo_max_concurrency, settings.photo_max_inflight_bytes, settings.photo_max_queue
+)
@@ -0,0 +1,143 @@
+import hashlib
+import logging
+import re
+import sqlite3
+import threading
+import time
+
+from app.services.storage_backends import INCOME_COLS, EXPENSE_COLS
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+_DATE_RE = re.compile(r'(\d{1,2})[./-](\d{1,2})[./-](\d{2,4})')
+_AMOUNT_JUNK_RE = re.compile(r'[^\d,.\-]')
+_TEXT_JUNK_RE = re.compile(r'[^\w]+')
+
+
+def _normalize_date(value) -> str:
+    """«5.3.24», «05.03.2024» и «05/03/2024» дают одно и то же «2024-03-05»."""
+    text = str(value or '')
+    match = _DATE_RE.search(text)
+    if not match:
+        return text.strip()
+    day, month, year = match.groups()
+    if len(year) == 2:
+        year = f"20{year}"
+    return f"{year}-{int(month):02d}-{int(day):02d}"
+
+
+def _normalize_amount(value) -> str:
+    """Сумма в копейках: «1 500,5 ₽», «1500.50» и 1500.5 совпадают."""
+    if isinstance(value, (int, float)):
+        return str(round(value * 100))
+    cleaned = _AMOUNT_JUNK_RE.sub('', str(value or '')).replace(',', '.')
+    try:
+        return str(round(float(cleaned) * 100))
+    except ValueError:
+        return cleaned
+
+
+def _normalize_text(value) -> str:
+    """Регистр, пробелы и знаки препинания не различаются: «Иван И.» == «иван и»."""
+    return _TEXT_JUNK_RE.sub(' ', str(value or '')).strip().casefold()
+
+
+def receipt_fingerprint(pet_name, section: str, date, amount, bank, author) -> int:
+    """
+    Отпечаток записи — 64-битное число из хеша нормализованных полей. Раздел (приход или расход)
+    входит в отпечаток, а в поле банка для расхода стоит назначение платежа — так же,
+    как в третьей колонке раздела на листе.
+    """
+    key = '\x1f'.join((
+        _normalize_text(pet_name), section, _normalize_date(date),
+        _normalize_amount(amount), _normalize_text(bank), _normalize_text(author),
+    ))
+    digest = hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest()
+    # SQLite хранит INTEGER со знаком
+    return int.from_bytes(digest, 'big', signed=True)
+
+
+def transaction_fingerprint(transaction_data: dict) -> int:
+    """Отпечаток транзакции из диалога (поля как в user_data)."""
+    if transaction_data.get('type') == 'expense':
+        section, bank = EXPENSE_COLS["start"], transaction_data.get('procedure')
+    else:
+        section, bank = INCOME_COLS["start"], transaction_data.get('bank')
+    return receipt_fingerprint(
+        transaction_data.get('pet_name'), section, transaction_data.get('date'),
+        transaction_data.get('amount'), bank, transaction_data.get('author'),
+    )
+
+
+def row_fingerprint(pet_name: str, target_cols: dict, row: list) -> int:
+    """Отпечаток строки листа по первым четырём колонкам раздела: дата, сумма, банк (назначение), отправитель."""
+    date, amount, bank, author = (list(row) + [''] * 4)[:4]
+    return receipt_fingerprint(pet_name, target_cols["start"], date, amount, bank, author)
+
+
+class ReceiptIndex:
+    """
+    Индекс уже сохранённых записей для поиска дублей (SQLite). Хранится только 8-байтовый
+    отпечаток нормализованных полей (питомец, дата, сумма, банк, отправитель); ключ таблицы —
+    сам отпечаток (WITHOUT ROWID), так что проверка — один поиск по первичному ключу
+    без обращения к Google Sheets.
+    Индекс пополняется при каждом сохранении и при сверке учёта с таблицей.
+    """
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS receipt_fingerprints ("
+            "fingerprint INTEGER PRIMARY KEY, saved_at REAL NOT NULL) WITHOUT ROWID"
+        )
+        self._db.commit()
+
+    def _contains(self, fingerprint: int) -> bool:
+        return self._db.execute(
+            "SELECT 1 FROM receipt_fingerprints WHERE fingerprint = ?", (fingerprint,)
+        ).fetchone() is not None
+
+    def find_duplicates(self, transactions: list[dict]) -> list[int]:
+        """
+        Индексы транзакций, похожих на уже сохранённые, — в том числе повторы внутри
+        самого списка (один и тот же скриншот дважды в альбоме).
+        """
+        duplicates = []
+        seen = set()
+        with self._lock:
+            for index, transaction_data in enumerate(transactions):
+                fingerprint = transaction_fingerprint(transaction_data)
+                if fingerprint in seen or self._contains(fingerprint):
+                    duplicates.append(index)
+                seen.add(fingerprint)
+        return duplicates
+
+    def _insert(self, fingerprints: list[int]) -> None:
+        now = time.time()
+        with self._lock:
+            try:
+                self._db.executemany(
+                    "INSERT OR IGNORE INTO receipt_fingerprints (fingerprint, saved_at) VALUES (?, ?)",
+                    [(fingerprint, now) for fingerprint in fingerprints],
+                )
+                self._db.commit()
+            except sqlite3.Error as e:
+                self._db.rollback()
+                logger.error(f"Не удалось обновить индекс дублей: {e}")
+
+    def add_sheets(self, sheets: dict[str, list[tuple[dict, list[list]]]]) -> None:
+        """
+        Добавляет строки листов: только что записанные в таблицу и все строки при сверке —
+        так индекс знает и о записях, внесённых вручную.
+        """
+        self._insert([
+            row_fingerprint(pet_name, target_cols, row)
+            for pet_name, sections in sheets.items()
+            for target_cols, rows in sections
+            for row in rows
+        ])
+
+
+receipt_index = ReceiptIndex(settings.receipt_index_path)
@@ -0,0 +1,163 @@
+import asyncio
+import logging
+import multiprocessing
+import threading
+import time
+from multiprocessing.pool import Pool
+
+from app.services.data_parser import (
+    parse_field, parse_multiple_transactions, parse_transaction_data, transaction_fields
+)
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+# Регулярные выражения нельзя прервать изнутри потока, поэтому разбор идёт в дочерних
+# процессах. Если чек не уложился в бюджет, пул целиком пересоздаётся, а зависшие процессы
+# завершаются — event loop не страдает. Чужие задачи, которые были в работе в пуле
+# в этот момент, их владельцы отправляют в новый пул заново (см. _run_with_budget).
+_pool: Pool | None = None
+_pool_lock = threading.Lock()
+
+_parser_stats = {
+    "parsed": 0,
+    "over_budget": 0,
+    "pool_restarts": 0,
+    "resubmitted": 0,
+}
+
+# Как часто ожидающий результата проверяет, не пересоздали ли пул из-за чужого чека (сек.)
+_RESTART_CHECK_INTERVAL = 0.05
+
+def get_parser_stats() -> dict:
+    """Метрики безопасного разбора: сколько чеков разобрано и сколько не уложились в бюджет."""
+    return {"safe_mode": settings.parser_safe_mode, "time_budget": settings.parser_time_budget, **_parser_stats}
+
+def _get_pool() -> Pool:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn, а не fork: процесс бота многопоточный (OCR, Sheets), fork в нём небезопасен
+            _pool = multiprocessing.get_context("spawn").Pool(settings.parser_workers)
+        return _pool
+
+def _restart_pool(pool: Pool) -> None:
+    """Завершает пул с зависшими задачами; новый будет создан при следующем разборе."""
+    global _pool
+    with _pool_lock:
+        if _pool is not pool:
+            return
+        _pool = None
+    _parser_stats["pool_restarts"] += 1
+    pool.terminate()
+
+def start_parser_pool() -> None:
+    """Заранее запускает процессы разбора, чтобы первый чек не ждал их старта."""
+    if settings.parser_safe_mode:
+        _get_pool()
+
+def shutdown_parser_pool() -> None:
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.terminate()
+        pool.join()
+
+def _truncate(text: str) -> str:
+    if len(text) > settings.parser_max_text_chars:
+        logger.warning(f"Текст для разбора обрезан: {len(text)} -> {settings.parser_max_text_chars} символов")
+        return text[:settings.parser_max_text_chars]
+    return text
+
+def _submit(calls: dict) -> tuple[Pool, dict]:
+    while True:
+        pool = _get_pool()
+        try:
+            return pool, {key: pool.apply_async(func, args) for key, (func, args) in calls.items()}
+        except ValueError:
+            # Пул успели остановить из-за чужого зависшего чека — берём новый
+            continue
+
+def _run_with_budget(calls: dict) -> tuple[dict, list]:
+    """
+    Выполняет вызовы {ключ: (функция, аргументы)} в пуле и ждёт их не дольше
+    settings.parser_time_budget. Возвращает результаты готовых вызовов и ключи тех,
+    что не успели; в этом случае пул пересоздаётся. Если пул пересоздали из-за чужого
+    чека, незавершённые вызовы отправляются в новый пул с новым бюджетом.
+    """
+    pool, pending = _submit(calls)
+    deadline = time.monotonic() + settings.parser_time_budget
+    results = {}
+    while True:
+        for key, async_result in list(pending.items()):
+            if async_result.ready():
+                del pending[key]
+                try:
+                    results[key] = async_result.get()
+                except Exception as e:
+                    logger.error(f"Ошибка разбора '{key}': {e}")
+                    results[key] = None
+        if not pending:
+            return results, []
+
+        if _pool is not pool:
+            _parser_stats["resubmitted"] += len(pending)
+            pool, pending = _submit({key: calls[key] for key in pending})
+            deadline = time.monotonic() + settings.parser_time_budget
+            continue
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            _restart_pool(pool)
+            return results, list(pending)
+        next(iter(pending.values())).wait(min(remaining, _RESTART_CHECK_INTERVAL))
+
+def _parse_with_budget(text: str, transaction_type: str) -> dict:
+    results, timed_out = _run_with_budget({
+        field: (parse_field, (field, text, transaction_type))
+        for field in transaction_fields(transaction_type)
+    })
+    result = {field: results.get(field) for field in transaction_fields(transaction_type)}
+
+    _parser_stats["parsed"] += 1
+    if timed_out:
+        _parser_stats["over_budget"] += 1
+        logger.warning(
+            f"Разбор не уложился в {settings.parser_time_budget} с, поля без значения: {', '.join(timed_out)}. "
+            f"Пул процессов разбора пересоздан."
+        )
+    return result
+
+def _parse_multiple_with_budget(text: str) -> list[dict]:
+    results, timed_out = _run_with_budget({"transactions": (parse_multiple_transactions, (text,))})
+
+    _parser_stats["parsed"] += 1
+    if timed_out:
+        _parser_stats["over_budget"] += 1
+        logger.warning(
+            f"Разбор списка операций не уложился в {settings.parser_time_budget} с. "
+            f"Пул процессов разбора пересоздан."
+        )
+    return results.get("transactions") or []
+
+async def parse_transaction_data_safe(text: str, transaction_type: str) -> dict:
+    """
+    parse_transaction_data с ограничением времени: поля разбираются параллельно в пуле
+    процессов, и всё, что не готово к истечению settings.parser_time_budget, возвращается как None.
+    """
+    text = _truncate(text)
+    if not settings.parser_safe_mode:
+        return parse_transaction_data(text, transaction_type)
+    return await asyncio.to_thread(_parse_with_budget, text, transaction_type)
+
+async def parse_multiple_transactions_safe(text: str) -> list[dict]:
+    """
+    parse_multiple_transactions с тем же ограничением времени: разбор идёт в пуле процессов,
+    и если он не уложился в settings.parser_time_budget, возвращается пустой список.
+    Текст не обрезается: разбор линейный, а в длинной истории операций обрезка молча
+    потеряла бы последние переводы.
+    """
+    if not settings.parser_safe_mode:
+        return parse_multiple_transactions(text)
+    return await asyncio.to_thread(_parse_multiple_with_budget, text)
@@ -1,83 +1,331 @@
+import asyncio
+import contextvars
 import gspread
+import itertools
 import os
-from gspread.exceptions import APIError, WorksheetNotFound
+import queue
+import random
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from gspread.exceptions import APIError
+from gspread.http_client import HTTPClient
+from gspread.utils import extract_id_from_url
 import logging
 
+from app.services.google_quota import PRIORITY_BACKGROUND, background_priority, quota_scheduler, request_priority
+from app.services.ledger import ledger
+from app.services.receipt_index import receipt_index
+from app.services.startup_timing import startup_timer
+from app.services.storage_backends import (
+    EXPENSE_COLS, FIRST_DATA_ROW, INCOME_COLS, StorageBackend, StorageError, get_storage_backend
+)
+from config.settings import settings
+
 logger = logging.getLogger(__name__)
 
 CREDENTIALS_FILE = "credentials.json"
 SPREADSHEET_NAME = "HvostatyeSosediBot_DB"
 TEMPLATE_SHEET_NAME = "Шаблон"
+# Сколько листов читать одним запросом values.batchGet при сверке
+SHEETS_BATCH_GET_LIMIT = 50
 
-INCOME_COLS = {
-    "start": "A", "end": "E", "check_col_index": 1,
-}
-EXPENSE_COLS = {
-    "start": "G", "end": "K", "check_col_index": 7,
-}
 
 def get_spreadsheet_link(spreadsheet: gspread.Spreadsheet, worksheet: gspread.Worksheet) -> str:
     return f"https://docs.google.com/spreadsheets/d/{spreadsheet.id}/edit#gid={worksheet.id}"
 
+def _new_sheet_id() -> int:
+    """id для нового листа задаём сами, чтобы сослаться на лист в том же batchUpdate."""
+    return random.randint(1, 2**31 - 1)
+
+def _cell_value_request(sheet_id: int, row: int, col: int, values: list[str]) -> dict:
+    """Запрос updateCells: строка значений, начиная с ячейки (row, col), нумерация с нуля."""
+    return {
+        "updateCells": {
+            "start": {"sheetId": sheet_id, "rowIndex": row, "columnIndex": col},
+            "rows": [{"values": [{"userEnteredValue": {"stringValue": value}} for value in values]}],
+            "fields": "userEnteredValue",
+        }
+    }
+
+def _provision_worksheet(spreadsheet: gspread.Spreadsheet, requests: list[dict], reply_key: str,
+                         rows: int) -> gspread.Worksheet:
+    """Выполняет подготовленные запросы одним batchUpdate и возвращает созданный лист."""
+    response = spreadsheet.batch_update({"requests": requests})
+    properties = response["replies"][0][reply_key]["properties"]
+    # Ответ описывает лист сразу после создания, до изменения числа строк
+    properties.setdefault("gridProperties", {})["rowCount"] = rows
+    return gspread.Worksheet(spreadsheet, properties, spreadsheet.id, spreadsheet.client)
+
 def _create_fallback_worksheet(spreadsheet: gspread.Spreadsheet, sheet_name: str) -> gspread.Worksheet | None:
     logger.warning(f"Шаблон '{TEMPLATE_SHEET_NAME}' не найден! Создается базовый лист для '{sheet_name}'.")
+    sheet_id = _new_sheet_id()
+    rows = settings.sheets_new_sheet_rows
+    income_headers = ["Дата", "Сумма", "Банк", "Автор", "Комментарий"]
+    expense_headers = ["Дата", "Сумма", "Процедура", "Автор", "Комментарий"]
+    requests = [
+        {"addSheet": {"properties": {
+            "sheetId": sheet_id, "title": sheet_name,
+            "gridProperties": {"rowCount": rows, "columnCount": 20},
+        }}},
+        _cell_value_request(sheet_id, 0, 5, [sheet_name]),     # F1
+        _cell_value_request(sheet_id, 1, 0, ['Приход']),       # A2
+        _cell_value_request(sheet_id, 1, 6, ['Расход']),       # G2
+        _cell_value_request(sheet_id, 2, 0, income_headers),   # A3:E3
+        _cell_value_request(sheet_id, 2, 6, expense_headers),  # G3:K3
+    ]
     try:
-        worksheet = spreadsheet.add_worksheet(title=sheet_name, rows="300", cols="20")
-        
-        worksheet.update('F1', sheet_name)
-        worksheet.update('A2', 'Приход')
-        worksheet.update('G2', 'Расход')
-        
-        income_headers = ["Дата", "Сумма", "Банк", "Автор", "Комментарий"]
-        expense_headers = ["Дата", "Сумма", "Процедура", "Автор", "Комментарий"]
-        worksheet.update('A3', [income_headers])
-        worksheet.update('G3', [expense_headers])
-        
-        return worksheet
+        return _provision_worksheet(spreadsheet, requests, "addSheet", rows)
     except APIError as e:
         logger.error(f"Не удалось создать даже базовый лист: {e}")
         return None
 
 def _find_or_create_worksheet(spreadsheet: gspread.Spreadsheet, pet_name: str) -> gspread.Worksheet | None:
-    try:
-        return spreadsheet.worksheet(pet_name)
-    except WorksheetNotFound:
-        logger.info(f"Лист для '{pet_name}' не найден. Ищем шаблон '{TEMPLATE_SHEET_NAME}' для копирования.")
+    worksheet = sheets_client.find_worksheet(pet_name)
+    if worksheet:
+        return worksheet
+    logger.info(f"Лист для '{pet_name}' не найден. Ищем шаблон '{TEMPLATE_SHEET_NAME}' для копирования.")
 
-    try:
-        template_worksheet = spreadsheet.worksheet(TEMPLATE_SHEET_NAME)
-        new_worksheet = template_worksheet.duplicate(new_sheet_name=pet_name)
-        new_worksheet.update_cell(1, 6, pet_name)
-        
-        logger.info(f"✅ Шаблон '{TEMPLATE_SHEET_NAME}' успешно скопирован в новый лист '{pet_name}'.")
-        return new_worksheet
-    except WorksheetNotFound:
-        return _create_fallback_worksheet(spreadsheet, pet_name)
-    except APIError as e:
-        logger.error(f"Ошибка API при копировании шаблона: {e}")
-        return None
+    template_worksheet = sheets_client.find_worksheet(TEMPLATE_SHEET_NAME)
+    if template_worksheet is None:
+        new_worksheet = _create_fallback_worksheet(spreadsheet, pet_name)
+    else:
+        # Копия шаблона, имя питомца в F1 и запас строк — одним запросом
+        sheet_id = _new_sheet_id()
+        rows = max(settings.sheets_new_sheet_rows, template_worksheet.row_count)
+        requests = [
+            {"duplicateSheet": {
+                "sourceSheetId": template_worksheet.id, "newSheetId": sheet_id, "newSheetName": pet_name,
+            }},
+            _cell_value_request(sheet_id, 0, 5, [pet_name]),
+            {"updateSheetProperties": {
+                "properties": {"sheetId": sheet_id, "gridProperties": {"rowCount": rows}},
+                "fields": "gridProperties.rowCount",
+            }},
+        ]
+        try:
+            new_worksheet = _provision_worksheet(spreadsheet, requests, "duplicateSheet", rows)
+            logger.info(f"✅ Шаблон '{TEMPLATE_SHEET_NAME}' успешно скопирован в новый лист '{pet_name}'.")
+        except APIError as e:
+            logger.error(f"Ошибка API при копировании шаблона: {e}")
+            return None
 
-def write_transaction(transaction_data: dict) -> str | None:
-    if not os.path.exists(CREDENTIALS_FILE):
-        logger.critical(f"КРИТИЧЕСКАЯ ОШИБКА: Файл {CREDENTIALS_FILE} не найден!")
-        return None
+    if new_worksheet:
+        sheets_client.remember_worksheet(new_worksheet)
+    return new_worksheet
 
-    try:
-        gc = gspread.service_account(filename=CREDENTIALS_FILE)
-        spreadsheet = gc.open(SPREADSHEET_NAME)
-    except Exception as e:
-        logger.error(f"Не удалось получить доступ к Google Sheets: {e}", exc_info=True)
-        return None
+class QuotaHTTPClient(HTTPClient):
+    """HTTP-клиент gspread, пропускающий каждый запрос к API через общий планировщик квот."""
+
+    def request(self, method, endpoint, *args, **kwargs):
+        quota_class = "read" if method.lower() == "get" else "write"
+        return quota_scheduler.call("sheets", quota_class, super().request, method, endpoint, *args, **kwargs)
+
+
+class SheetsClient:
+    """
+    Долгоживущий клиент Google Sheets. Ключи сервисного аккаунта читаются один раз,
+    HTTP-сессия gspread переиспользуется между записями, а таблица открывается по id
+    из settings.GOOGLE_SHEETS_LINK (без поиска по названию в Drive) и хранится.
+    Все вызовы gspread выполняются в одном выделенном потоке: асинхронные методы
+    не блокируют event loop, а сам клиент не используется из нескольких потоков сразу.
+    Вызовы ждут потока в очереди с приоритетом: интерактивные идут раньше фоновых.
+    """
+
+    def __init__(self, credentials_file: str, spreadsheet_link: str):
+        self.credentials_file = credentials_file
+        self.spreadsheet_link = spreadsheet_link
+        self._gc: gspread.Client | None = None
+        self._spreadsheet: gspread.Spreadsheet | None = None
+        self._lock = threading.Lock()
+        # Очередь вызовов для потока клиента: (приоритет, порядковый номер, вызов)
+        self._calls: queue.PriorityQueue = queue.PriorityQueue()
+        self._call_numbers = itertools.count()
+        self._thread: threading.Thread | None = None
+        self._refresh_task: asyncio.Task | None = None
+        # Кэш листов: название -> Worksheet, загружается одним запросом метаданных таблицы
+        self._worksheets: dict[str, gspread.Worksheet] | None = None
+        self._worksheets_loaded_at = 0.0
+
+    def _get_client(self) -> gspread.Client | None:
+        if self._gc is None:
+            if not os.path.exists(self.credentials_file):
+                logger.critical(f"КРИТИЧЕСКАЯ ОШИБКА: Файл {self.credentials_file} не найден!")
+                return None
+            with startup_timer.measure("clients", "gspread"):
+                self._gc = gspread.service_account(filename=self.credentials_file, http_client=QuotaHTTPClient)
+            logger.info("Клиент Google Sheets инициализирован")
+        return self._gc
+
+    def get_spreadsheet(self) -> gspread.Spreadsheet | None:
+        """Открытая таблица; при первом обращении — авторизация и открытие по id."""
+        with self._lock:
+            if self._spreadsheet is not None:
+                return self._spreadsheet
+            try:
+                gc = self._get_client()
+                if gc is None:
+                    return None
+                try:
+                    spreadsheet_id = extract_id_from_url(self.spreadsheet_link)
+                except gspread.exceptions.NoValidUrlKeyFound:
+                    spreadsheet_id = None
+                if spreadsheet_id:
+                    self._spreadsheet = gc.open_by_key(spreadsheet_id)
+                else:
+                    logger.warning(f"В GOOGLE_SHEETS_LINK нет id таблицы, ищем по названию '{SPREADSHEET_NAME}'")
+                    self._spreadsheet = gc.open(SPREADSHEET_NAME)
+                logger.info(f"Таблица '{self._spreadsheet.title}' открыта (id {self._spreadsheet.id})")
+            except Exception as e:
+                logger.error(f"Не удалось получить доступ к Google Sheets: {e}", exc_info=True)
+                return None
+            return self._spreadsheet
+
+    def _load_worksheets(self, spreadsheet: gspread.Spreadsheet) -> dict[str, gspread.Worksheet]:
+        self._worksheets = {worksheet.title: worksheet for worksheet in spreadsheet.worksheets()}
+        self._worksheets_loaded_at = time.monotonic()
+        logger.info(f"Загружены метаданные таблицы: {len(self._worksheets)} листов")
+        return self._worksheets
+
+    def find_worksheet(self, title: str) -> gspread.Worksheet | None:
+        """
+        Лист по названию из кэша, без запросов к API. Кэш перечитывается, если устарел
+        (settings.sheets_metadata_ttl) или если листа в нём нет — его могли создать вручную.
+        """
+        spreadsheet = self.get_spreadsheet()
+        if spreadsheet is None:
+            return None
+        with self._lock:
+            worksheets = self._worksheets
+            expired = time.monotonic() - self._worksheets_loaded_at > settings.sheets_metadata_ttl
+            if worksheets is None or expired:
+                worksheets = self._load_worksheets(spreadsheet)
+            elif title not in worksheets:
+                worksheets = self._load_worksheets(spreadsheet)
+            return worksheets.get(title)
+
+    def worksheet_titles(self) -> list[str]:
+        """Названия всех листов таблицы (из кэша метаданных)."""
+        spreadsheet = self.get_spreadsheet()
+        if spreadsheet is None:
+            return []
+        with self._lock:
+            worksheets = self._worksheets
+            if worksheets is None or time.monotonic() - self._worksheets_loaded_at > settings.sheets_metadata_ttl:
+                worksheets = self._load_worksheets(spreadsheet)
+            return list(worksheets)
+
+    def remember_worksheet(self, worksheet: gspread.Worksheet) -> None:
+        """Добавляет в кэш только что созданный лист."""
+        with self._lock:
+            if self._worksheets is not None:
+                self._worksheets[worksheet.title] = worksheet
+
+    def invalidate_worksheets(self) -> None:
+        """Сбрасывает кэш листов, например после ошибки записи на удалённый/переименованный лист."""
+        with self._lock:
+            self._worksheets = None
+
+    def refresh_token_if_needed(self) -> None:
+        """Обновляет токен доступа заранее, чтобы запись не ждала обмена ключа на токен."""
+        with self._lock:
+            if self._gc is None:
+                return
+            credentials = self._gc.http_client.auth
+            margin = timedelta(seconds=settings.sheets_token_refresh_margin)
+            # expiry у google-auth — наивное время в UTC
+            now = datetime.now(timezone.utc).replace(tzinfo=None)
+            if credentials.valid and credentials.expiry and credentials.expiry - now > margin:
+                return
+            from google.auth.transport.requests import Request
 
-    pet_name = transaction_data.get('pet_name', '').strip().capitalize()
+            # Отдельная сессия: у сессии gspread (AuthorizedSession) свой механизм обновления токена
+            credentials.refresh(Request())
+            logger.info(f"Токен Google Sheets обновлён, действует до {credentials.expiry:%H:%M:%S} UTC")
+
+    async def run_in_thread(self, func, *args):
+        """
+        Выполняет синхронный вызов gspread в потоке клиента. Вызов встаёт в очередь
+        с приоритетом из контекста (request_priority), и контекст передаётся в поток
+        вместе с ним — его видит и планировщик квот.
+        """
+        context = contextvars.copy_context()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._serve_calls, name="sheets", daemon=True)
+            self._thread.start()
+        self._calls.put((request_priority.get(), next(self._call_numbers), (loop, future, context, func, args)))
+        return await future
+
+    def _serve_calls(self) -> None:
+        while True:
+            _, _, call = self._calls.get()
+            if call is None:
+                return
+            loop, future, context, func, args = call
+            if future.cancelled():
+                continue
+            try:
+                result = context.run(func, *args)
+            except BaseException as e:
+                loop.call_soon_threadsafe(_resolve_future, future, None, e)
+            else:
+                loop.call_soon_threadsafe(_resolve_future, future, result, None)
+
+    async def _token_refresh_loop(self) -> None:
+        while True:
+            try:
+                with background_priority():
+                    await self.run_in_thread(self.get_spreadsheet)
+                    await self.run_in_thread(self.refresh_token_if_needed)
+            except Exception as e:
+                logger.warning(f"Не удалось обновить токен Google Sheets: {e}")
+            await asyncio.sleep(settings.sheets_token_refresh_interval)
+
+    def start(self) -> None:
+        """Запускает фоновое подключение к таблице и периодическое обновление токена."""
+        if self._refresh_task is None:
+            self._refresh_task = asyncio.get_running_loop().create_task(self._token_refresh_loop())
+
+    async def stop(self) -> None:
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            try:
+                await self._refresh_task
+            except asyncio.CancelledError:
+                pass
+            self._refresh_task = None
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            # Метка остановки — после всех уже поставленных вызовов, включая фоновые
+            self._calls.put((PRIORITY_BACKGROUND + 1, next(self._call_numbers), None))
+            await asyncio.to_thread(thread.join)
+
+
+def _resolve_future(future: asyncio.Future, result, error: BaseException | None) -> None:
+    if future.cancelled():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+sheets_client = SheetsClient(CREDENTIALS_FILE, settings.GOOGLE_SHEETS_LINK)
+
+
+async def write_transactions_async(transactions: list[dict]) -> list[str | None]:
+    """write_transactions в потоке клиента Sheets, не блокируя event loop."""
+    return await sheets_client.run_in_thread(write_transactions, transactions)
+
+def _prepare_row(transaction_data: dict) -> tuple[str, dict, list] | None:
+    """Лист, раздел (колонки прихода или расхода) и значения строки для одной записи."""
+    pet_name = (transaction_data.get('pet_name') or '').strip().capitalize()
     if not pet_name:
         logger.error("В данных транзакции отсутствует 'pet_name'. Операция прервана.")
         return None
 
-    worksheet = _find_or_create_worksheet(spreadsheet, pet_name)
-    if not worksheet:
-        return None
-
     trans_type = transaction_data.get('type')
     
     if trans_type in ['income', 'transaction']:
@@ -101,20 +349,107 @@ def write_transaction(transaction_data: dict) -> str | None:
     else:
         logger.error(f"Неизвестный тип транзакции: '{trans_type}'")
         return None
+    return pet_name, target_cols, row_data
 
-    try:
-        col_values = worksheet.col_values(target_cols["check_col_index"])
-        next_row = len(col_values) + 1
-        if next_row < 4: next_row = 4
-        
-        write_range = f'{target_cols["start"]}{next_row}:{target_cols["end"]}{next_row}'
-        worksheet.update(write_range, [row_data], value_input_option='USER_ENTERED')
-        
-        sheet_link = get_spreadsheet_link(spreadsheet, worksheet)
-        
-        logger.info(f"✅ Запись добавлена на лист '{worksheet.title}', диапазон {write_range}")
-        logger.info(f"📎 Ссылка на лист: {sheet_link}")
-        return sheet_link
-    except Exception as e:
-        logger.error(f"⚠️ Ошибка при записи данных на лист '{worksheet.title}': {e}", exc_info=True)
-        return None
\ No newline at end of file
+class GoogleSheetsStorage(StorageBackend):
+    """Хранилище записей в Google Sheets: лист на каждого питомца в общей таблице."""
+    name = "sheets"
+
+    def is_ready(self) -> bool:
+        return os.path.exists(sheets_client.credentials_file)
+
+    def _worksheet(self, pet_name: str) -> tuple[gspread.Spreadsheet, gspread.Worksheet]:
+        spreadsheet = sheets_client.get_spreadsheet()
+        if spreadsheet is None:
+            raise StorageError("Нет доступа к Google Sheets")
+        worksheet = _find_or_create_worksheet(spreadsheet, pet_name)
+        if not worksheet:
+            raise StorageError(f"Не удалось получить или создать лист '{pet_name}'")
+        return spreadsheet, worksheet
+
+    def write_rows(self, pet_name: str, sections: list[tuple[dict, list[list]]]) -> str:
+        """
+        Каждый раздел дописывается запросом values.append: свободную строку выбирает
+        Google, поэтому одновременные записи из разных воркеров не затирают друг друга.
+        """
+        spreadsheet, worksheet = self._worksheet(pet_name)
+        for target_cols, rows in sections:
+            table_range = f'{target_cols["start"]}{FIRST_DATA_ROW}:{target_cols["end"]}'
+            try:
+                response = worksheet.append_rows(
+                    rows, value_input_option='USER_ENTERED', insert_data_option='OVERWRITE',
+                    table_range=table_range,
+                )
+            except Exception as e:
+                # Лист могли удалить или переименовать — при следующей записи перечитаем метаданные
+                sheets_client.invalidate_worksheets()
+                raise StorageError(f"Ошибка при записи данных на лист '{worksheet.title}': {e}") from e
+            written_range = response.get('updates', {}).get('updatedRange', table_range)
+            logger.info(f"✅ Записи ({len(rows)} шт.) добавлены на лист '{worksheet.title}', диапазон {written_range}")
+        return get_spreadsheet_link(spreadsheet, worksheet)
+
+    def read_sheets(self) -> dict[str, list[tuple[dict, list[list]]]]:
+        """
+        Читает данные всех листов питомцев запросами values.batchGet — по
+        SHEETS_BATCH_GET_LIMIT листов за запрос, обе таблицы листа (A:K) одним диапазоном.
+        """
+        spreadsheet = sheets_client.get_spreadsheet()
+        if spreadsheet is None:
+            raise StorageError("Нет доступа к Google Sheets")
+        titles = [title for title in sheets_client.worksheet_titles() if title != TEMPLATE_SHEET_NAME]
+
+        sheets = {}
+        for start in range(0, len(titles), SHEETS_BATCH_GET_LIMIT):
+            chunk = titles[start:start + SHEETS_BATCH_GET_LIMIT]
+            ranges = [f"'{title.replace(chr(39), chr(39) * 2)}'!A{FIRST_DATA_ROW}:K" for title in chunk]
+            # Числа — без форматирования, даты — как они показаны в таблице
+            response = spreadsheet.values_batch_get(ranges, params={
+                "valueRenderOption": "UNFORMATTED_VALUE", "dateTimeRenderOption": "FORMATTED_STRING",
+            })
+            for title, value_range in zip(chunk, response.get("valueRanges", [])):
+                rows = value_range.get("values", [])
+                sheets[title] = [
+                    (INCOME_COLS, [row[0:5] for row in rows if any(row[0:5])]),
+                    (EXPENSE_COLS, [row[6:11] for row in rows if any(row[6:11])]),
+                ]
+        return sheets
+
+
+def write_transactions(transactions: list[dict]) -> list[str | None]:
+    """
+    Записывает несколько транзакций: строки группируются по листу питомца и разделу,
+    и на каждый раздел листа уходит одна операция хранилища (для Google Sheets — один
+    запрос values.append со всеми его строками). Раздел записывается целиком или не
+    записывается вовсе, поэтому журнал может повторить ровно то, что не записалось.
+    Возвращает по элементу на каждую транзакцию — ссылку на лист или None, если запись не удалась.
+    """
+    results: list[str | None] = [None] * len(transactions)
+    backend = get_storage_backend()
+
+    # лист -> раздел ("A"/"G") -> (колонки, [(индекс транзакции, строка)])
+    groups: dict[str, dict[str, tuple[dict, list[tuple[int, list]]]]] = {}
+    for index, transaction_data in enumerate(transactions):
+        prepared = _prepare_row(transaction_data)
+        if prepared is None:
+            continue
+        pet_name, target_cols, row_data = prepared
+        sections = groups.setdefault(pet_name, {})
+        sections.setdefault(target_cols["start"], (target_cols, []))[1].append((index, row_data))
+
+    for pet_name, sections in groups.items():
+        for target_cols, rows in sections.values():
+            written_sections = [(target_cols, [row_data for _, row_data in rows])]
+            try:
+                sheet_link = backend.write_rows(pet_name, written_sections)
+            except StorageError as e:
+                logger.error(f"⚠️ {e}")
+                continue
+            ledger.record(pet_name, written_sections)
+            # Отпечатки — только для строк, которые действительно оказались в таблице
+            receipt_index.add_sheets({pet_name: written_sections})
+
+            for index, _ in rows:
+                results[index] = sheet_link
+            logger.info(f"📎 Ссылка на лист: {sheet_link}")
+
+    return results
@@ -0,0 +1,293 @@
+import asyncio
+import json
+import logging
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import nullcontext
+
+from app.services.google_quota import background_priority
+from app.services.sheets_client import write_transactions_async
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+# Поля транзакции, которые нужны для записи в таблицу (остальное в user_data не сохраняем)
+JOURNAL_FIELDS = ('pet_name', 'type', 'date', 'amount', 'bank', 'procedure', 'author', 'comment')
+
+
+class SheetsJournal:
+    """
+    Локальный журнал записей для Google Sheets (SQLite в режиме WAL). Подтверждённая
+    пользователем запись сначала попадает сюда и только потом — в таблицу, поэтому
+    ошибка API или перезапуск бота её не теряют. Записи одного сохранения объединены batch_id.
+    Воркер забирает записи «в аренду» (lease_until): если процесс упал посреди записи,
+    после истечения аренды записи снова станут доступны.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=FULL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS sheets_journal ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, batch_id TEXT NOT NULL, chat_id INTEGER, "
+            "payload TEXT NOT NULL, status TEXT NOT NULL DEFAULT 'pending', "
+            "attempts INTEGER NOT NULL DEFAULT 0, next_attempt_at REAL NOT NULL DEFAULT 0, "
+            "lease_until REAL NOT NULL DEFAULT 0, sheet_link TEXT, last_error TEXT, "
+            "notified INTEGER NOT NULL DEFAULT 0, created_at REAL NOT NULL)"
+        )
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS sheets_journal_due ON sheets_journal(status, next_attempt_at)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS sheets_journal_batch ON sheets_journal(batch_id)")
+        self._db.commit()
+        logger.info(f"Журнал записей в Google Sheets: {path}")
+
+    def enqueue(self, chat_id: int | None, transactions: list[dict]) -> str:
+        """Сохраняет записи одного подтверждения и возвращает их batch_id."""
+        batch_id = uuid.uuid4().hex
+        now = time.time()
+        rows = [
+            (batch_id, chat_id, json.dumps({k: tx.get(k) for k in JOURNAL_FIELDS}, ensure_ascii=False), now)
+            for tx in transactions
+        ]
+        with self._lock:
+            self._db.executemany(
+                "INSERT INTO sheets_journal (batch_id, chat_id, payload, created_at) VALUES (?, ?, ?, ?)", rows
+            )
+            self._db.commit()
+        return batch_id
+
+    def claim(self, limit: int, lease_seconds: float, due_only: bool = True) -> list[tuple[int, str, int, dict]]:
+        """
+        Забирает до limit ожидающих записей: [(id, batch_id, число попыток, транзакция)].
+        Новые записи идут раньше повторных. Выбор и аренда — один оператор UPDATE, поэтому
+        воркеры разных процессов не заберут одну и ту же запись.
+        """
+        now = time.time()
+        due_before = now if due_only else float('inf')
+        with self._lock:
+            rows = self._db.execute(
+                "UPDATE sheets_journal SET lease_until = ? WHERE id IN ("
+                "SELECT id FROM sheets_journal "
+                "WHERE status = 'pending' AND next_attempt_at <= ? AND lease_until <= ? "
+                "ORDER BY attempts > 0, id LIMIT ?) "
+                "RETURNING id, batch_id, attempts, payload",
+                (now + lease_seconds, due_before, now, limit),
+            ).fetchall()
+            self._db.commit()
+        # RETURNING не сохраняет порядок подзапроса
+        rows.sort(key=lambda row: (row[2] > 0, row[0]))
+        return [(row_id, batch_id, attempts, json.loads(payload)) for row_id, batch_id, attempts, payload in rows]
+
+    def complete(self, results: list[tuple[int, str]]) -> None:
+        """Отмечает записи [(id, ссылка на лист)] как сохранённые в таблице."""
+        with self._lock:
+            self._db.executemany(
+                "UPDATE sheets_journal SET status = 'done', sheet_link = ?, lease_until = 0 WHERE id = ?",
+                [(link, row_id) for row_id, link in results],
+            )
+            self._db.commit()
+
+    def retry_later(self, row_ids: list[int], error: str) -> None:
+        """Откладывает записи с экспоненциальной паузой; после settings.sheets_max_attempts — ошибка."""
+        now = time.time()
+        with self._lock:
+            for row_id in row_ids:
+                attempts = self._db.execute(
+                    "SELECT attempts FROM sheets_journal WHERE id = ?", (row_id,)
+                ).fetchone()[0] + 1
+                if attempts >= settings.sheets_max_attempts:
+                    self._db.execute(
+                        "UPDATE sheets_journal SET status = 'failed', attempts = ?, last_error = ?, "
+                        "lease_until = 0 WHERE id = ?",
+                        (attempts, error, row_id),
+                    )
+                    continue
+                delay = min(settings.sheets_retry_base_delay * 2 ** (attempts - 1), settings.sheets_retry_max_delay)
+                delay *= random.uniform(0.5, 1.0)
+                self._db.execute(
+                    "UPDATE sheets_journal SET attempts = ?, next_attempt_at = ?, last_error = ?, "
+                    "lease_until = 0 WHERE id = ?",
+                    (attempts, now + delay, error, row_id),
+                )
+            self._db.commit()
+
+    def take_finished_batch(self, batch_id: str) -> dict | None:
+        """
+        Если в пакете не осталось ожидающих записей и о нём ещё не сообщали пользователю,
+        отмечает его как сообщённый и возвращает итог: chat_id, питомец, сохранено, ошибок, ссылка.
+        """
+        with self._lock:
+            # Отметка и проверка — один оператор: о пакете сообщит только один процесс
+            rows = self._db.execute(
+                "UPDATE sheets_journal SET notified = 1 WHERE batch_id = ? AND notified = 0 "
+                "AND NOT EXISTS (SELECT 1 FROM sheets_journal WHERE batch_id = ? AND status = 'pending') "
+                "RETURNING chat_id, payload, status, sheet_link",
+                (batch_id, batch_id),
+            ).fetchall()
+            self._db.commit()
+        if not rows:
+            return None
+
+        links = [link for _, _, status, link in rows if status == 'done' and link]
+        return {
+            "chat_id": rows[0][0],
+            "pet_name": json.loads(rows[0][1]).get('pet_name'),
+            "done": sum(1 for _, _, status, _ in rows if status == 'done'),
+            "failed": sum(1 for _, _, status, _ in rows if status == 'failed'),
+            "sheet_link": links[0] if links else None,
+        }
+
+    def prune(self, older_than_seconds: float) -> None:
+        """Удаляет давно сохранённые записи, о которых пользователю уже сообщили."""
+        with self._lock:
+            self._db.execute(
+                "DELETE FROM sheets_journal WHERE status = 'done' AND notified = 1 AND created_at < ?",
+                (time.time() - older_than_seconds,),
+            )
+            self._db.commit()
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            counts = dict(self._db.execute(
+                "SELECT status, COUNT(*) FROM sheets_journal GROUP BY status"
+            ).fetchall())
+        return {"pending": counts.get('pending', 0), "done": counts.get('done', 0), "failed": counts.get('failed', 0)}
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+class SheetsWriter:
+    """
+    Фоновый воркер: забирает ожидающие записи из журнала, пишет их в таблицу через
+    write_transactions (записи для одного листа уходят одним запросом) и сообщает
+    пользователю ссылку, когда все записи его сохранения оказались в таблице.
+    """
+
+    def __init__(self, journal: SheetsJournal):
+        self.journal = journal
+        self._bot = None
+        self._task: asyncio.Task | None = None
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+
+    def start(self, bot) -> None:
+        self._bot = bot
+        self._stopping = False
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def wake_up(self) -> None:
+        self._wakeup.set()
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            try:
+                processed = await self.process_once()
+            except Exception as e:
+                logger.error(f"Ошибка фоновой записи в Google Sheets: {e}", exc_info=True)
+                processed = 0
+            # Пока записи уходят в таблицу, сразу берём следующую порцию; иначе ждём новых или паузы
+            if processed:
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=settings.sheets_writer_poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def process_once(self, due_only: bool = True) -> int:
+        """Один проход: запись очередной порции журнала. Возвращает число записанных в таблицу."""
+        claimed = await asyncio.to_thread(
+            self.journal.claim, settings.sheets_writer_batch_size, settings.sheets_writer_lease, due_only
+        )
+        if not claimed:
+            return 0
+
+        # Свежие записи только что подтвердил пользователь — это интерактивные запросы к Sheets;
+        # повторы и дозапись при остановке уступают им квоту
+        interactive = due_only and any(attempts == 0 for _, _, attempts, _ in claimed)
+        try:
+            with nullcontext() if interactive else background_priority():
+                links = await write_transactions_async([tx for *_, tx in claimed])
+        except Exception as e:
+            logger.error(f"Ошибка пакетной записи в Google Sheets: {e}", exc_info=True)
+            links = [None] * len(claimed)
+
+        written = [(row_id, link) for (row_id, *_), link in zip(claimed, links) if link]
+        failed = [row_id for (row_id, *_), link in zip(claimed, links) if not link]
+        if written:
+            await asyncio.to_thread(self.journal.complete, written)
+        if failed:
+            logger.warning(f"Не удалось записать в таблицу {len(failed)} из {len(claimed)} записей, повторим позже")
+            await asyncio.to_thread(self.journal.retry_later, failed, "запись в Google Sheets не удалась")
+
+        for batch_id in dict.fromkeys(batch_id for _, batch_id, *_ in claimed):
+            summary = await asyncio.to_thread(self.journal.take_finished_batch, batch_id)
+            if summary:
+                await self._notify(summary)
+        return len(written)
+
+    async def _notify(self, summary: dict) -> None:
+        if self._bot is None or summary["chat_id"] is None:
+            return
+        pet_name = summary["pet_name"] or 'хвостик'
+        if summary["done"]:
+            if summary["done"] > 1:
+                text = f"✅ *Готово!* Записи ({summary['done']} шт.) для *{pet_name}* добавлены в таблицу.\n\n"
+            else:
+                text = f"✅ *Готово!* Запись для *{pet_name}* добавлена в таблицу.\n\n"
+            if summary["failed"]:
+                text += f"⚠️ Не удалось сохранить записей: {summary['failed']} шт.\n\n"
+            text += f"🔗 [Посмотреть записи в таблице]({summary['sheet_link']})"
+        else:
+            text = (f"❌ Не удалось сохранить данные для *{pet_name}* в таблицу. "
+                    f"Пожалуйста, попробуйте снова или свяжитесь с администратором.")
+        try:
+            await self._bot.send_message(
+                summary["chat_id"], text, parse_mode='Markdown', disable_web_page_preview=True
+            )
+        except Exception as e:
+            logger.error(f"Не удалось отправить уведомление о сохранении: {e}")
+
+    async def stop(self) -> None:
+        """
+        Останавливает воркер, предварительно дописав журнал: новые порции берутся, пока
+        не прошло settings.sheets_drain_timeout. Порция, которая уже пишется, не прерывается —
+        иначе запись в таблицу завершилась бы в потоке Sheets без отметки в журнале,
+        и после перезапуска строки записались бы повторно.
+        """
+        self._stopping = True
+        self.wake_up()
+        if self._task is not None:
+            await self._task
+            self._task = None
+
+        # Дописываем всё, включая отложенные записи, пока таблица принимает запись
+        deadline = time.monotonic() + settings.sheets_drain_timeout
+        while time.monotonic() < deadline:
+            if not await self.process_once(due_only=False):
+                break
+        stats = self.journal.get_stats()
+        if stats["pending"]:
+            logger.warning(f"При остановке в журнале остались записи: {stats['pending']}. Они будут записаны после запуска.")
+        self.journal.prune(settings.sheets_journal_retention)
+
+
+sheets_journal = SheetsJournal(settings.sheets_journal_path)
+sheets_writer = SheetsWriter(sheets_journal)
+
+
+async def enqueue_transactions(chat_id: int | None, transactions: list[dict]) -> str:
+    """Фиксирует записи в журнале и будит фоновый воркер. Возвращает batch_id."""
+    batch_id = await asyncio.to_thread(sheets_journal.enqueue, chat_id, transactions)
+    sheets_writer.wake_up()
+    return batch_id
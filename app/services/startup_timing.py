@@ -0,0 +1,58 @@
+import importlib
+import logging
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class StartupTimer:
+    """
+    Замеры холодного старта: время импорта модулей, создания клиентов и готовности бота,
+    отсчитанное от импорта этого модуля (первым делом в main.py). Время импорта модуля
+    включает его зависимости, которые не были загружены раньше.
+    """
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self._imports: dict[str, float] = {}
+        self._clients: dict[str, float] = {}
+        self.ready_after: float | None = None
+
+    @contextmanager
+    def measure(self, kind: str, name: str):
+        """Замеряет блок и записывает его длительность в раздел kind ("imports" или "clients")."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            (self._imports if kind == "imports" else self._clients)[name] = elapsed
+
+    def import_module(self, name: str):
+        with self.measure("imports", name):
+            return importlib.import_module(name)
+
+    def since_start(self) -> float:
+        return time.perf_counter() - self.started_at
+
+    def mark_ready(self) -> None:
+        self.ready_after = self.since_start()
+        logger.info(f"Бот готов через {self.ready_after:.2f} с после запуска: {self.format_report()}")
+
+    def format_report(self) -> str:
+        parts = [f"{name} {elapsed * 1000:.0f} мс" for name, elapsed in {**self._imports, **self._clients}.items()]
+        return ", ".join(parts)
+
+    def get_report(self) -> dict:
+        """Отчёт для эндпоинта /: миллисекунды по каждому импорту и клиенту."""
+        return {
+            "ready": self.ready_after is not None,
+            "ready_after": round(self.ready_after, 3) if self.ready_after is not None else None,
+            "uptime": round(self.since_start(), 1),
+            "imports_ms": {name: round(elapsed * 1000) for name, elapsed in self._imports.items()},
+            "clients_ms": {name: round(elapsed * 1000) for name, elapsed in self._clients.items()},
+        }
+
+
+startup_timer = StartupTimer()
@@ -0,0 +1,168 @@
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+# Раскладка листа питомца: приход в A–E, расход в G–K; check_col_index — колонка (с 1),
+# по которой ищется последняя заполненная строка
+INCOME_COLS = {
+    "start": "A", "end": "E", "check_col_index": 1,
+}
+EXPENSE_COLS = {
+    "start": "G", "end": "K", "check_col_index": 7,
+}
+# Строки 1–3 занимают заголовки, данные начинаются с четвёртой
+FIRST_DATA_ROW = 4
+
+
+class StorageError(Exception):
+    """Ошибка хранилища записей; текст исключения уже пригоден для показа в логах."""
+
+
+class StorageBackend:
+    """
+    Базовый интерфейс хранилища записей. Раскладка повторяет лист питомца в Google Sheets:
+    приход в колонках A–E, расход в G–K, данные с FIRST_DATA_ROW-й строки.
+    Раздел передаётся словарём колонок (INCOME_COLS / EXPENSE_COLS).
+    Методы синхронные: sheets_client вызывает их в своём выделенном потоке.
+    """
+    name = "base"
+
+    def is_ready(self) -> bool:
+        return True
+
+    def write_rows(self, pet_name: str, sections: list[tuple[dict, list[list]]]) -> str:
+        """
+        Дописывает строки в разделы листа питомца: [(колонки раздела, строки)]. Строки раздела
+        занимают первые свободные строки на момент записи, даже если лист одновременно пишут
+        другие процессы. Возвращает ссылку на лист; при ошибке бросает StorageError,
+        и тогда не записано ничего из раздела, на котором случилась ошибка.
+        """
+        raise NotImplementedError
+
+    def read_sheets(self) -> dict[str, list[tuple[dict, list[list]]]]:
+        """Содержимое всех листов питомцев: {питомец: [(колонки раздела, строки данных)]}."""
+        raise NotImplementedError
+
+
+class SqliteSheetStorage(StorageBackend):
+    """
+    Локальная замена Google Sheets для нагрузочных и офлайн-тестов: листы и строки хранятся
+    в SQLite с той же раскладкой разделов. Умеет добавлять задержку и случайные сбои;
+    случайность детерминирована seed'ом, как у replay-движка OCR.
+    """
+    name = "sqlite"
+
+    def __init__(self, path: str, latency_ms: int = 0, jitter_ms: int = 0,
+                 error_rate: float = 0.0, seed: int = 0):
+        self.path = path
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS sheets ("
+            "pet_name TEXT PRIMARY KEY, sheet_id INTEGER NOT NULL, created_at REAL NOT NULL)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS sheet_rows ("
+            "pet_name TEXT NOT NULL, section TEXT NOT NULL, row INTEGER NOT NULL, "
+            "c1, c2, c3, c4, c5, PRIMARY KEY (pet_name, section, row))"
+        )
+        self._db.commit()
+        logger.info(f"Локальное хранилище записей (SQLite): {path}")
+
+    def _simulate_call(self) -> None:
+        """Задержка и случайный сбой, как у сетевого вызова к Google API."""
+        with self._lock:
+            delay_ms = self.latency_ms + (self._rng.uniform(0, self.jitter_ms) if self.jitter_ms else 0)
+            failed = bool(self.error_rate) and self._rng.random() < self.error_rate
+        if delay_ms > 0:
+            time.sleep(delay_ms / 1000)
+        if failed:
+            raise StorageError("Ошибка хранилища (sqlite): смоделированный сбой")
+
+    def _sheet_id(self, pet_name: str) -> int:
+        row = self._db.execute("SELECT sheet_id FROM sheets WHERE pet_name = ?", (pet_name,)).fetchone()
+        if row:
+            return row[0]
+        sheet_id = self._db.execute("SELECT COALESCE(MAX(sheet_id), 0) + 1 FROM sheets").fetchone()[0]
+        self._db.execute(
+            "INSERT INTO sheets (pet_name, sheet_id, created_at) VALUES (?, ?, ?)", (pet_name, sheet_id, time.time())
+        )
+        logger.info(f"Создан локальный лист для '{pet_name}'")
+        return sheet_id
+
+    def write_rows(self, pet_name: str, sections: list[tuple[dict, list[list]]]) -> str:
+        self._simulate_call()
+        with self._lock:
+            try:
+                sheet_id = self._sheet_id(pet_name)
+                for target_cols, rows in sections:
+                    section = target_cols["start"]
+                    last_row = self._db.execute(
+                        "SELECT MAX(row) FROM sheet_rows WHERE pet_name = ? AND section = ?", (pet_name, section)
+                    ).fetchone()[0]
+                    first_row = max((last_row or 0) + 1, FIRST_DATA_ROW)
+                    self._db.executemany(
+                        "INSERT INTO sheet_rows (pet_name, section, row, c1, c2, c3, c4, c5) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        [(pet_name, section, first_row + i, *row_data) for i, row_data in enumerate(rows)],
+                    )
+                self._db.commit()
+            except sqlite3.Error as e:
+                self._db.rollback()
+                raise StorageError(f"Ошибка записи в локальное хранилище: {e}") from e
+        return f"sqlite:///{os.path.abspath(self.path)}#gid={sheet_id}"
+
+    def read_sheets(self) -> dict[str, list[tuple[dict, list[list]]]]:
+        self._simulate_call()
+        with self._lock:
+            pet_names = [row[0] for row in self._db.execute("SELECT pet_name FROM sheets ORDER BY sheet_id")]
+        return {
+            pet_name: [(cols, self.read_rows(pet_name, cols)) for cols in (INCOME_COLS, EXPENSE_COLS)]
+            for pet_name in pet_names
+        }
+
+    def read_rows(self, pet_name: str, target_cols: dict) -> list[list]:
+        """Строки раздела по порядку — для проверок в тестах."""
+        with self._lock:
+            return [list(row) for row in self._db.execute(
+                "SELECT c1, c2, c3, c4, c5 FROM sheet_rows WHERE pet_name = ? AND section = ? ORDER BY row",
+                (pet_name, target_cols["start"]),
+            )]
+
+
+_backend: StorageBackend | None = None
+_backend_lock = threading.Lock()
+
+
+def get_storage_backend() -> StorageBackend:
+    """Создаёт (один раз) хранилище записей, выбранное в settings.storage_backend."""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            if settings.storage_backend == "sqlite":
+                _backend = SqliteSheetStorage(
+                    settings.storage_sqlite_path,
+                    latency_ms=settings.storage_latency_ms,
+                    jitter_ms=settings.storage_jitter_ms,
+                    error_rate=settings.storage_error_rate,
+                    seed=settings.storage_seed,
+                )
+            elif settings.storage_backend == "sheets":
+                from app.services.sheets_client import GoogleSheetsStorage
+
+                _backend = GoogleSheetsStorage()
+            else:
+                raise ValueError(f"Неизвестное хранилище записей: '{settings.storage_backend}'")
+            logger.info(f"Хранилище записей: {_backend.name}")
+        return _backend
@@ -1,63 +1,170 @@
+import asyncio
 import logging
-import os
-from google.cloud import vision
-from google.api_core.exceptions import GoogleAPICallError, PermissionDenied, InvalidArgument
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+from app.services.ocr_cache import ocr_cache, image_cache_key
+from app.services.ocr_engines import OcrEngineError, get_ocr_engine, record_ocr_result
+from config.settings import settings
 
 logger = logging.getLogger(__name__)
 
-# Инициализация клиента с проверкой credentials
-try:
-    # Проверяем наличие файла credentials в корне проекта
-    credentials_path = "credentials.json"
-    if os.path.exists(credentials_path):
-        vision_client = vision.ImageAnnotatorClient.from_service_account_file(credentials_path)
-        logger.info(f"Google Vision client initialized with {credentials_path}")
-    else:
-        logger.error(f"Файл {credentials_path} не найден в корне проекта!")
-        vision_client = None
-        
-except Exception as e:
-    vision_client = None
-    logger.error(f"Could not initialize Google Vision client: {e}")
-
-async def recognize_text(image_bytes: bytes) -> str | None:
-    """Распознает текст с изображения с улучшенной обработкой ошибок."""
-    if not vision_client:
-        error_msg = "Клиент Vision не инициализирован. Проверьте credentials.json"
-        logger.error(error_msg)
-        return error_msg
+# Синхронный OCR-движок (см. ocr_engines) выполняется в отдельном пуле потоков, чтобы не блокировать
+# event loop. Семафор ограничивает число запросов "в полёте", остальные ждут своей очереди.
+_ocr_executor = ThreadPoolExecutor(
+    max_workers=settings.ocr_max_concurrency, thread_name_prefix="vision-ocr"
+)
+_ocr_semaphore = asyncio.Semaphore(settings.ocr_max_concurrency)
+
+# Ограничение Vision API на число изображений в одном batch-запросе
+VISION_BATCH_LIMIT = 16
+
+_ocr_stats = {
+    "in_flight": 0,
+    "waiting": 0,
+    "admitted": 0,
+    "queue_wait_total": 0.0,
+    "queue_wait_max": 0.0,
+}
+
+def get_ocr_stats() -> dict:
+    """Возвращает метрики очереди OCR: текущая загрузка и время ожидания в очереди (сек.)."""
+    admitted = _ocr_stats["admitted"]
+    return {
+        "max_concurrency": settings.ocr_max_concurrency,
+        "in_flight": _ocr_stats["in_flight"],
+        "waiting": _ocr_stats["waiting"],
+        "admitted": admitted,
+        "queue_wait_avg": round(_ocr_stats["queue_wait_total"] / admitted, 3) if admitted else 0.0,
+        "queue_wait_max": round(_ocr_stats["queue_wait_max"], 3),
+    }
 
+@asynccontextmanager
+async def _ocr_slot():
+    """Занимает одно место в пуле запросов к Vision и учитывает время ожидания в очереди."""
+    queued_at = time.monotonic()
+    _ocr_stats["waiting"] += 1
     try:
-        image = vision.Image(content=image_bytes)
-        response = vision_client.text_detection(image=image)
+        await _ocr_semaphore.acquire()
+    finally:
+        _ocr_stats["waiting"] -= 1
 
-        if response.error.message:
-            error_msg = f'Ошибка Vision API: {response.error.message}'
-            logger.error(error_msg)
-            return error_msg
+    queue_wait = time.monotonic() - queued_at
+    _ocr_stats["in_flight"] += 1
+    _ocr_stats["admitted"] += 1
+    _ocr_stats["queue_wait_total"] += queue_wait
+    _ocr_stats["queue_wait_max"] = max(_ocr_stats["queue_wait_max"], queue_wait)
+    if queue_wait > 1:
+        logger.warning(f"Запрос OCR ждал в очереди {queue_wait:.2f} с")
 
-        texts = response.text_annotations
-        if not texts:
-            return "Текст не обнаружен на изображении"
+    try:
+        yield
+    finally:
+        _ocr_stats["in_flight"] -= 1
+        _ocr_semaphore.release()
 
-        # Возвращаем весь распознанный текст
-        full_text = texts[0].description
-        logger.info(f"Успешно распознано {len(full_text)} символов")
-        return full_text
+def _finish_text(image_bytes: bytes, text: str, cache_key: str | None, content_key: str) -> str:
+    """
+    Кэширует успешный результат и приводит пустой ответ к сообщению для пользователя.
+    Пишет в SQLite и на диск, поэтому вызывается в _ocr_executor вместе с распознаванием.
+    """
+    if not text:
+        return "Текст не обнаружен на изображении"
+    logger.info(f"Успешно распознано {len(text)} символов")
+    ocr_cache.put(text, cache_key, content_key)
+    record_ocr_result(image_bytes, text)
+    return text
 
-    except PermissionDenied as e:
-        error_msg = f"Доступ запрещен: {e}. Проверьте права сервисного аккаунта."
-        logger.error(error_msg)
-        return error_msg
-    except InvalidArgument as e:
-        error_msg = f"Неверный аргумент: {e}. Проверьте формат изображения."
-        logger.error(error_msg)
-        return error_msg
-    except GoogleAPICallError as e:
-        error_msg = f"Ошибка Google API: {e}"
+def _describe_error(e: Exception) -> str:
+    error_msg = str(e) if isinstance(e, OcrEngineError) else f"Неожиданная ошибка: {e}"
+    logger.error(error_msg)
+    return error_msg
+
+def _detect_and_finish(detect, image_bytes: bytes, cache_key: str | None, content_key: str) -> str:
+    return _finish_text(image_bytes, detect(image_bytes), cache_key, content_key)
+
+def _batch_detect_and_finish(engine, images: list[bytes], cache_keys: list[str | None],
+                             content_keys: list[str]) -> list[str]:
+    results = []
+    for image_bytes, result, cache_key, content_key in zip(
+        images, engine.batch_detect_text(images), cache_keys, content_keys
+    ):
+        if isinstance(result, Exception):
+            results.append(_describe_error(result))
+        else:
+            results.append(_finish_text(image_bytes, result, cache_key, content_key))
+    return results
+
+async def recognize_text(image_bytes: bytes, cache_key: str | None = None,
+                         with_layout: bool = False) -> str | None:
+    """
+    Распознает текст с изображения с улучшенной обработкой ошибок.
+    Результат кэшируется по хешу содержимого и, если передан, дополнительно по cache_key
+    (например, file_unique_id из Telegram), чтобы повтор можно было найти без скачивания.
+    С with_layout=True возвращается OcrText — строка со словами и блоками с координатами
+    (из кэша может прийти и обычная строка, если изображение уже распознавалось без разметки).
+    """
+    content_key = image_cache_key(image_bytes)
+    cached_text = ocr_cache.get(content_key)
+    if cached_text is not None:
+        logger.info(f"Результат OCR взят из кэша ({len(cached_text)} символов)")
+        return cached_text
+
+    engine = get_ocr_engine()
+    if not engine.is_ready():
+        error_msg = f"OCR-движок '{engine.name}' не инициализирован. Проверьте credentials.json и настройки"
         logger.error(error_msg)
         return error_msg
-    except Exception as e:
-        error_msg = f"Неожиданная ошибка: {e}"
+
+    async with _ocr_slot():
+        try:
+            loop = asyncio.get_running_loop()
+            detect = engine.detect_layout if with_layout else engine.detect_text
+            return await loop.run_in_executor(
+                _ocr_executor, _detect_and_finish, detect, image_bytes, cache_key, content_key
+            )
+        except Exception as e:
+            return _describe_error(e)
+
+async def recognize_texts(images: list[bytes], cache_keys: list[str | None] | None = None) -> list[str | None]:
+    """
+    Распознает текст сразу с нескольких изображений (например, альбома) пакетно:
+    для Vision это один batch_annotate_images на каждые VISION_BATCH_LIMIT картинок.
+    Порядок результатов совпадает с порядком изображений.
+    """
+    cache_keys = cache_keys or [None] * len(images)
+    content_keys = [image_cache_key(image_bytes) for image_bytes in images]
+    results: list[str | None] = [ocr_cache.get(key) for key in content_keys]
+    pending = [i for i, text in enumerate(results) if text is None]
+    if not pending:
+        return results
+
+    engine = get_ocr_engine()
+    if not engine.is_ready():
+        error_msg = f"OCR-движок '{engine.name}' не инициализирован. Проверьте credentials.json и настройки"
         logger.error(error_msg)
-        return error_msg
\ No newline at end of file
+        for i in pending:
+            results[i] = error_msg
+        return results
+
+    loop = asyncio.get_running_loop()
+    for start in range(0, len(pending), VISION_BATCH_LIMIT):
+        chunk = pending[start:start + VISION_BATCH_LIMIT]
+        async with _ocr_slot():
+            try:
+                batch_results = await loop.run_in_executor(
+                    _ocr_executor, _batch_detect_and_finish, engine, [images[i] for i in chunk],
+                    [cache_keys[i] for i in chunk], [content_keys[i] for i in chunk]
+                )
+            except Exception as e:
+                error_msg = _describe_error(e)
+                for i in chunk:
+                    results[i] = error_msg
+                continue
+
+        for i, result in zip(chunk, batch_results):
+            results[i] = result
+
+    logger.info(f"Пакетное распознавание завершено: {len(images)} изображений, из них {len(pending)} через OCR-движок")
+    return results
@@ -0,0 +1,152 @@
+"""
+Бенчмарк парсера на корпусе обезличенных OCR-текстов (benchmarks/corpus/*.json).
+
+Для каждого поля показывает время разбора (нс/операция, p99) и точность
+относительно ожидаемых значений из корпуса. Запуск из корня проекта:
+
+    python -m benchmarks.parser_suite
+    python -m benchmarks.parser_suite --iterations 2000 --corpus benchmarks/corpus
+
+Формат файла корпуса:
+    {"name": ..., "type": "income" | "expense" | "transaction", "text": ...,
+     "expected": {поле: значение} или [список транзакций для type=transaction],
+     "words": [[текст, x0, y0, x1, y1], ...]}
+Поля, которых нет в expected, не проверяются. Необязательный words — слова с координатами,
+как в <sha256>.layout.json replay-движка OCR: с ним текст разбирается по разметке.
+"""
+import argparse
+import glob
+import json
+import logging
+import os
+import time
+
+from app.services import data_parser
+from app.services.layout import OcrText, OcrWord
+
+DEFAULT_CORPUS_DIR = os.path.join(os.path.dirname(__file__), "corpus")
+
+
+def load_corpus(corpus_dir: str) -> list[dict]:
+    samples = []
+    for path in sorted(glob.glob(os.path.join(corpus_dir, "*.json"))):
+        with open(path, encoding="utf-8") as f:
+            sample = json.load(f)
+        if sample.get("words"):
+            sample["text"] = OcrText(sample["text"], [OcrWord(*word) for word in sample["words"]])
+        samples.append(sample)
+    return samples
+
+
+def _field_parsers(sample: dict) -> dict:
+    """Те же вызовы, что делает parse_transaction_data, но по отдельности для замера."""
+    text = sample["text"]
+    transaction_type = sample["type"]
+    if transaction_type in ("income", "transaction"):
+        normalized = data_parser._normalize_text_for_search(text)
+        return {
+            "date": lambda: data_parser.parse_date(text),
+            "amount": lambda: data_parser.parse_amount(text, transaction_type),
+            "bank": lambda: data_parser.parse_bank(normalized),
+            "author": lambda: data_parser.parse_author(normalized, transaction_type),
+            "comment": lambda: data_parser.parse_comment(normalized),
+        }
+    return {
+        "date": lambda: data_parser.parse_date(text),
+        "amount": lambda: data_parser.parse_amount(text, transaction_type),
+        "procedure": lambda: data_parser.parse_procedure(text),
+        "author": lambda: data_parser.parse_author(text, transaction_type),
+        "comment": lambda: data_parser.parse_comment(text),
+    }
+
+
+def _time_calls(func, iterations: int) -> list[int]:
+    timings = []
+    for _ in range(iterations):
+        started = time.perf_counter_ns()
+        func()
+        timings.append(time.perf_counter_ns() - started)
+    return timings
+
+
+def _percentile(values: list[int], q: float) -> int:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+def run(samples: list[dict], iterations: int) -> dict:
+    timings: dict[str, list[int]] = {}
+    accuracy: dict[str, list[int]] = {}  # поле -> [верно, всего]
+    failures: list[str] = []
+
+    def record(name: str, sample_timings: list[int]) -> None:
+        timings.setdefault(name, []).extend(sample_timings)
+
+    def score(field: str, ok: bool, detail: str) -> None:
+        counts = accuracy.setdefault(field, [0, 0])
+        counts[1] += 1
+        if ok:
+            counts[0] += 1
+        else:
+            failures.append(detail)
+
+    for sample in samples:
+        name, text, transaction_type = sample["name"], sample["text"], sample["type"]
+        expected = sample["expected"]
+
+        if transaction_type == "transaction":
+            record("parse_multiple_transactions",
+                   _time_calls(lambda: data_parser.parse_multiple_transactions(text), iterations))
+            found = data_parser.parse_multiple_transactions(text)
+            for tx in expected:
+                score("transactions", tx in found, f"{name}: не найдена транзакция {tx}")
+            for tx in found:
+                if tx not in expected:
+                    failures.append(f"{name}: лишняя транзакция {tx}")
+            continue
+
+        for field, func in _field_parsers(sample).items():
+            record(field, _time_calls(func, iterations))
+        record("parse_transaction_data",
+               _time_calls(lambda: data_parser.parse_transaction_data(text, transaction_type), iterations))
+
+        result = data_parser.parse_transaction_data(text, transaction_type)
+        for field, expected_value in expected.items():
+            actual = result.get(field)
+            score(field, actual == expected_value, f"{name}.{field}: ожидалось {expected_value!r}, получено {actual!r}")
+
+    return {"timings": timings, "accuracy": accuracy, "failures": failures}
+
+
+def print_report(report: dict) -> None:
+    print(f"{'операция':<28} {'вызовов':>8} {'нс/оп':>10} {'p99, нс':>10} {'точность':>10}")
+    names = list(report["timings"]) + [f for f in report["accuracy"] if f not in report["timings"]]
+    for name in names:
+        values = report["timings"].get(name)
+        calls = f"{len(values)}" if values else "-"
+        mean = f"{sum(values) // len(values)}" if values else "-"
+        p99 = f"{_percentile(values, 0.99)}" if values else "-"
+        correct, total = report["accuracy"].get(name, (0, 0))
+        acc = f"{correct}/{total}" if total else "-"
+        print(f"{name:<28} {calls:>8} {mean:>10} {p99:>10} {acc:>10}")
+
+    if report["failures"]:
+        print("\nРасхождения с ожидаемыми значениями:")
+        for failure in report["failures"]:
+            print(f"  - {failure}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Бенчмарк и точность data_parser на корпусе OCR-текстов")
+    parser.add_argument("--iterations", type=int, default=500, help="повторов на каждый образец")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS_DIR, help="каталог с *.json образцами")
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    samples = load_corpus(args.corpus)
+    print(f"Образцов в корпусе: {len(samples)}, повторов: {args.iterations}\n")
+    print_report(run(samples, args.iterations))
+
+
+if __name__ == "__main__":
+    main()
@@ -8,6 +8,120 @@ class Settings(BaseSettings):
     # Ссылка на Google Таблицу - используем верхний регистр для консистентности
     GOOGLE_SHEETS_LINK: str = "https://docs.google.com/spreadsheets/d/1FBnDZdRy0KmBRFs5VmMBWCJmNhuXE--D0pPb6ghusFA/edit?gid=0#gid=0"
     
+    # Секрет вебхука: Telegram присылает его в заголовке X-Telegram-Bot-Api-Secret-Token,
+    # запросы без него отклоняются (пустая строка — проверка отключена)
+    telegram_webhook_secret: str = ""
+    # Сколько секунд вебхук ждёт запуска бота после холодного старта, прежде чем ответить 503
+    webhook_startup_wait: float = 20.0
+    # Обновления разных чатов обрабатываются параллельно (не более max_concurrent одновременно),
+    # одного чата — по очереди; max_pending — сколько обновлений можно держать принятыми в работу
+    bot_max_concurrent_updates: int = 16
+    bot_max_pending_updates: int = 256
+    # Общее хранилище диалогов (SQLite) для нескольких воркеров; незавершённые диалоги
+    # старше session_ttl секунд удаляются при запуске
+    session_store_path: str = "sessions.db"
+    session_ttl: int = 7 * 24 * 3600
+    # Диалог, который дольше стольких секунд в состоянии WAITING (воркер упал посреди
+    # распознавания), при запуске возвращается в состояние до начала обработки
+    session_waiting_timeout: int = 600
+    
+    # OCR-движок: "vision" (Google Cloud Vision) или "replay" (записанные ответы для офлайн-тестов)
+    ocr_engine: str = "vision"
+    # Параметры replay-движка: каталог с записями <sha256>.txt, задержка и доля ошибок
+    ocr_replay_dir: str = "ocr_replay"
+    ocr_replay_latency_ms: int = 0
+    ocr_replay_jitter_ms: int = 0
+    ocr_replay_error_rate: float = 0.0
+    ocr_replay_seed: int = 0
+    # Если задан, успешные ответы OCR сохраняются сюда в формате replay-движка
+    ocr_record_dir: str = ""
+    
+    # Максимум одновременных запросов к Vision API (остальные ждут в очереди)
+    ocr_max_concurrency: int = 4
+    
+    # Кэш результатов OCR: размер LRU в памяти, время жизни записи (сек.)
+    # и необязательный файл SQLite для дискового уровня (пустая строка — отключен)
+    ocr_cache_size: int = 256
+    ocr_cache_ttl: int = 7 * 24 * 3600
+    ocr_cache_path: str = ""
+    ocr_cache_disk_max_entries: int = 5000
+    
+    # Предобработка фото перед OCR: минимальная длинная сторона, достаточная для текста,
+    # максимальная длинная сторона и целевой размер файла после пережатия
+    ocr_preprocess: bool = True
+    ocr_min_photo_side: int = 1000
+    ocr_max_image_side: int = 2048
+    ocr_target_image_bytes: int = 400_000
+    
+    # Допуск фото к скачиванию и OCR: сколько фото (альбом — одна заявка) обрабатывается
+    # одновременно, сколько байт они могут занимать в памяти и сколько заявок ждёт в очереди
+    photo_max_concurrency: int = 8
+    photo_max_inflight_bytes: int = 256 * 1024 * 1024
+    photo_max_queue: int = 100
+    
+    # Сколько секунд ждать следующее фото альбома, прежде чем распознавать его целиком
+    album_collect_window: float = 1.5
+    
+    # Безопасный разбор текста: поля разбираются в отдельных процессах с общим
+    # бюджетом времени на чек (сек.); не успевшие поля остаются пустыми.
+    # Текст одиночного чека длиннее parser_max_text_chars обрезается перед разбором;
+    # списки операций разбираются целиком
+    parser_safe_mode: bool = True
+    parser_workers: int = 2
+    parser_time_budget: float = 2.0
+    parser_max_text_chars: int = 20_000
+    
+    # Google Sheets: как часто проверять токен доступа (сек.) и за сколько секунд
+    # до истечения обновлять его заранее
+    sheets_token_refresh_interval: int = 300
+    sheets_token_refresh_margin: int = 600
+    # Как долго (сек.) доверять кэшу списка листов таблицы без повторной загрузки
+    sheets_metadata_ttl: int = 1800
+    # Сколько строк выделять новому листу питомца (и добавлять, когда место заканчивается)
+    sheets_new_sheet_rows: int = 1000
+    
+    # Хранилище записей: "sheets" (Google Sheets) или "sqlite" (локальная замена для тестов
+    # с той же раскладкой листа). Для sqlite можно добавить задержку и долю сбоев
+    storage_backend: str = "sheets"
+    storage_sqlite_path: str = "local_sheets.db"
+    storage_latency_ms: int = 0
+    storage_jitter_ms: int = 0
+    storage_error_rate: float = 0.0
+    storage_seed: int = 0
+    
+    # Локальный учёт сумм по питомцам (для /balance) и период сверки с таблицей (сек.)
+    ledger_path: str = "ledger.db"
+    ledger_reconcile_interval: int = 6 * 3600
+    
+    # Индекс отпечатков сохранённых записей для предупреждения о дублях
+    receipt_index_path: str = "receipt_index.db"
+    
+    # Журнал записей в таблицу (SQLite): подтверждённые записи сохраняются в нём
+    # и дописываются в Google Sheets фоновым воркером с повторами при ошибках
+    sheets_journal_path: str = "sheets_journal.db"
+    sheets_writer_batch_size: int = 200
+    sheets_writer_poll_interval: float = 5.0
+    sheets_writer_lease: float = 120.0
+    sheets_max_attempts: int = 10
+    sheets_retry_base_delay: float = 2.0
+    sheets_retry_max_delay: float = 300.0
+    # Сколько секунд при остановке дописывать журнал и сколько хранить сохранённые записи
+    sheets_drain_timeout: float = 15.0
+    sheets_journal_retention: int = 7 * 24 * 3600
+    
+    # Квоты Google API (запросов в минуту) и допустимый всплеск. Запросы сверх квоты ждут
+    # в очереди; ответы 429/503 повторяются с экспоненциальной паузой
+    google_sheets_reads_per_minute: int = 60
+    google_sheets_writes_per_minute: int = 60
+    google_quota_burst: int = 10
+    google_vision_requests_per_minute: int = 1800
+    google_vision_burst: int = 32
+    google_retry_attempts: int = 5
+    google_retry_base_delay: float = 1.0
+    google_retry_max_delay: float = 32.0
+    # Корзины квот общие для всех воркеров и лежат в этом файле SQLite
+    google_quota_path: str = "google_quota.db"
+    
     # credentials.json лежит в корне проекта
     @property
     def google_credentials_path(self) -> str:
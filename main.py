@@ -1,12 +1,16 @@
+# Отсчёт времени старта начинается с импорта startup_timing — он должен идти первым
+from app.services.startup_timing import startup_timer
+
+import asyncio
+import hmac
 import logging
-import os
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, Request
-from telegram.ext import Application
-from telegram import Update
+
+with startup_timer.measure("imports", "fastapi"):
+    from fastapi import FastAPI, Request
+    from fastapi.responses import JSONResponse
 
 from config.settings import settings
-from app.bot.handlers import setup_handlers
 
 # Настройка логирования
 logging.basicConfig(
@@ -21,60 +25,60 @@ if not settings.telegram_token:
     logger.critical("TELEGRAM_TOKEN не установлен! Бот не может быть запущен.")
     raise ValueError("TELEGRAM_TOKEN обязателен для работы бота")
 
-# Проверяем наличие файла с ключами доступа Google
-if not os.path.exists("credentials.json"):
-    logger.critical("Файл credentials.json не найден в корне проекта! Доступ к Google API невозможен.")
-
-# --- Инициализация Telegram-бота ---
-try:
-    ptb_app_builder = Application.builder().token(settings.telegram_token)
-    ptb_app = ptb_app_builder.build()
-    
-    # Регистрация обработчиков
-    conv_handler, help_handler = setup_handlers()
-    ptb_app.add_handler(conv_handler)
-    ptb_app.add_handler(help_handler)
-    
-    logger.info("Бот и обработчики успешно инициализированы")
-except Exception as e:
-    logger.critical(f"Критическая ошибка инициализации бота: {e}", exc_info=True)
-    raise
+# Тяжёлые модули импортируются в фоне, когда сервер уже принимает запросы, — по одному,
+# чтобы в отчёте о старте было видно время каждого. Последним идёт app.bot.runtime:
+# он создаёт Application и регистрирует обработчики
+BOT_MODULES = (
+    "telegram.ext",
+    "gspread",
+    "app.services.sheets_client",
+    "app.services.sheets_journal",
+    "app.services.vision_ocr",
+    "app.bot.handlers",
+    "app.bot.runtime",
+)
+
+# Модуль app.bot.runtime после фоновой инициализации
+runtime = None
+bot_ready = asyncio.Event()
+startup_error: str | None = None
+
+
+async def _initialize_bot() -> None:
+    """Импортирует модули бота, запускает его и заранее создаёт клиентов Google."""
+    global runtime, startup_error
+    try:
+        module = None
+        for name in BOT_MODULES:
+            module = await asyncio.to_thread(startup_timer.import_module, name)
+        runtime = module
+        await runtime.start_bot()
+        startup_timer.mark_ready()
+        bot_ready.set()
+        await runtime.prewarm_clients()
+    except Exception as e:
+        startup_error = str(e)
+        logger.critical(f"Критическая ошибка запуска бота: {e}", exc_info=True)
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    """Управляет жизненным циклом: запускает и останавливает бота вместе с FastAPI."""
-    # На Render используем вебхуки вместо polling
-    webhook_url = os.getenv("RENDER_EXTERNAL_URL", "") + "/webhook"
-    
-    if webhook_url and not webhook_url.startswith("http"):
-        webhook_url = f"https://{webhook_url}"
-    
-    if webhook_url and "render.com" in webhook_url:
-        logger.info(f"Настройка вебхука для Render: {webhook_url}")
-        await ptb_app.initialize()
-        await ptb_app.bot.set_webhook(webhook_url)
-        await ptb_app.start()
-        logger.info("Бот успешно запущен в режиме вебхука")
-    else:
-        # Локальная разработка с polling
-        logger.info("Запуск Telegram-бота в режиме polling (локальная разработка)...")
-        await ptb_app.initialize()
-        await ptb_app.start() 
-        if ptb_app.updater:
-            await ptb_app.updater.start_polling()
-        logger.info("Бот успешно запущен в режиме polling")
-    
+    """
+    Управляет жизненным циклом: сервер отвечает сразу, бот запускается в фоне
+    и останавливается вместе с FastAPI.
+    """
+    init_task = asyncio.create_task(_initialize_bot())
+
     yield
-    
-    logger.info("Остановка Telegram-бота...")
-    try:
-        if ptb_app.updater:
-            await ptb_app.updater.stop()
-        await ptb_app.stop()
-        await ptb_app.shutdown()
-        logger.info("Бот успешно остановлен")
-    except Exception as e:
-        logger.error(f"Ошибка при остановке бота: {e}", exc_info=True)
+
+    if not init_task.done():
+        init_task.cancel()
+        try:
+            await init_task
+        except asyncio.CancelledError:
+            pass
+    if runtime is not None:
+        await runtime.stop_bot()
 
 # Создаем FastAPI приложение
 app = FastAPI(
@@ -85,47 +89,60 @@ app = FastAPI(
 
 @app.post("/webhook")
 async def webhook(request: Request):
-    """Эндпоинт для получения обновлений от Telegram через вебхук."""
+    """
+    Эндпоинт для получения обновлений от Telegram через вебхук. Обновление только
+    проверяется и ставится в очередь приложения — ответ уходит сразу, не дожидаясь
+    OCR и записи в таблицу. Пока бот запускается, запрос ждёт его не дольше
+    settings.webhook_startup_wait секунд, затем отвечает 503, и Telegram повторит доставку.
+    """
+    if settings.telegram_webhook_secret:
+        secret = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+        if not hmac.compare_digest(secret, settings.telegram_webhook_secret):
+            logger.warning("Вебхук: запрос с неверным секретным токеном отклонён")
+            return JSONResponse(status_code=403, content={"status": "forbidden"})
+    if not bot_ready.is_set():
+        try:
+            await asyncio.wait_for(bot_ready.wait(), timeout=settings.webhook_startup_wait)
+        except asyncio.TimeoutError:
+            return JSONResponse(status_code=503, content={"status": "starting"})
     try:
         data = await request.json()
-        update = Update.de_json(data, ptb_app.bot)
-        await ptb_app.process_update(update)
-        return {"status": "ok"}
+        await runtime.enqueue_update(data)
     except Exception as e:
-        logger.error(f"Ошибка обработки вебхука: {e}")
+        logger.error(f"Ошибка разбора обновления из вебхука: {e}")
         return {"status": "error", "message": str(e)}
+    return {"status": "ok"}
 
 @app.get("/", summary="Статус бота")
 async def read_root():
     """Корневой эндпоинт для проверки, что веб-сервер запущен."""
-    try:
-        webhook_info = await ptb_app.bot.get_webhook_info()
+    if not bot_ready.is_set():
         return {
-            "status": "Bot is running via FastAPI",
-            "webhook_url": webhook_info.url,
-            "webhook_set": bool(webhook_info and webhook_info.url),
-            "pending_updates": webhook_info.pending_update_count if webhook_info else 0
+            "status": "Bot failed to start" if startup_error else "Bot is starting",
+            "error": startup_error,
+            "startup": startup_timer.get_report(),
         }
+    try:
+        return await runtime.get_status()
     except Exception as e:
         logger.error(f"Ошибка получения информации о вебхуке: {e}")
         return {"status": "Bot is running", "error": str(e)}
 
 @app.get("/health", summary="Проверка здоровья сервиса")
 def health_check():
-    """Эндпоинт для систем мониторинга."""
-    return {"status": "healthy"}
+    """Эндпоинт для систем мониторинга. Отвечает сразу, не дожидаясь запуска бота."""
+    return {"status": "healthy", "bot_ready": bot_ready.is_set()}
 
 @app.get("/set_webhook", summary="Установить вебхук вручную")
 async def set_webhook_manual():
     """Эндпоинт для ручной установки вебхука (для отладки)."""
+    if not bot_ready.is_set():
+        return {"status": "error", "message": "Бот ещё запускается"}
     try:
-        webhook_url = os.getenv("RENDER_EXTERNAL_URL", "") + "/webhook"
-        if webhook_url and not webhook_url.startswith("http"):
-            webhook_url = f"https://{webhook_url}"
-        
-        result = await ptb_app.bot.set_webhook(webhook_url)
+        webhook_url = runtime.get_webhook_url()
+        result = await runtime.set_webhook(webhook_url)
         return {
-            "status": "webhook_set", 
+            "status": "webhook_set",
             "url": webhook_url,
             "success": result
         }
@@ -136,4 +153,4 @@ async def set_webhook_manual():
 # Если файл запускается напрямую (для локальной разработки)
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
+    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)